@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from app.api.user_queries import user_queries_router
+from app.api.metrics import metrics_router
 
 router = APIRouter()
 
@@ -7,3 +8,4 @@ router = APIRouter()
 router.include_router(
     user_queries_router, prefix="/user_queries", tags=["User Queries"]
 )
+router.include_router(metrics_router, prefix="/metrics", tags=["Metrics"])
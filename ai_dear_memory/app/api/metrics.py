@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Query
+from app.services import cost_accounting, metrics
+
+metrics_router = APIRouter(prefix="", tags=["Metrics"])
+
+
+@metrics_router.get("")
+async def get_metrics():
+    """
+    API endpoint exposing the application's counters and gauges.
+
+    Returns:
+        dict: Metric name to current value.
+    """
+    return metrics.snapshot()
+
+
+@metrics_router.get("/costs")
+async def get_costs(
+    user_id: int | None = Query(None, description="Only report this user"),
+    top_users: int = Query(10, description="Number of users reported, by Gemini tokens"),
+):
+    """
+    API endpoint rolling up the external calls, Gemini tokens and index units
+    used per endpoint and per user.
+
+    Returns:
+        dict: Requests, totals and per-request averages per endpoint and user.
+    """
+    return cost_accounting.snapshot(user_id=user_id, top_users=top_users)
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Header, Query, Response
 from fastapi.responses import JSONResponse
+from app.core.config import settings
 from app.schemas.embeddings import EmbeddingRequest, SaveMemoryResponse
+from app.schemas.save_jobs import SaveJobAccepted, SaveJobStatus
 from app.schemas.rename_delete_location import (
     RenameLocationRequest,
     DeleteLocationRequest,
@@ -10,6 +12,8 @@ from app.services.renaming_location import update_memory
 from app.services.insert_and_delete import insert_delete
 from app.services.deleting_locations import delete_loc_and_items
 from app.services.utils import remove_dear_memory_prefix
+from app.services import cost_accounting, memory_versions, metrics
+from app.services.job_queue import QueueFullError, enqueue_save, get_job
 
 user_queries_router = APIRouter(prefix="", tags=["User Queries"])
 
@@ -24,14 +28,43 @@ async def save_embedding(data: EmbeddingRequest):
 
     Returns:
         SaveMemoryResponse: A response containing the success message and items.
+        With ASYNC_SAVE enabled, a 202 response with the ID of the queued job.
 
     Raises:
         HTTPException: If an error occurs during the save operation.
     """
+    cost_accounting.set_user(data.user_id)
     try:
         data.text = remove_dear_memory_prefix(data.text.strip())
-        result = await insert_delete(data)
-        return result
+        if not settings.ASYNC_SAVE:
+            result = await insert_delete(data)
+            return result
+
+        if not data.text:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "status": 400,
+                    "error": "Validation Error",
+                    "message": "Invalid request body.",
+                },
+            )
+        try:
+            job_id = await enqueue_save(data)
+        except QueueFullError as e:
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": "5"},
+                content={"status": 503, "error": str(e)},
+            )
+        return JSONResponse(
+            status_code=202,
+            content=SaveJobAccepted(
+                status=202,
+                job_id=job_id,
+                status_url=f"/user_queries/save/{job_id}?user_id={data.user_id}",
+            ).model_dump(),
+        )
     except Exception as e:
         print(e)
         return JSONResponse(
@@ -43,17 +76,58 @@ async def save_embedding(data: EmbeddingRequest):
         )
 
 
+@user_queries_router.get("/save/{job_id}", response_model=SaveJobStatus)
+async def save_job_status(
+    job_id: str,
+    user_id: int = Query(..., description="The unique identifier for the user"),
+):
+    """
+    API endpoint to poll a background save job.
+
+    Args:
+        job_id (str): The job ID returned by /save.
+        user_id (int): The unique identifier for the user who submitted the job.
+
+    Returns:
+        SaveJobStatus: The job status and, once finished, the save result and its status code.
+    """
+    cost_accounting.set_user(user_id)
+    try:
+        job = await get_job(job_id)
+        if job is None or job["user_id"] != user_id:
+            return JSONResponse(
+                status_code=404,
+                content={"status": 404, "error": "Save job not found."},
+            )
+        return job
+    except Exception as e:
+        print(e)
+        return JSONResponse(
+            status_code=500,
+            content={
+                "status": 500,
+                "error": "An unexpected error occurred while reading the save job",
+            },
+        )
+
+
 @user_queries_router.get("/retrieve")
 async def retrieve_memory(
     user_id: int = Query(..., description="The unique identifier for the user"),
     text: str = Query(..., description="The text query for embedding retrieval"),
+    if_none_match: str | None = Header(None),
 ):
     """
     API endpoint to retrieve the best matching text embedding based on a given query from a user.
 
+    Successful answers carry an ETag built from the user's memory version and
+    the query; a request sending it in If-None-Match gets 304 Not Modified
+    until the user's memories change.
+
     Args:
         user_id (int): The unique identifier for the user.
         text (str): The text query for embedding retrieval.
+        if_none_match (str | None): ETags of answers the client already has.
 
     Returns:
         JSONResponse: The most relevant text embedding from the user's memory.
@@ -61,11 +135,35 @@ async def retrieve_memory(
     Raises:
         HTTPException: If an error occurs during the retrieval process.
     """
+    cost_accounting.set_user(user_id)
     try:
         text = remove_dear_memory_prefix(text.strip())
 
+        tag = None
+        if settings.CONDITIONAL_RETRIEVE:
+            try:
+                version = await memory_versions.settled_version(user_id)
+                if version is not None:
+                    tag = memory_versions.etag(user_id, version, text)
+            except Exception as e:
+                print(f"Error reading memory version: {e}")
+        cache_headers = (
+            {"ETag": tag, "Cache-Control": settings.RETRIEVE_CACHE_CONTROL} if tag else {}
+        )
+        if tag and memory_versions.matches(if_none_match, tag):
+            metrics.increment("retrieve_not_modified")
+            return Response(status_code=304, headers=cache_headers)
+
         data = EmbeddingRequest(user_id=user_id, text=text)
         result = await smart_retrieval(data)
+        # Only complete answers are tagged; one degraded by a failing call
+        # must not be served again once the dependency is back
+        if (
+            tag
+            and getattr(result, "status_code", 200) == 200
+            and not cost_accounting.had_failures()
+        ):
+            result.headers.update(cache_headers)
         return result
     except Exception:
         return JSONResponse(
@@ -91,7 +189,7 @@ async def renaming_location(request: RenameLocationRequest):
     Raises:
         HTTPException: If an error occurs during the rename operation.
     """
-
+    cost_accounting.set_user(request.user_id)
     try:
         response = await update_memory(
             request.user_id,
@@ -125,6 +223,7 @@ async def delete_location_and_items(request: DeleteLocationRequest):
     Raises:
         HTTPException: If an error occurs during the delete operation.
     """
+    cost_accounting.set_user(request.user_id)
     try:
         response = await delete_loc_and_items(
             request.user_id,
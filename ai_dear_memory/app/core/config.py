@@ -1,6 +1,7 @@
 import google.generativeai as genai
 from pydantic_settings import BaseSettings
 from pinecone import Pinecone, ServerlessSpec
+from app.core.local_index import LocalIndex
 
 
 class Settings(BaseSettings):
@@ -11,6 +12,14 @@ class Settings(BaseSettings):
     DB_PORT: int
     DB_NAME: str
 
+    # Vector index backend: "pinecone" or "local" (in-process, for development
+    # and offline benchmarks)
+    VECTOR_BACKEND: str = "pinecone"
+    # Snapshot directory of the local index: memory-mapped at startup and
+    # rewritten at shutdown, unless another worker rewrote it first (see
+    # app.core.index_snapshot). Empty disables.
+    LOCAL_INDEX_SNAPSHOT: str = ""
+
     # Pinecone Config
     PINECONE_API_KEY: str
     INDEX_NAME: str = "dear-memory-project-index"
@@ -18,8 +27,183 @@ class Settings(BaseSettings):
     PINECONE_CLOUD: str = "aws"
     PINECONE_REGION: str = "us-east1"
 
+    # Embedding model of new vectors; each vector records the model and
+    # dimension it was embedded with. To switch models, set the new model here
+    # and the old one as EMBEDDING_PREVIOUS_MODEL: similarity queries then read
+    # both generations, each with its own query embedding, while
+    # app.services.reembedding rewrites the old vectors. Clear it afterwards.
+    # Both models must produce INDEX_DIMENSION values.
+    EMBEDDING_MODEL: str = "models/gemini-embedding-exp-03-07"
+    EMBEDDING_PREVIOUS_MODEL: str = ""
+
+    # Hybrid sparse-dense retrieval. Pinecone only supports sparse values on
+    # dotproduct indexes, so INDEX_NAME must point to a dotproduct index when
+    # this is enabled.
+    HYBRID_SEARCH: bool = False
+    HYBRID_ALPHA: float = 0.75  # 1.0 = dense only, 0.0 = sparse only
+
+    # Matches of the single query used to enumerate a user's memories (all of
+    # them, or those in a location). Users with more are enumerated by listing
+    # their per-user namespace, or with queries over savedAt ranges in shared
+    # and bucket namespaces. At most 1000, Pinecone's top_k limit.
+    SCAN_PAGE_SIZE: int = 1000
+
+    # Namespace layout: "shared" (one namespace, filtered by userId), "user"
+    # (one namespace per user) or "bucket" (users hashed into NAMESPACE_BUCKETS
+    # namespaces). Keep NAMESPACE_DUAL_READ on while namespace_migration copies
+    # existing memories out of the shared namespace.
+    NAMESPACE_LAYOUT: str = "shared"
+    NAMESPACE_BUCKETS: int = 64
+    NAMESPACE_DUAL_READ: bool = False
+
+    # Merge each user's upserts and deletes of the last WRITE_OVERLAY_SECONDS
+    # into their queries and fetches, so reads right after a write see it
+    # while the index is catching up (0 disables).
+    WRITE_OVERLAY_SECONDS: float = 10.0
+
+    # Database for app-owned state such as the background job queue
+    STATE_DATABASE_URL: str = "sqlite:///./dear_memory_state.db"
+
+    # Background /save jobs. With ASYNC_SAVE, /save enqueues the request and
+    # returns 202 with a job ID that can be polled for the result.
+    ASYNC_SAVE: bool = False
+    SAVE_WORKERS: int = 4
+    SAVE_QUEUE_MAX_DEPTH: int = 1000
+    SAVE_QUEUE_MAX_PER_USER: int = 20
+    SAVE_JOB_MAX_ATTEMPTS: int = 3
+    SAVE_QUEUE_POLL_SECONDS: float = 0.5
+    # Running jobs hold a lease renewed by their worker; jobs whose worker
+    # stopped renewing it for this long are requeued by any process.
+    SAVE_JOB_LEASE_SECONDS: float = 60.0
+    # Finished jobs hold the users' texts and results; they are deleted this
+    # long after they finished (0 keeps them).
+    SAVE_JOB_RETENTION_SECONDS: float = 86400.0
+
+    # Materialized location -> items view in the state database, updated on
+    # every write and used to answer location listings. Users are copied in
+    # from the index in the background the first time they list a location.
+    LOCATION_VIEW: bool = True
+
+    # Per-user memory quotas and compaction. Every MAINTENANCE_INTERVAL_SECONDS
+    # (0 disables), users who saved since the last run are compacted: entries
+    # for the same item (names at least COMPACTION_NAME_MIN_SCORE similar) are
+    # merged into the latest one. Users still above MEMORY_QUOTA_PER_USER
+    # memories (0 = unlimited) then lose the "oldest" or "least_retrieved" ones.
+    MEMORY_QUOTA_PER_USER: int = 0
+    QUOTA_EVICTION: str = "oldest"
+    COMPACTION_NAME_MIN_SCORE: float = 1.0
+    MAINTENANCE_INTERVAL_SECONDS: float = 0.0
+    MAINTENANCE_USERS_PER_SECOND: float = 5.0
+
+    # Deadlines and hedging for external calls. Every Gemini and index call made
+    # while serving a request must finish within REQUEST_DEADLINE_SECONDS of the
+    # request start (0 disables). With HEDGING, idempotent reads (index queries
+    # and fetches, embeddings) that run past their recent HEDGE_PERCENTILE
+    # latency are duplicated and the first answer wins.
+    REQUEST_DEADLINE_SECONDS: float = 20.0
+    LLM_TIMEOUT_SECONDS: float = 30.0
+    HEDGING: bool = False
+    HEDGE_PERCENTILE: float = 0.95
+    HEDGE_MIN_DELAY_SECONDS: float = 0.05
+    HEDGE_MIN_SAMPLES: int = 20
+    HEDGE_WINDOW: int = 200
+
+    # Thread pools running the blocking SDK calls, one per dependency so slow
+    # chat calls cannot starve index reads. Calls that wait longer than
+    # EXECUTOR_QUEUE_WAIT_ALERT_SECONDS for a thread are reported as saturation.
+    INDEX_THREADS: int = 32
+    EMBEDDING_THREADS: int = 16
+    CHAT_THREADS: int = 32
+    EXECUTOR_QUEUE_WAIT_ALERT_SECONDS: float = 0.1
+
+    # Circuit breakers around the Gemini chat, function-calling and embedding
+    # clients. While a breaker is open, requests use local fallbacks (keyword
+    # intent routing, regex extraction, exact name lookups and template
+    # responses) instead of waiting on Gemini.
+    CIRCUIT_BREAKERS: bool = True
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_SECONDS: float = 30.0
+
+    # Cost accounting. External calls, Gemini tokens and index read units are
+    # added up per request and rolled up per endpoint and per user (the
+    # COST_TRACKED_USERS most recently active) at GET /metrics/costs. With
+    # COST_DEBUG_HEADER, responses carry their figures in X-Request-Cost.
+    COST_DEBUG_HEADER: bool = False
+    COST_TRACKED_USERS: int = 10000
+
+    # Warm-up on startup: open WARMUP_CONNECTIONS index connections, probe the
+    # Gemini clients, build the prompt chains and load the name index and
+    # location view of the WARMUP_HOT_USERS users most recently active before
+    # the last shutdown. GET /ready answers 503 until the warm-up is done or
+    # WARMUP_TIMEOUT_SECONDS have passed.
+    WARMUP: bool = True
+    WARMUP_CONNECTIONS: int = 4
+    WARMUP_HOT_USERS: int = 0
+    WARMUP_TIMEOUT_SECONDS: float = 30.0
+
+    # Append every /user_queries request to this JSON lines file so it can be
+    # replayed with benchmarks/load_test.py. Empty disables recording.
+    TRAFFIC_TRACE_PATH: str = ""
+
     # Gemini AI Config
     GEMINI_API_KEY: str
+    CHAT_MODEL: str = "gemini-2.0-flash"
+
+    # Cache the static system messages of all prompts together, one section
+    # per prompt, as Gemini cached content for PROMPT_CACHE_TTL_SECONDS, so
+    # calls only send the variable part and the name of their section. Gemini
+    # rejects caches below a model-specific size; if all sections together
+    # stay below PROMPT_CACHE_MIN_TOKENS tokens, prompts are sent as is.
+    PROMPT_CACHING: bool = False
+    PROMPT_CACHE_TTL_SECONDS: int = 3600
+    PROMPT_CACHE_MIN_TOKENS: int = 4096
+
+    # Insert pipeline
+    # When enabled, a save runs a single structured-extraction call that returns
+    # every item/location pair and the success message. Disable it to fall back
+    # to the ITEM_SEPARATION -> EXTRACTION_PROMPT -> AI_OUTPUT_PROMPT chain.
+    STRUCTURED_EXTRACTION: bool = True
+    # Start phrasing the success message while extraction is still running
+    # (multi-call pipeline only; the structured call already returns it).
+    SPECULATIVE_SUCCESS_MESSAGE: bool = False
+    # Separate and embed a saved text while its intent is still being
+    # classified; the work is discarded if the text turns out to be a delete.
+    SPECULATIVE_INSERT: bool = False
+
+    # Typo-tolerant item/location matching
+    # Names typed by the user are matched against the user's stored item and
+    # location names before falling back to an embedding query. Deletions
+    # never use a close name in place of the typed one; they suggest it.
+    FUZZY_MATCHING: bool = True
+    FUZZY_MATCH_MIN_SCORE: float = 0.75  # treat as the same name
+    FUZZY_SUGGEST_MIN_SCORE: float = 0.5  # offer as a similar name
+    NAME_INDEX_TTL_SECONDS: int = 300
+    NAME_INDEX_MAX_USERS: int = 10000  # least recently used users are dropped
+
+    # Similar-name suggestions for items and locations that are not found.
+    # Tune with benchmarks/retrieval_eval.py.
+    SIMILAR_ITEM_MIN_SCORE: float = 0.65
+    SIMILAR_LOCATION_MIN_SCORE: float = 0.70
+    DELETE_SIMILAR_LOCATION_MIN_SCORE: float = 0.75
+    SIMILAR_TOP_K: int = 3
+
+    # Keep the result of item and location lookups that found nothing, with
+    # their suggestions, for NEGATIVE_CACHE_TTL_SECONDS (0 disables). Entries
+    # are tied to the user's memory version, so any write makes them stale.
+    NEGATIVE_CACHE_TTL_SECONDS: float = 60.0
+    NEGATIVE_CACHE_MAX_ENTRIES: int = 10000
+
+    # Conditional GETs of /user_queries/retrieve. Answers carry an ETag made
+    # of the user's memory version (increased by every write) and the query;
+    # If-None-Match with a current ETag is answered 304 without recomputing.
+    # Answers within WRITE_OVERLAY_SECONDS of the user's last write are not
+    # tagged, as the index may not show that write to every process yet.
+    CONDITIONAL_RETRIEVE: bool = True
+    RETRIEVE_CACHE_CONTROL: str = "private, no-cache"
+
+    @property
+    def index_metric(self) -> str:
+        return "dotproduct" if self.HYBRID_SEARCH else "cosine"
 
     @property
     def mysql_uri(self) -> str:
@@ -35,21 +219,31 @@ settings = Settings()
 
 genai.configure(api_key=settings.GEMINI_API_KEY)
 
-# Initialize Pinecone
-pinecone_client = Pinecone(api_key=settings.PINECONE_API_KEY)
+# Vectors file of the snapshot the local index started from ("" for none),
+# so the export at shutdown does not replace one written meanwhile
+local_snapshot_base: str | None = None
+
+if settings.VECTOR_BACKEND == "local":
+    index = LocalIndex(settings.INDEX_DIMENSION, metric=settings.index_metric)
+    if settings.LOCAL_INDEX_SNAPSHOT:
+        index.load_snapshot(settings.LOCAL_INDEX_SNAPSHOT)
+        local_snapshot_base = index.snapshot.manifest["vectors"] if index.snapshot else ""
+else:
+    # Initialize Pinecone
+    pinecone_client = Pinecone(api_key=settings.PINECONE_API_KEY)
 
-existing_indexes = [index["name"] for index in pinecone_client.list_indexes()]
+    existing_indexes = [index["name"] for index in pinecone_client.list_indexes()]
 
-# Check and create index only if needed
-if settings.INDEX_NAME not in existing_indexes:
-    pinecone_client.create_index(
-        name=settings.INDEX_NAME,
-        dimension=settings.INDEX_DIMENSION,
-        metric="cosine",
-        spec=ServerlessSpec(
-            cloud=settings.PINECONE_CLOUD, region=settings.PINECONE_REGION
-        ),
-    )
+    # Check and create index only if needed
+    if settings.INDEX_NAME not in existing_indexes:
+        pinecone_client.create_index(
+            name=settings.INDEX_NAME,
+            dimension=settings.INDEX_DIMENSION,
+            metric=settings.index_metric,
+            spec=ServerlessSpec(
+                cloud=settings.PINECONE_CLOUD, region=settings.PINECONE_REGION
+            ),
+        )
 
-# Connect to Pinecone index
-index = pinecone_client.Index(settings.INDEX_NAME)
+    # Connect to Pinecone index
+    index = pinecone_client.Index(settings.INDEX_NAME)
@@ -0,0 +1,376 @@
+"""
+On-disk snapshots of a vector index, memory-mapped by the local backend.
+
+A snapshot is a directory holding:
+- vectors-<id>.f32: every vector as contiguous float32 rows, grouped by
+  namespace and by user, so one user's vectors are adjacent pages;
+- columns-<id>.json: the ids, metadata fields and sparse values as one list
+  per column, in row order;
+- manifest.json: dimension, metric, the file names and the offset table
+  giving the first row and row count of each user in each namespace.
+
+The local index opens a snapshot with mmap instead of loading it: vector rows
+are read-only views of the file, so a cold start only reads the columns, and
+every worker process on a host shares one page-cache copy of the vectors.
+Vectors written afterwards replace their row in the process's index only.
+Writing a snapshot creates new data files and then replaces the manifest, so
+a snapshot can be rewritten while processes have it open. Writers hold a lock
+file in the directory, so two of them cannot interleave; a writer given the
+data files it started from leaves a snapshot that another process replaced
+meanwhile alone.
+
+Usage (from the ai_dear_memory directory), to export the configured index
+(Pinecone or local) and to summarize a snapshot:
+    python -m app.core.index_snapshot export snapshots/index
+    python -m app.core.index_snapshot info snapshots/index
+"""
+
+import os
+import sys
+import json
+import mmap
+import uuid
+import argparse
+import tempfile
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized
+    fcntl = None
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+LOCK_FILE = ".lock"
+NO_USER = ""  # offset table key of vectors without a userId
+
+
+class SnapshotChanged(RuntimeError):
+    """Raised when a snapshot was replaced since the writer's base was read."""
+
+
+@contextmanager
+def _locked(path: str):
+    with open(os.path.join(path, LOCK_FILE), "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _user_key(metadata: dict) -> str:
+    user_id = metadata.get("userId")
+    if user_id is None:
+        return NO_USER
+    if isinstance(user_id, float) and user_id.is_integer():
+        user_id = int(user_id)  # Pinecone returns metadata numbers as floats
+    return str(user_id)
+
+
+def _plain_sparse_values(sparse_values) -> dict | None:
+    if not sparse_values:
+        return None
+    return {
+        "indices": list(sparse_values["indices"]),
+        "values": list(sparse_values["values"]),
+    }
+
+
+class SnapshotWriter:
+    """
+    Write a snapshot one vector at a time. Rows are spooled to a temporary
+    file in arrival order and regrouped by namespace and user on close, so
+    memory use does not grow with the vectors.
+    """
+
+    def __init__(self, path: str, dimension: int, metric: str = "cosine"):
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        os.makedirs(path, exist_ok=True)
+        self._spool = tempfile.TemporaryFile(dir=path)
+        self._rows = []  # (namespace, user key, id, metadata, sparse values)
+
+    def add(
+        self,
+        namespace: str,
+        vector_id: str,
+        values,
+        metadata: dict | None = None,
+        sparse_values: dict | None = None,
+    ) -> None:
+        row = array("f", values)
+        if len(row) != self.dimension:
+            raise ValueError(
+                f"Vector {vector_id} has {len(row)} values, expected {self.dimension}"
+            )
+        row.tofile(self._spool)
+        metadata = dict(metadata or {})
+        self._rows.append(
+            (
+                namespace,
+                _user_key(metadata),
+                vector_id,
+                metadata,
+                _plain_sparse_values(sparse_values),
+            )
+        )
+
+    def close(self, base: str | None = None) -> dict:
+        """
+        Write the data files and the manifest.
+
+        Args:
+            base (str | None): The vectors file of the snapshot the rows were
+                read from ("" for none). If the snapshot was replaced since,
+                nothing is written. None writes unconditionally.
+
+        Returns:
+            dict: The manifest.
+
+        Raises:
+            SnapshotChanged: If the snapshot is no longer `base`.
+        """
+        try:
+            with _locked(self.path):
+                return self._write(base)
+        finally:
+            self._spool.close()
+
+    def _write(self, base: str | None) -> dict:
+        previous = _read_manifest(self.path)
+        current = previous["vectors"] if previous else ""
+        if base is not None and current != base:
+            raise SnapshotChanged(
+                f"Snapshot {self.path} was replaced since it was read ({current})"
+            )
+        order = sorted(
+            range(len(self._rows)), key=lambda i: (self._rows[i][0], self._rows[i][1])
+        )
+        name = uuid.uuid4().hex[:12]
+        vectors_file, columns_file = f"vectors-{name}.f32", f"columns-{name}.json"
+        row_bytes = self.dimension * array("f").itemsize
+
+        self._spool.flush()
+        namespaces = defaultdict(lambda: {"users": {}})
+        with open(os.path.join(self.path, vectors_file), "wb") as out:
+            for position, i in enumerate(order):
+                self._spool.seek(i * row_bytes)
+                out.write(self._spool.read(row_bytes))
+                namespace, user, *_ = self._rows[i]
+                users = namespaces[namespace]["users"]
+                start, count = users.get(user, (position, 0))
+                users[user] = (start, count + 1)
+
+        fields = sorted({key for i in order for key in self._rows[i][3]})
+        columns = {
+            "id": [self._rows[i][2] for i in order],
+            "metadata": {
+                field: [self._rows[i][3].get(field) for i in order] for field in fields
+            },
+            "sparse_values": [self._rows[i][4] for i in order],
+        }
+        with open(os.path.join(self.path, columns_file), "w") as f:
+            json.dump(columns, f)
+
+        manifest = {
+            "format": FORMAT_VERSION,
+            "dimension": self.dimension,
+            "metric": self.metric,
+            "byteorder": sys.byteorder,
+            "count": len(order),
+            "vectors": vectors_file,
+            "columns": columns_file,
+            "namespaces": namespaces,
+        }
+        tmp_path = os.path.join(self.path, f"{MANIFEST}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST))
+        if previous:
+            for old in (previous["vectors"], previous["columns"]):
+                try:
+                    os.remove(os.path.join(self.path, old))
+                except OSError:
+                    pass  # still mapped on platforms that forbid removing it
+        return manifest
+
+
+def _read_manifest(path: str) -> dict | None:
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class Snapshot:
+    """
+    A memory-mapped snapshot. Rows are zero-copy float32 views of the file;
+    they stay valid until close().
+    """
+
+    def __init__(self, path: str):
+        manifest = _read_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No index snapshot in {path}")
+        if manifest["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {manifest['format']}")
+        self.path = path
+        self.manifest = manifest
+        self.dimension = manifest["dimension"]
+        self.metric = manifest["metric"]
+        self.count = manifest["count"]
+        with open(os.path.join(path, manifest["columns"])) as f:
+            self.columns = json.load(f)
+
+        self._map = None
+        if not self.count:
+            self._values = array("f")
+        elif manifest["byteorder"] != sys.byteorder:
+            # Foreign byte order: the rows have to be converted in memory
+            self._values = array("f")
+            with open(os.path.join(path, manifest["vectors"]), "rb") as f:
+                self._values.fromfile(f, self.count * self.dimension)
+            self._values.byteswap()
+        else:
+            with open(os.path.join(path, manifest["vectors"]), "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._values = memoryview(self._map).cast("f")
+
+    def row(self, position: int) -> memoryview:
+        start = position * self.dimension
+        return memoryview(self._values)[start : start + self.dimension]
+
+    def metadata(self, position: int) -> dict:
+        return {
+            field: values[position]
+            for field, values in self.columns["metadata"].items()
+            if values[position] is not None
+        }
+
+    def user_rows(self, user_id, namespace: str = "") -> range:
+        """Row positions of one user's vectors in a namespace."""
+        users = self.manifest["namespaces"].get(namespace, {}).get("users", {})
+        start, count = users.get(str(user_id), (0, 0))
+        return range(start, start + count)
+
+    def records(self):
+        """Yield (namespace, id, values, metadata, sparse values) for every row."""
+        for namespace, entry in self.manifest["namespaces"].items():
+            for start, count in entry["users"].values():
+                for position in range(start, start + count):
+                    yield (
+                        namespace,
+                        self.columns["id"][position],
+                        self.row(position),
+                        self.metadata(position),
+                        self.columns["sparse_values"][position],
+                    )
+
+    def close(self) -> None:
+        """Unmap the vectors. Left mapped while rows are still referenced."""
+        if self._map is None:
+            return
+        try:
+            self._values.release()
+            self._map.close()
+        except BufferError:
+            return
+        self._map = None
+
+
+def export(
+    index,
+    path: str,
+    dimension: int,
+    metric: str,
+    batch_size: int = 100,
+    base: str | None = None,
+) -> dict:
+    """
+    Write a snapshot of every namespace of a live index, through the index
+    API shared by Pinecone and the local backend.
+
+    Args:
+        index: The Pinecone or local index.
+        path (str): The snapshot directory.
+        dimension (int): The index dimension.
+        metric (str): The index metric.
+        batch_size (int): Vectors listed and fetched per call.
+        base (str | None): Only replace the snapshot if its vectors file is
+            still this one ("" for no snapshot); see SnapshotWriter.close.
+
+    Returns:
+        dict: The manifest of the written snapshot.
+
+    Raises:
+        SnapshotChanged: If the snapshot is no longer `base`.
+    """
+    writer = SnapshotWriter(path, dimension, metric)
+    for namespace in index.describe_index_stats().namespaces:
+        token = None
+        while True:
+            page = index.list_paginated(
+                limit=batch_size, pagination_token=token, namespace=namespace
+            )
+            ids = [vector.id for vector in page.vectors]
+            if ids:
+                fetched = index.fetch(ids=ids, namespace=namespace)
+                for vector_id, vector_data in fetched.vectors.items():
+                    writer.add(
+                        namespace,
+                        vector_id,
+                        vector_data["values"],
+                        dict(vector_data["metadata"] or {}),
+                        vector_data.get("sparse_values"),
+                    )
+            token = page.pagination.next if page.pagination else None
+            if not token:
+                break
+    return writer.close(base)
+
+
+def info(path: str) -> None:
+    snapshot = Snapshot(path)
+    manifest = snapshot.manifest
+    print(
+        f"{snapshot.count} vectors of dimension {snapshot.dimension} ({snapshot.metric}), "
+        f"{snapshot.count * snapshot.dimension * 4 / 2**20:.1f} MB mapped"
+    )
+    for namespace, entry in sorted(manifest["namespaces"].items()):
+        counts = sorted((count for _, count in entry["users"].values()), reverse=True)
+        print(
+            f"namespace {namespace or '(shared)'}: {sum(counts)} vectors, "
+            f"{len(counts)} users, largest {counts[0] if counts else 0}"
+        )
+    snapshot.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--batch-size", type=int, default=100)
+    commands.add_parser("info").add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from app.core.config import index, settings
+
+        manifest = export(
+            index,
+            args.path,
+            settings.INDEX_DIMENSION,
+            settings.index_metric,
+            batch_size=args.batch_size,
+        )
+        print(f"Exported {manifest['count']} vectors to {args.path}")
+    else:
+        info(args.path)
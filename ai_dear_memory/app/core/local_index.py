@@ -0,0 +1,235 @@
+import os
+import math
+import threading
+from array import array
+from app.core.index_snapshot import MANIFEST, Snapshot
+
+
+class Record(dict):
+    """Dict that also allows attribute access, like Pinecone response objects."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError as e:
+            raise AttributeError(name) from e
+
+
+_COMPARATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$exists": lambda value, operand: (value is not None) == operand,
+}
+
+
+def matches_filter(metadata: dict, filter: dict | None) -> bool:
+    """Evaluate a Pinecone metadata filter against a metadata dict."""
+    for key, condition in (filter or {}).items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not _COMPARATORS[operator](value, operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _dot(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def _sparse_dot(a: dict | None, b: dict | None) -> float:
+    if not a or not b:
+        return 0.0
+    weights = dict(zip(a["indices"], a["values"]))
+    return sum(weights.get(i, 0.0) * v for i, v in zip(b["indices"], b["values"]))
+
+
+class LocalIndex:
+    """
+    In-process vector index implementing the subset of the Pinecone index API
+    used by the app: query, upsert, update, delete and fetch, with metadata
+    filters, namespaces and sparse-dense (hybrid) scoring. It can start from a
+    memory-mapped snapshot (see app.core.index_snapshot).
+    """
+
+    def __init__(self, dimension: int, metric: str = "cosine"):
+        self.dimension = dimension
+        self.metric = metric
+        # namespace -> {id: (float32 values, sparse_values, metadata)}; the
+        # values of vectors loaded from a snapshot are views of its file
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self.snapshot: Snapshot | None = None
+
+    def load_snapshot(self, path: str) -> bool:
+        """
+        Serve the vectors of a snapshot, mapped from disk rather than copied.
+
+        Returns:
+            bool: False when the directory holds no snapshot yet.
+        """
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            return False
+        snapshot = Snapshot(path)
+        if snapshot.dimension != self.dimension:
+            raise ValueError(
+                f"Snapshot {path} has dimension {snapshot.dimension}, "
+                f"the index {self.dimension}"
+            )
+        if snapshot.metric != self.metric:
+            raise ValueError(
+                f"Snapshot {path} has metric {snapshot.metric}, the index {self.metric}"
+            )
+        with self._lock:
+            for namespace, vector_id, values, metadata, sparse_values in snapshot.records():
+                self._namespaces.setdefault(namespace, {})[vector_id] = (
+                    values,
+                    sparse_values,
+                    metadata,
+                )
+            self.snapshot = snapshot
+        return True
+
+    def _score(self, vector, sparse_vector, values, sparse_values) -> float:
+        dense = _dot(vector, values)
+        if self.metric == "cosine":
+            norm = math.sqrt(_dot(vector, vector) * _dot(values, values))
+            dense = dense / norm if norm else 0.0
+        return dense + _sparse_dot(sparse_vector, sparse_values)
+
+    def query(
+        self,
+        vector,
+        top_k: int,
+        filter: dict | None = None,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        sparse_vector: dict | None = None,
+        namespace: str = "",
+        **kwargs,
+    ) -> Record:
+        with self._lock:
+            entries = list(self._namespaces.get(namespace, {}).items())
+
+        matches = []
+        for vector_id, (values, sparse_values, metadata) in entries:
+            if not matches_filter(metadata, filter):
+                continue
+            match = Record(
+                id=vector_id,
+                score=self._score(vector, sparse_vector, values, sparse_values),
+            )
+            if include_metadata:
+                match["metadata"] = dict(metadata)
+            if include_values:
+                match["values"] = array("f", values)
+            matches.append(match)
+
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return Record(matches=matches[:top_k], namespace=namespace)
+
+    def upsert(self, vectors: list, namespace: str = "", **kwargs) -> Record:
+        with self._lock:
+            store = self._namespaces.setdefault(namespace, {})
+            for vector in vectors:
+                if isinstance(vector, dict):
+                    store[vector["id"]] = (
+                        array("f", vector["values"]),
+                        vector.get("sparse_values"),
+                        dict(vector.get("metadata") or {}),
+                    )
+                else:
+                    vector_id, values, metadata = vector
+                    store[vector_id] = (array("f", values), None, dict(metadata or {}))
+        return Record(upserted_count=len(vectors))
+
+    def update(
+        self, id: str, set_metadata: dict | None = None, namespace: str = "", **kwargs
+    ) -> Record:
+        with self._lock:
+            store = self._namespaces.get(namespace, {})
+            if id in store:
+                values, sparse_values, metadata = store[id]
+                store[id] = (values, sparse_values, {**metadata, **(set_metadata or {})})
+        return Record()
+
+    def delete(
+        self,
+        ids: list | None = None,
+        delete_all: bool = False,
+        namespace: str = "",
+        **kwargs,
+    ) -> Record:
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+                return Record()
+            store = self._namespaces.get(namespace, {})
+            for vector_id in ids or []:
+                store.pop(vector_id, None)
+        return Record()
+
+    def list_paginated(
+        self,
+        prefix: str | None = None,
+        limit: int = 100,
+        pagination_token: str | None = None,
+        namespace: str = "",
+        **kwargs,
+    ) -> Record:
+        with self._lock:
+            ids = sorted(self._namespaces.get(namespace, {}))
+        if prefix:
+            ids = [vector_id for vector_id in ids if vector_id.startswith(prefix)]
+        if pagination_token:
+            ids = [vector_id for vector_id in ids if vector_id > pagination_token]
+        page = ids[:limit]
+        next_token = page[-1] if len(ids) > limit else None
+        return Record(
+            vectors=[Record(id=vector_id) for vector_id in page],
+            namespace=namespace,
+            pagination=Record(next=next_token) if next_token else None,
+        )
+
+    def describe_index_stats(self, **kwargs) -> Record:
+        with self._lock:
+            namespaces = {
+                namespace: Record(vector_count=len(store))
+                for namespace, store in self._namespaces.items()
+                if store
+            }
+        return Record(
+            dimension=self.dimension,
+            namespaces=namespaces,
+            total_vector_count=sum(ns.vector_count for ns in namespaces.values()),
+        )
+
+    def fetch(self, ids: list, namespace: str = "", **kwargs) -> Record:
+        with self._lock:
+            store = self._namespaces.get(namespace, {})
+            vectors = {}
+            for vector_id in ids:
+                if vector_id in store:
+                    values, sparse_values, metadata = store[vector_id]
+                    vectors[vector_id] = Record(
+                        id=vector_id,
+                        values=array("f", values),
+                        metadata=dict(metadata),
+                    )
+                    if sparse_values:
+                        vectors[vector_id]["sparse_values"] = sparse_values
+        return Record(vectors=vectors, namespace=namespace)
@@ -1,10 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from app.api import router
+from app.core import index_snapshot
+from app.core.config import index, local_snapshot_base, settings
+from app.services import cost_accounting, executors, job_queue, location_view
+from app.services import memory_maintenance, prompt_cache, warmup
+from app.services.traffic_trace import record_request
 
-app = FastAPI(title="dear-memory", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await executors.start()
+    if settings.ASYNC_SAVE:
+        await job_queue.start_workers()
+    await memory_maintenance.start()
+    await location_view.start()
+    await warmup.start()
+    yield
+    await warmup.stop()
+    await job_queue.stop_workers()
+    await memory_maintenance.stop()
+    await location_view.stop()
+    if settings.PROMPT_CACHING:
+        await asyncio.to_thread(prompt_cache.delete_all)
+    if settings.VECTOR_BACKEND == "local" and settings.LOCAL_INDEX_SNAPSHOT:
+        # Only replace the snapshot this process started from: once another
+        # worker has written its own, exporting this one would drop its writes
+        try:
+            await asyncio.to_thread(
+                index_snapshot.export,
+                index,
+                settings.LOCAL_INDEX_SNAPSHOT,
+                settings.INDEX_DIMENSION,
+                settings.index_metric,
+                base=local_snapshot_base,
+            )
+        except index_snapshot.SnapshotChanged as e:
+            print(f"Local index not exported: {e}")
+    await executors.stop()
+
+
+app = FastAPI(title="dear-memory", version="0.1.0", lifespan=lifespan)
 
 # Define allowed origins
 origins = [
@@ -21,12 +61,44 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_traffic(request: Request, call_next):
+    if settings.TRAFFIC_TRACE_PATH and request.url.path.startswith("/user_queries/"):
+        await record_request(request)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def account_costs(request: Request, call_next):
+    if not request.url.path.startswith("/user_queries/"):
+        return await call_next(request)
+    with cost_accounting.request_scope(f"{request.method} (unmatched)") as usage:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            usage.endpoint = f"{request.method} {route.path}"
+    if settings.COST_DEBUG_HEADER:
+        response.headers["X-Request-Cost"] = usage.header_value()
+    return response
+
+
 # Test root endpoint
 @app.get("/")
 async def root():
     return {"message": "Dear Memory fastAPI live"}
 
 
+# Readiness probe: route traffic here only once the warm-up is done
+@app.get("/ready")
+async def ready():
+    if not warmup.is_ready():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": status.HTTP_503_SERVICE_UNAVAILABLE, "error": "Warming up."},
+        )
+    return {"status": status.HTTP_200_OK, "message": "Ready"}
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     message = (
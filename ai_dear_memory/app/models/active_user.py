@@ -0,0 +1,11 @@
+from sqlalchemy import Column, DateTime, Integer
+from app.state_database import StateBase
+
+
+class ActiveUser(StateBase):
+    """Users recently served by an app process, preloaded by the next startup."""
+
+    __tablename__ = "active_users"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    last_seen_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, DateTime, Index, Integer, String
+from app.state_database import StateBase
+
+
+class LocationItem(StateBase):
+    """One memory in the materialized location -> items view."""
+
+    __tablename__ = "location_items"
+    __table_args__ = (Index("ix_location_items_user_location", "user_id", "location"),)
+
+    vector_id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    location = Column(String(255), nullable=False)  # lowercased and stripped
+    item = Column(String(255), nullable=False)
+
+
+class LocationViewUser(StateBase):
+    """Users whose location view holds all of their memories in one index."""
+
+    __tablename__ = "location_view_users"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    built_at = Column(DateTime(timezone=True), nullable=False)
+    index_id = Column(String(64), nullable=True)  # the index the view was built from
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, DateTime, Integer, String
+from app.state_database import StateBase
+
+
+class MemoryUsage(StateBase):
+    """How often each memory was returned by /retrieve, for quota eviction."""
+
+    __tablename__ = "memory_usage"
+
+    vector_id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    retrieval_count = Column(Integer, nullable=False, default=0)
+    last_retrieved_at = Column(DateTime(timezone=True))
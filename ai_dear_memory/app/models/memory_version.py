@@ -0,0 +1,12 @@
+from sqlalchemy import Column, DateTime, Integer
+from app.state_database import StateBase
+
+
+class MemoryVersion(StateBase):
+    """Number of writes to a user's memories, for conditional GETs."""
+
+    __tablename__ = "memory_versions"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False, default=0)
+    written_at = Column(DateTime(timezone=True))  # time of the last write
@@ -0,0 +1,27 @@
+import datetime
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from app.state_database import StateBase
+
+
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class SaveJob(StateBase):
+    __tablename__ = "save_jobs"
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    text = Column(Text, nullable=False)
+    # queued -> running -> succeeded | failed
+    status = Column(String(16), nullable=False, default="queued", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    result_status = Column(Integer)
+    result = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utc_now)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    # Set by the worker running the job, which renews the lease until it
+    # finishes; a running job whose lease expired is requeued
+    claim_id = Column(String(36))
+    lease_expires_at = Column(DateTime(timezone=True))
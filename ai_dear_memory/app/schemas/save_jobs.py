@@ -0,0 +1,16 @@
+from typing import Any, Optional
+from pydantic import BaseModel
+
+
+class SaveJobAccepted(BaseModel):
+    status: int
+    job_id: str
+    status_url: str
+
+
+class SaveJobStatus(BaseModel):
+    job_id: str
+    user_id: int
+    status: str
+    result_status: Optional[int] = None
+    result: Optional[Any] = None
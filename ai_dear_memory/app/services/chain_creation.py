@@ -1,24 +1,103 @@
 import os
-import asyncio
+from google.api_core.exceptions import NotFound
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.output_parsers.json import SimpleJsonOutputParser
 from app.core.config import settings
+from app.services import cost_accounting, metrics, prompt_cache
+from app.services.circuit_breaker import chat_breaker
+from app.services.external_calls import DeadlineExceeded, call_blocking
 
 os.environ["GOOGLE_API_KEY"] = settings.GEMINI_API_KEY
 
 llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash", temperature=0, max_tokens=None, timeout=None, max_retries=2
+    model=settings.CHAT_MODEL,
+    temperature=0,
+    max_tokens=None,
+    timeout=settings.LLM_TIMEOUT_SECONDS,
+    max_retries=2,
 )
 
 
-async def create_chain(prompt_template, input_data):
+_chains = {}  # (prompt id, cached content) -> compiled chain
+_json_parser = SimpleJsonOutputParser()
+
+
+def get_chain(prompt_template, cached_content=None):
+    """
+    Build the prompt | model chain of a prompt. With cached content, the system
+    message is already held by the shared cache and only the other messages are
+    sent, naming the prompt's section of the cache.
+    """
+    key = (id(prompt_template), cached_content)
+    chain = _chains.get(key)
+    if chain is None:
+        messages = (
+            prompt_cache.cached_messages(prompt_template) if cached_content else prompt_template
+        )
+        model = llm.bind(cached_content=cached_content) if cached_content else llm
+        chain = ChatPromptTemplate.from_messages(messages) | model
+        if not cached_content:
+            # Prompts are module-level constants; cached chains change with
+            # every cache refresh, so only the plain ones are kept
+            _chains[key] = chain
+    return chain
+
+
+def count_chat_tokens(text: str) -> int:
+    """Count tokens with the chat model's client, opening its connection."""
+    return llm.get_num_tokens(text)
+
+
+def run_chain(prompt_template, input_data, cached_content=None):
+    """Run a prompt through the chat model and parse its JSON answer."""
+    message = get_chain(prompt_template, cached_content).invoke(input_data)
+    usage = message.usage_metadata or {}
+    cost_accounting.add("gemini_input_tokens", usage.get("input_tokens", 0))
+    cost_accounting.add("gemini_output_tokens", usage.get("output_tokens", 0))
+    cost_accounting.add(
+        "gemini_cached_tokens", usage.get("input_token_details", {}).get("cache_read", 0)
+    )
+    return _json_parser.invoke(message)
+
+
+def invoke_chain(prompt_template, input_data):
+    cached_content = prompt_cache.cached_content(prompt_template)
+    if cached_content:
+        try:
+            result = run_chain(prompt_template, input_data, cached_content)
+            metrics.increment("prompt_cache_hits")
+            return result
+        except NotFound:
+            # The cache expired or was deleted on Gemini's side
+            prompt_cache.invalidate(cached_content)
+    return run_chain(prompt_template, input_data)
+
+
+async def create_chain(prompt_template, input_data, fallback=None):
+    """
+    Run a prompt through the chat model and parse its JSON answer.
+
+    Args:
+        prompt_template: The prompt messages.
+        input_data (dict): The prompt variables.
+        fallback: Optional local stand-in called with input_data while the
+            chat model's circuit breaker is open.
+
+    Returns:
+        dict: The parsed answer, the fallback's answer, or {} on failure.
+    """
     try:
-        prompt = ChatPromptTemplate.from_messages(prompt_template)
-        json_parser = SimpleJsonOutputParser()
-        chain = prompt | llm | json_parser
-        result = await asyncio.to_thread(chain.invoke, input_data)
-        return result
+        return await call_blocking(
+            "chain", invoke_chain, prompt_template, input_data, breaker=chat_breaker
+        )
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"An error occurred during chain execution: {e}")
+        # A single failure is reported as before; answers are only made up
+        # locally once the breaker has given up on the chat model
+        if fallback and chat_breaker.degraded:
+            metrics.increment("fallbacks:chain")
+            return fallback(input_data)
         return {}
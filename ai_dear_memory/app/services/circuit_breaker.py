@@ -0,0 +1,63 @@
+import time
+from app.core.config import settings
+from app.services import metrics
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a dependency after BREAKER_FAILURE_THRESHOLD consecutive
+    failures. While open, calls fail immediately; after BREAKER_RESET_SECONDS
+    a single trial call is let through and closes the breaker if it succeeds.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+        metrics.register_gauge(f"breaker_open:{name}", lambda: float(self.is_open))
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    @property
+    def degraded(self) -> bool:
+        """Whether callers should use their local fallbacks instead of the dependency."""
+        return settings.CIRCUIT_BREAKERS and self.is_open
+
+    def before_call(self) -> None:
+        """
+        Raises:
+            CircuitOpenError: If the breaker is open and no trial call is due.
+        """
+        if not settings.CIRCUIT_BREAKERS or self.opened_at is None:
+            return
+        reset_due = time.monotonic() - self.opened_at >= settings.BREAKER_RESET_SECONDS
+        if reset_due and not self.trial_running:
+            self.trial_running = True
+            return
+        metrics.increment(f"breaker_rejected:{self.name}")
+        raise CircuitOpenError(f"{self.name} is unavailable")
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= settings.BREAKER_FAILURE_THRESHOLD:
+            if self.opened_at is None:
+                metrics.increment(f"breaker_opened:{self.name}")
+            self.opened_at = time.monotonic()
+
+
+chat_breaker = CircuitBreaker("chat")
+function_calling_breaker = CircuitBreaker("function_calling")
+embedding_breaker = CircuitBreaker("embedding")
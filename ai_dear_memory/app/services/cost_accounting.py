@@ -0,0 +1,174 @@
+"""
+Attribute the cost of external calls to requests, endpoints and users.
+
+Every SDK call made through external_calls.call_blocking is counted, together
+with the Gemini input, output and cached tokens and the index read units its
+response reports. Figures are collected per request (or per background save
+job), then added to per-endpoint and per-user totals that GET /metrics/costs
+rolls up. Embedding tokens are estimated from the text length, as the
+embedding API does not report them.
+"""
+
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.core.config import settings
+
+
+class RequestUsage:
+    """Calls, tokens and units used while serving one request."""
+
+    def __init__(self, endpoint: str, user_id: int | None = None):
+        self.endpoint = endpoint
+        self.user_id = user_id
+        self.counts = Counter()
+        self._lock = threading.Lock()  # calls run in worker threads
+
+    def add(self, name: str, value: float = 1) -> None:
+        if value:
+            with self._lock:
+                self.counts[name] += value
+
+    def header_value(self) -> str:
+        return ", ".join(f"{name}={value:g}" for name, value in sorted(self.counts.items()))
+
+
+_usage: ContextVar[RequestUsage | None] = ContextVar("request_usage", default=None)
+_lock = threading.Lock()
+_endpoints: dict[str, Counter] = {}
+_users: OrderedDict[int, Counter] = OrderedDict()  # least recently active first
+
+
+def current() -> RequestUsage | None:
+    return _usage.get()
+
+
+def add(name: str, value: float = 1) -> None:
+    """Add to a figure of the current request, if there is one."""
+    usage = _usage.get()
+    if usage is not None:
+        usage.add(name, value)
+
+
+def set_user(user_id: int) -> None:
+    """Attribute the current request to a user."""
+    usage = _usage.get()
+    if usage is not None:
+        usage.user_id = user_id
+
+
+def had_failures() -> bool:
+    """Whether an external call of the current request failed or was rejected."""
+    usage = _usage.get()
+    if usage is None:
+        return False
+    with usage._lock:
+        return any(name.startswith("failed_calls:") for name in usage.counts)
+
+
+def estimate_tokens(text: str | list[str]) -> int:
+    """Rough Gemini token count of a text: about four characters per token."""
+    texts = [text] if isinstance(text, str) else text
+    return sum(max(1, len(t) // 4) for t in texts)
+
+
+def record_response(name: str, response) -> None:
+    """
+    Count an external call and the usage reported in its response: Gemini
+    usage_metadata or the read units of a Pinecone response.
+    """
+    usage = _usage.get()
+    if usage is None:
+        return
+    usage.add(f"calls:{name}")
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None:
+        usage.add("gemini_input_tokens", getattr(metadata, "prompt_token_count", 0) or 0)
+        usage.add("gemini_output_tokens", getattr(metadata, "candidates_token_count", 0) or 0)
+        usage.add(
+            "gemini_cached_tokens", getattr(metadata, "cached_content_token_count", 0) or 0
+        )
+    read_units = getattr(getattr(response, "usage", None), "read_units", None)
+    if read_units:
+        usage.add("index_read_units", read_units)
+
+
+def _add_totals(totals: Counter, usage: RequestUsage) -> None:
+    totals["requests"] += 1
+    totals.update(usage.counts)
+
+
+def finish(usage: RequestUsage) -> None:
+    """Add a finished request to the endpoint and user totals."""
+    with _lock:
+        _add_totals(_endpoints.setdefault(usage.endpoint, Counter()), usage)
+        if usage.user_id is not None:
+            totals = _users.pop(usage.user_id, None) or Counter()
+            _add_totals(totals, usage)
+            _users[usage.user_id] = totals
+            while len(_users) > settings.COST_TRACKED_USERS:
+                _users.popitem(last=False)
+
+
+@contextmanager
+def request_scope(endpoint: str, user_id: int | None = None):
+    """
+    Collect the usage of the calls made inside the block for one request. The
+    endpoint and user can still be set on the yielded usage inside the block.
+    """
+    usage = RequestUsage(endpoint, user_id)
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+        finish(usage)
+
+
+def recent_users(limit: int) -> list[int]:
+    """The users who most recently finished a request, most recent first."""
+    with _lock:
+        return list(reversed(_users))[:limit]
+
+
+def _rollup(totals: Counter) -> dict:
+    requests = totals["requests"]
+    figures = {name: value for name, value in totals.items() if name != "requests"}
+    return {
+        "requests": requests,
+        "total": figures,
+        "per_request": {name: value / requests for name, value in figures.items()},
+    }
+
+
+def snapshot(user_id: int | None = None, top_users: int = 10) -> dict:
+    """
+    Roll up the collected usage.
+
+    Args:
+        user_id (int | None): Only report this user.
+        top_users (int): Number of users reported, by Gemini tokens used.
+
+    Returns:
+        dict: Per-endpoint and per-user requests, totals and per-request averages.
+    """
+    with _lock:
+        if user_id is not None:
+            totals = _users.get(user_id)
+            return {"users": {user_id: _rollup(totals)} if totals else {}}
+
+        def tokens(item):
+            return item[1]["gemini_input_tokens"] + item[1]["gemini_output_tokens"]
+
+        users = sorted(_users.items(), key=tokens, reverse=True)[:top_users]
+        return {
+            "endpoints": {name: _rollup(totals) for name, totals in _endpoints.items()},
+            "users": {uid: _rollup(totals) for uid, totals in users},
+        }
+
+
+def reset() -> None:
+    with _lock:
+        _endpoints.clear()
+        _users.clear()
@@ -1,9 +1,11 @@
-import asyncio
-from app.core.config import index
+from app.services import vector_store
 from fastapi.responses import JSONResponse
 from app.services.utils import fetch_vectors
+from app.services.name_index import forget_vectors
+from app.services.external_calls import DeadlineExceeded, with_request_deadline
 
 
+@with_request_deadline
 async def delete_loc_and_items(user_id, vector_ids):
     """
     Delete a location and its associated vectors from the index.
@@ -27,14 +29,21 @@ async def delete_loc_and_items(user_id, vector_ids):
                 content={"status": 404, "message": "No matching location found."},
             )
 
-        await asyncio.to_thread(
-            index.delete,
-            ids=list(user_vectors.keys()),
-        )
+        await vector_store.delete(user_id, list(user_vectors.keys()))
+        forget_vectors(user_id, list(user_vectors.keys()))
         return JSONResponse(
             status_code=200,
             content={"status": 200, "message": "Location deleted successfully."},
         )
 
+    except DeadlineExceeded as e:
+        print(e)
+        return JSONResponse(
+            status_code=504,
+            content={
+                "status": 504,
+                "error": "The request took too long to process. Please try again.",
+            },
+        )
     except Exception as e:
         raise e
@@ -0,0 +1,163 @@
+"""
+Bounded thread pools for the blocking SDK calls, one per external dependency.
+
+With a single shared pool, a burst of slow chat calls takes every thread and
+fast index reads queue behind them. Each dependency (the vector index, the
+embedding API and the chat/function-calling models) gets its own pool, sized
+by INDEX_THREADS, EMBEDDING_THREADS and CHAT_THREADS. The time calls wait for
+a thread is reported by GET /metrics; calls waiting longer than
+EXECUTOR_QUEUE_WAIT_ALERT_SECONDS are counted and logged as saturation.
+"""
+
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.core.config import settings
+from app.services import metrics
+
+# Queue waits kept per pool for the percentile gauge
+WAIT_WINDOW = 200
+# Log a saturated pool at most this often
+ALERT_INTERVAL_SECONDS = 60
+
+
+def dependency_of(call_name: str) -> str:
+    """Map a call name used by external_calls to the pool that runs it."""
+    if call_name.startswith("index."):
+        return "index"
+    if call_name.startswith("embed"):
+        return "embedding"
+    return "chat"
+
+
+def pool_sizes() -> dict[str, int]:
+    return {
+        "index": settings.INDEX_THREADS,
+        "embedding": settings.EMBEDDING_THREADS,
+        "chat": settings.CHAT_THREADS,
+    }
+
+
+class DependencyExecutor:
+    """Thread pool running the blocking calls to one dependency."""
+
+    def __init__(self, name: str, threads: int):
+        self.name = name
+        self.threads = threads
+        self.queued = 0
+        self.active = 0
+        self.waits = deque(maxlen=WAIT_WINDOW)
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix=f"{name}-calls"
+        )
+        self._lock = threading.Lock()
+        self._last_alert = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn in the pool with the caller's context variables. Cancelling the
+        returned awaitable drops the call if it has not started yet.
+        """
+        submitted = time.monotonic()
+        context = contextvars.copy_context()
+
+        def call():
+            self._started(time.monotonic() - submitted)
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(call)
+        future.add_done_callback(self._finished)
+        return await asyncio.wrap_future(future)
+
+    def _finished(self, future: Future) -> None:
+        if future.cancelled():  # never started
+            with self._lock:
+                self.queued -= 1
+
+    def _started(self, wait: float) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.waits.append(wait)
+        metrics.increment(f"executor_calls:{self.name}")
+        metrics.increment(f"executor_queue_wait_seconds:{self.name}", wait)
+        if wait < settings.EXECUTOR_QUEUE_WAIT_ALERT_SECONDS:
+            return
+        metrics.increment(f"executor_saturated_calls:{self.name}")
+        now = time.monotonic()
+        if now - self._last_alert >= ALERT_INTERVAL_SECONDS:
+            self._last_alert = now
+            print(
+                f"The {self.name} pool is saturated: a call waited {wait * 1000:.0f} ms "
+                f"for one of its {self.threads} threads ({self.queued} still queued)."
+            )
+
+    def wait_percentile(self, q: float) -> float:
+        ordered = sorted(self.waits)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+    def saturated(self) -> bool:
+        return (
+            self.queued > 0
+            or self.wait_percentile(0.95) >= settings.EXECUTOR_QUEUE_WAIT_ALERT_SECONDS
+        )
+
+    def register_gauges(self) -> None:
+        metrics.register_gauge(f"executor_active:{self.name}", lambda: self.active)
+        metrics.register_gauge(f"executor_queued:{self.name}", lambda: self.queued)
+        metrics.register_gauge(
+            f"executor_queue_wait_p95_seconds:{self.name}",
+            lambda: self.wait_percentile(0.95),
+        )
+        metrics.register_gauge(
+            f"executor_saturated:{self.name}", lambda: int(self.saturated())
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_executors: dict[str, DependencyExecutor] = {}
+_lock = threading.Lock()
+
+
+def executor_for(dependency: str) -> DependencyExecutor:
+    """Return the pool of a dependency, creating it on first use."""
+    executor = _executors.get(dependency)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(dependency)
+            if executor is None:
+                executor = DependencyExecutor(dependency, pool_sizes()[dependency])
+                executor.register_gauges()
+                _executors[dependency] = executor
+    return executor
+
+
+async def run(call_name: str, fn, *args, **kwargs):
+    """Run a blocking call in the pool of its dependency."""
+    return await executor_for(dependency_of(call_name)).run(fn, *args, **kwargs)
+
+
+async def start() -> None:
+    """Create every pool, so their gauges are reported from startup."""
+    for dependency in pool_sizes():
+        executor_for(dependency)
+
+
+async def stop() -> None:
+    """Shut the pools down, dropping queued calls. Pools are recreated on use."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
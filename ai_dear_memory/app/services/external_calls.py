@@ -0,0 +1,204 @@
+import time
+import asyncio
+import functools
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.core.config import settings
+from app.services import cost_accounting, executors, metrics
+from app.services.circuit_breaker import CircuitBreaker
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when an external call cannot finish before the request deadline."""
+
+
+_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float | None):
+    """
+    Bound every external call made inside the block (including tasks and
+    threads started from it) by a deadline `seconds` from now. A deadline set
+    by an enclosing scope is kept if it is earlier.
+    """
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(min(deadline, current) if current else deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_request_deadline(func):
+    """Run an async entry point under REQUEST_DEADLINE_SECONDS."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with deadline_scope(settings.REQUEST_DEADLINE_SECONDS):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def remaining_time() -> float | None:
+    """Seconds left until the current deadline, or None without a deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def sdk_request_options() -> dict | None:
+    """google.generativeai request options carrying the remaining deadline."""
+    remaining = remaining_time()
+    return None if remaining is None else {"timeout": max(remaining, 0.001)}
+
+
+class LatencyTracker:
+    """Rolling window of call durations."""
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.samples) < settings.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+_latencies = defaultdict(lambda: LatencyTracker(settings.HEDGE_WINDOW))
+
+
+async def _timed(name: str, fn, args, kwargs):
+    # Timed from when a pool thread starts the call: the wait for a free
+    # thread is tracked by the executor, and counting it here would make
+    # hedges fire on a full pool, where a duplicate only queues behind
+    started = []
+
+    def timed(*args, **kwargs):
+        started.append(time.monotonic())
+        return fn(*args, **kwargs)
+
+    result = await executors.run(name, timed, *args, **kwargs)
+    _latencies[name].record(time.monotonic() - started[0])
+    cost_accounting.record_response(name, result)
+    return result
+
+
+def hedge_delay(name: str) -> float | None:
+    """Delay after which a duplicate call is fired, from the call's recent p95."""
+    percentile = _latencies[name].percentile(settings.HEDGE_PERCENTILE)
+    if percentile is None:
+        return None
+    return max(percentile, settings.HEDGE_MIN_DELAY_SECONDS)
+
+
+async def _hedged(name: str, fn, args, kwargs):
+    first = asyncio.ensure_future(_timed(name, fn, args, kwargs))
+    tasks = {first}
+    try:
+        delay = hedge_delay(name)
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.increment(f"hedged_calls:{name}")
+        second = asyncio.ensure_future(_timed(name, fn, args, kwargs))
+        tasks.add(second)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        metrics.increment(f"hedge_wins:{name}")
+                    return task.result()
+        return first.result()  # both failed; raise the first error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call_blocking(
+    name: str,
+    fn,
+    *args,
+    hedge: bool = False,
+    breaker: CircuitBreaker | None = None,
+    **kwargs,
+):
+    """
+    Run a blocking SDK call in the thread pool of its dependency, bounded by
+    the request deadline.
+
+    Args:
+        name (str): Name of the call, used for latency tracking and metrics.
+        fn: The blocking function.
+        *args: Positional arguments of fn.
+        hedge (bool): The call is an idempotent read that may be duplicated
+            after its p95 latency when HEDGING is enabled.
+        **kwargs: Keyword arguments of fn.
+
+    Returns:
+        The return value of fn.
+
+    Raises:
+        DeadlineExceeded: If the deadline passes before the call returns.
+        CircuitOpenError: If the breaker is open.
+    """
+    timeout = remaining_time()
+    if timeout is not None and timeout <= 0:
+        metrics.increment(f"deadline_exceeded:{name}")
+        raise DeadlineExceeded(f"No time left for {name}")
+    if breaker:
+        try:
+            breaker.before_call()
+        except Exception:
+            cost_accounting.add(f"failed_calls:{name}")
+            raise
+
+    call = (
+        _hedged(name, fn, args, kwargs)
+        if hedge and settings.HEDGING
+        else _timed(name, fn, args, kwargs)
+    )
+    try:
+        result = await asyncio.wait_for(call, timeout)
+    except asyncio.TimeoutError as e:
+        cost_accounting.add(f"failed_calls:{name}")
+        if timeout is None or remaining_time() > 0:
+            # The dependency itself timed out
+            if breaker:
+                breaker.record_failure()
+            raise
+        # The request ran out of its own budget, which says nothing about the
+        # dependency's health; only give back a half-open trial
+        if breaker:
+            breaker.trial_running = False
+        metrics.increment(f"deadline_exceeded:{name}")
+        raise DeadlineExceeded(f"{name} did not finish before the deadline") from e
+    except asyncio.CancelledError:
+        if breaker:
+            breaker.trial_running = False
+        raise
+    except Exception:
+        cost_accounting.add(f"failed_calls:{name}")
+        if breaker:
+            breaker.record_failure()
+        raise
+    if breaker:
+        breaker.record_success()
+    return result
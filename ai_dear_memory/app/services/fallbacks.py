@@ -0,0 +1,273 @@
+"""
+Local stand-ins for the Gemini calls, used when a call fails or its circuit
+breaker is open. They cover the common phrasings only; anything they cannot
+parse is answered as not understood rather than guessed.
+"""
+
+import re
+
+_DETERMINERS = re.compile(r"^(?:(?:my|the|a|an|our|your|his|her|their|some|all)\s+)+")
+_PREPOSITIONS = (
+    r"in front of|on top of|next to|inside of|inside|into|onto|underneath|under"
+    r"|behind|beside|near|within|in|on|at"
+)
+_SAVE_VERB = re.compile(
+    r"\b(?:kept|keep|put|placed|place|left|leave|stored|store|packed|pack|hid|hidden"
+    r"|dropped|moved|parked|hung|set)\b\s+",
+    re.IGNORECASE,
+)
+_PAIR = re.compile(
+    rf"^(?P<item>.+?)\s+(?P<preposition>{_PREPOSITIONS})\s+(?P<location>.+)$",
+    re.IGNORECASE,
+)
+_DELETE_VERB = re.compile(
+    r"^\s*(?:please\s+)?(?:delete|remove|forget(?:\s+about)?|erase|clear|discard)\s+",
+    re.IGNORECASE,
+)
+_DELETE_LOCATION = re.compile(
+    rf"^(?:everything|anything|all(?:\s+(?:the\s+)?(?:items|things|memories))?"
+    rf"|(?:the\s+)?(?:items|things|memories))\s+(?:{_PREPOSITIONS}|from)\s+(?P<location>.+)$"
+    r"|^(?P<named>.+?)\s+location$",
+    re.IGNORECASE,
+)
+_LOCATION_QUERY = re.compile(
+    r"^(?:what(?:'s|\s+is|\s+are|\s+did\s+i\s+(?:keep|put|store|leave)"
+    r"|\s+have\s+i\s+(?:kept|put|stored|left)|\s+do\s+i\s+have)?"
+    r"|(?:list|show)(?:\s+me)?(?:\s+(?:everything|all(?:\s+the)?\s+items|items))?)"
+    rf"\s+(?:{_PREPOSITIONS})\s+(?P<location>.+)$",
+    re.IGNORECASE,
+)
+_ITEM_QUERY = re.compile(
+    r"^(?:where(?:'s|\s+is|\s+are|\s+did\s+i\s+(?:keep|put|leave|store|place)"
+    r"|\s+have\s+i\s+(?:kept|put|left|stored|placed)|\s+can\s+i\s+find)?)\s+(?P<items>.+)$",
+    re.IGNORECASE,
+)
+
+
+def _clean(name: str) -> str:
+    name = name.strip(" \t.,!?;:'\"").lower()
+    return _DETERMINERS.sub("", name).strip()
+
+
+def _split_names(text: str) -> list[str]:
+    names = (_clean(name) for name in re.split(r"\s*(?:,|\band\b|&)\s*", text))
+    return [name for name in names if name]
+
+
+def _sentences(text: str) -> list[str]:
+    return [part for part in re.split(r"[.;!?\n]+", text) if part.strip()]
+
+
+def _join(names) -> str:
+    names = list(names)
+    if len(names) <= 1:
+        return "".join(names)
+    return f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+def _capitalize(text: str) -> str:
+    return text[:1].upper() + text[1:]
+
+
+def extract_pairs(text: str) -> list[dict]:
+    """
+    Extract item/location pairs from sentences such as "I kept my keys in the
+    drawer and my wallet on the table".
+
+    Args:
+        text (str): The text the user asked to save.
+
+    Returns:
+        list[dict]: {"item", "location", "preposition", "sentence"} per pair.
+    """
+    entries = []
+    for sentence in _sentences(text):
+        verb = _SAVE_VERB.search(sentence)
+        if not verb:
+            continue
+        # "salt and pepper in the cupboard" is one pair, so pieces without a
+        # preposition are joined to the next piece
+        pending = ""
+        for piece in re.split(r"\s*,\s*(?:and\s+)?|\s+and\s+", sentence[verb.end() :]):
+            pending = f"{pending} and {piece}" if pending else piece
+            match = _PAIR.match(pending.strip())
+            if not match:
+                continue
+            pending = ""
+            item, location = _clean(match["item"]), _clean(match["location"])
+            if not item or not location:
+                continue
+            preposition = match["preposition"].lower()
+            entries.append(
+                {
+                    "item": item,
+                    "location": location,
+                    "preposition": preposition,
+                    "sentence": f"I have kept {item} {preposition} the {location}.",
+                }
+            )
+    return entries
+
+
+def success_message(entries: list[dict]) -> str:
+    """Template success message for saved pairs."""
+    message = "; ".join(
+        f"{entry['item']} saved {entry.get('preposition', 'in')} {entry['location']}"
+        for entry in entries
+    )
+    return f"{_capitalize(message)}."
+
+
+def phrase_saved_text(input_data: dict) -> dict:
+    """Fallback for the AI_OUTPUT_PROMPT prompt."""
+    entries = extract_pairs(input_data["text"])
+    return {"sentence": success_message(entries) if entries else input_data["text"]}
+
+
+def structured_extraction(input_data: dict) -> dict:
+    """Fallback for the STRUCTURED_EXTRACTION prompt."""
+    entries = extract_pairs(input_data["text"])
+    if not entries:
+        return {"error": "No item and location found."}
+    return {"entries": entries, "success_message": success_message(entries)}
+
+
+def item_separation(input_data: dict) -> dict:
+    """Fallback for the ITEM_SEPARATION prompt."""
+    return {"sentences": [entry["sentence"] for entry in extract_pairs(input_data["text"])]}
+
+
+def key_value_extraction(input_data: dict) -> dict:
+    """Fallback for the EXTRACTION_PROMPT prompt: {location: item}."""
+    entries = extract_pairs(input_data["input_text"])
+    if not entries:
+        return {"error": "No item and location found."}
+    return {entries[0]["location"]: entries[0]["item"]}
+
+
+def rename_text(input_data: dict) -> dict:
+    """Fallback for the RENAME_LOCATION prompt."""
+    pattern = re.compile(re.escape(input_data["original_location"]), re.IGNORECASE)
+    return {
+        "answer": pattern.sub(
+            lambda _: input_data["modified_location"], input_data["input_text"]
+        )
+    }
+
+
+def route_save(text: str) -> tuple[str, dict] | None:
+    """
+    Classify a /save text as an insert, an item deletion or a location
+    deletion, like the function-calling model would.
+
+    Returns:
+        tuple[str, dict] | None: Function name and arguments, or None if the
+        text is not understood.
+    """
+    text = text.strip()
+    delete = _DELETE_VERB.match(text)
+    if delete:
+        target = text[delete.end() :].strip(" .!?")
+        location = _DELETE_LOCATION.match(target)
+        if location:
+            names = _split_names(location["location"] or location["named"])
+            return "delete_memory_location", {"locations": names}
+        return "delete_memory_item", {"items": _split_names(target)}
+    if extract_pairs(text):
+        return "insert_embedding", {}
+    return None
+
+
+def route_query(text: str) -> tuple[str, dict] | None:
+    """
+    Classify a /retrieve question as a lookup by location or by item.
+
+    Returns:
+        tuple[str, dict] | None: Function name and arguments, or None if the
+        question is not understood.
+    """
+    text = text.strip().rstrip(" ?.!")
+    location = _LOCATION_QUERY.match(text)
+    if location:
+        return "retrieving_memory_by_location", {
+            "locations": _split_names(location["location"])
+        }
+    items = _ITEM_QUERY.match(text)
+    if items and text.lower().startswith("where"):
+        names = _split_names(items["items"])
+        if names:
+            return "retrieving_memory_by_item", {"items": names}
+    return None
+
+
+def item_response(input_data: dict) -> dict:
+    """Fallback for the RETRIEVAL_ITEM_RESPONSE prompt."""
+    found, similar, missing = [], set(), []
+    for response in input_data["responses"]:
+        if response["exact_location"]:
+            found.append(
+                f"{response['item']} found in the {_join(sorted(response['exact_location']))}"
+            )
+        else:
+            missing.append(response["item"])
+            similar.update(response["similar_items"])
+    messages = [f"{_capitalize('; '.join(found))}."] if found else []
+    if missing:
+        message = f"Sorry, can't find {_join(missing)}."
+        if similar:
+            message += f" Try searching for other items like {_join(sorted(similar))}."
+        messages.append(message)
+    return {"answer": " ".join(messages)}
+
+
+def location_response(input_data: dict) -> dict:
+    """Fallback for the RETRIEVAL_LOCATION_RESPONSE prompt."""
+    found, similar, missing = [], set(), []
+    for response in input_data["responses"]:
+        if response["exact_items"]:
+            found.append(
+                f"{_join(sorted(response['exact_items']))} found in the {response['location']}"
+            )
+        else:
+            missing.append(response["location"])
+            similar.update(response["similar_locations"])
+    messages = [f"{_capitalize('; '.join(found))}."] if found else []
+    if missing:
+        message = f"Sorry, can't find anything at {_join(missing)}."
+        if similar:
+            message += f" Try searching for other locations like {_join(sorted(similar))}."
+        messages.append(message)
+    return {"answer": " ".join(messages)}
+
+
+def delete_item_response(input_data: dict) -> dict:
+    """Fallback for the CREATE_DELETE_ITEM_RESPONSE prompt."""
+    deleted = [entry["exact_item"] for entry in input_data["items"] if entry["exact_item"]]
+    missing = [entry for entry in input_data["items"] if not entry["exact_item"]]
+    messages = [f"Deleted {_join(deleted)} successfully."] if deleted else []
+    if missing:
+        similar = sorted({name for entry in missing for name in entry["similar_items"]})
+        message = f"Can't find {_join(entry['item'] for entry in missing)}"
+        message += (
+            f". Try searching for related items: {_join(similar)}." if similar else " at any location."
+        )
+        messages.append(message)
+    return {"answer": " ".join(messages)}
+
+
+def delete_location_response(input_data: dict) -> dict:
+    """Fallback for the CREATE_DELETE_RESPONSE prompt."""
+    messages = []
+    for entry in input_data["locations"]:
+        if entry["exact_items"]:
+            messages.append(
+                f"Deleted items {_join(entry['exact_items'])} from {entry['location']}."
+            )
+        elif entry["similar_locations"]:
+            messages.append(
+                f"Can't find any items at {entry['location']}. Try searching for similar "
+                f"locations such as: {_join(entry['similar_locations'])}."
+            )
+        else:
+            messages.append(f"Can't find any items at {entry['location']}.")
+    return {"answer": " ".join(messages)}
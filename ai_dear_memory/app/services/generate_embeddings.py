@@ -1,16 +1,24 @@
 import uuid
 import asyncio
 import datetime
-from app.core.config import index
+from app.core.config import settings
+from app.services import vector_store
 from fastapi.responses import JSONResponse
 from app.schemas.embeddings import EmbeddingRequest, EmbeddingResponse
-from app.services.information_extraction import extract_key_value_pairs
+from app.services.information_extraction import (
+    extract_key_value_pairs,
+    extract_item_location_pairs,
+)
 from app.services.chain_creation import create_chain
 from app.prompts.text_formatting import ITEM_SEPARATION, AI_OUTPUT_PROMPT
 from app.services.retrieving_memory import (
     query_index_item,
 )
 from app.services.utils import get_text_embedding
+from app.services.name_index import record_vectors, forget_vectors
+from app.services.hybrid_search import vector_record
+from app.services.external_calls import DeadlineExceeded
+from app.services import fallbacks, memory_maintenance
 
 
 async def handling_previous_entry(user_id: int, item: str, query_vector: list) -> list:
@@ -33,14 +41,18 @@ async def handling_previous_entry(user_id: int, item: str, query_vector: list) -
     return []
 
 
-async def process_sentence(sentence: str, user_id: int, embedding: list) -> dict | None:
+async def process_sentence(
+    sentence: str, user_id: int, embedding: list, extracted_info: dict | None = None
+) -> dict | None:
     """
     Process a single sentence to extract information and handle existing entries.
 
     Args:
         sentence (str): Input sentence
         user_id (int): User ID
-        embedding (list): Pre-generated embedding for the sentence
+        embedding (list): Pre-generated float32 embedding for the sentence
+        extracted_info (dict | None): Pre-extracted {location: item} pair. When
+            omitted, the pair is extracted from the sentence with EXTRACTION_PROMPT.
 
     Returns:
         dict: Processing results including vector ID, location, item, and deleted entries
@@ -52,7 +64,8 @@ async def process_sentence(sentence: str, user_id: int, embedding: list) -> dict
         deleted_entries = []
 
         try:
-            extracted_info = await extract_key_value_pairs(sentence)
+            if extracted_info is None:
+                extracted_info = await extract_key_value_pairs(sentence)
             if extracted_info.get("error"):
                 return {
                     "error": "Sorry, I couldn't understand that sentence. Please make sure you're clearly mentioning where and what item you're referring to."
@@ -89,15 +102,19 @@ async def process_sentence(sentence: str, user_id: int, embedding: list) -> dict
                 deleted_entries = [matched_object["id"]]
 
         # Create metadata for the new entry
+        vector_id = str(uuid.uuid4())
+        saved_at = datetime.datetime.now(datetime.timezone.utc)
         metadata = {
             "userId": user_id,
             "originalText": sentence,
-            "datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "datetime": saved_at.isoformat(),
+            "savedAt": saved_at.timestamp(),  # numeric, for range filters
             "location": location,
             "item": item,
+            "embeddingModel": settings.EMBEDDING_MODEL,
+            "embeddingDimension": len(embedding),
         }
 
-        vector_id = str(uuid.uuid4())
         return {
             "vector_id": vector_id,
             "embedding": embedding,
@@ -108,36 +125,126 @@ async def process_sentence(sentence: str, user_id: int, embedding: list) -> dict
             "deleted_entries": deleted_entries,
         }
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error processing sentence: {e}")
         return None
 
 
-async def insert_embedding(request_body: EmbeddingRequest) -> dict | JSONResponse:
+async def phrase_success_message(text: str) -> str:
     """
-    Inserts data into Pinecone index after processing sentences.
+    Phrase the success message for a save. It depends only on the saved text,
+    so it can run concurrently with extraction and the index writes.
+
+    Args:
+        text (str): The text the user asked to save.
+
+    Returns:
+        str: The success message, or the text itself if phrasing fails.
+    """
+    processed_output = await create_chain(
+        AI_OUTPUT_PROMPT, {"text": text}, fallback=fallbacks.phrase_saved_text
+    )
+    return processed_output.get("sentence", text)
+
+
+async def prepare_insert(request_body: EmbeddingRequest) -> dict:
+    """
+    Split the text into item/location sentences and embed them. This is the
+    part of a save that does not touch the index, so it can be started before
+    the intent of the text is known.
 
     Args:
         request_body (EmbeddingRequest): Request containing user ID and text
 
     Returns:
-        dict: Response containing processing results or error message
+        dict: The sentences, their embeddings, pre-extracted pairs and success
+        message, or {"error": message} if no item/location pair was found
+        (with "status": 503 if the text could not be embedded).
     """
-    try:
+    success_message = None
+    if settings.STRUCTURED_EXTRACTION:
+        # Extract items, locations and the success message in one call
+        extraction = await extract_item_location_pairs(request_body.text)
+        if "error" in extraction:
+            return {
+                "error": "Sorry, I couldn't understand that sentence. Please make sure you're clearly mentioning where and what item you're referring to."
+            }
+        entries = extraction["entries"]
+        sentences = [entry["sentence"] for entry in entries]
+        extracted_infos = [{entry["location"]: entry["item"]} for entry in entries]
+        success_message = extraction["success_message"] or None
+    else:
         # Split text into sentences
         sentences_chain = await create_chain(
-            ITEM_SEPARATION, {"text": request_body.text}
+            ITEM_SEPARATION,
+            {"text": request_body.text},
+            fallback=fallbacks.item_separation,
         )
         sentences = sentences_chain["sentences"]
+        extracted_infos = [None] * len(sentences)
+
+    # Batch embedding generation
+    embeddings = await get_text_embedding(sentences)
+    if embeddings is None:
+        return {
+            "error": "Saving memories is temporarily unavailable. Please try again in a few minutes.",
+            "status": 503,
+        }
+
+    return {
+        "sentences": sentences,
+        "embeddings": embeddings,
+        "extracted_infos": extracted_infos,
+        "success_message": success_message,
+    }
+
+
+async def insert_embedding(
+    request_body: EmbeddingRequest, prepared: dict | None = None
+) -> dict | JSONResponse:
+    """
+    Inserts data into Pinecone index after processing sentences.
+
+    Args:
+        request_body (EmbeddingRequest): Request containing user ID and text
+        prepared (dict | None): Result of prepare_insert if it already ran,
+            e.g. speculatively alongside intent classification.
 
-        # Batch embedding generation
-        embeddings = await get_text_embedding(sentences)
+    Returns:
+        dict: Response containing processing results or error message
+    """
+    phrasing_task = None
+    try:
+        if settings.SPECULATIVE_SUCCESS_MESSAGE and not settings.STRUCTURED_EXTRACTION:
+            # Start phrasing while extraction is still running; it is
+            # cancelled below if the save does not succeed.
+            phrasing_task = asyncio.create_task(
+                phrase_success_message(request_body.text)
+            )
+
+        if prepared is None:
+            prepared = await prepare_insert(request_body)
+        if "error" in prepared:
+            status_code = prepared.get("status", 400)
+            return JSONResponse(
+                status_code=status_code,
+                content={"status": status_code, "error": prepared["error"]},
+            )
+        success_message = prepared["success_message"]
 
         # Process all sentences concurrently
         results = await asyncio.gather(
             *[
-                process_sentence(sentence, request_body.user_id, embedding)
-                for sentence, embedding in zip(sentences, embeddings)
+                process_sentence(
+                    sentence, request_body.user_id, embedding, extracted_info
+                )
+                for sentence, embedding, extracted_info in zip(
+                    prepared["sentences"],
+                    prepared["embeddings"],
+                    prepared["extracted_infos"],
+                )
                 if embedding  # Skip sentences with failed embeddings
             ]
         )
@@ -182,7 +289,9 @@ async def insert_embedding(request_body: EmbeddingRequest) -> dict | JSONRespons
         # Handle existing sentences
         if existing_sentences:
             processed_output = await create_chain(
-                AI_OUTPUT_PROMPT, {"text": " ".join(existing_sentences)}
+                AI_OUTPUT_PROMPT,
+                {"text": " ".join(existing_sentences)},
+                fallback=fallbacks.phrase_saved_text,
             )
             return JSONResponse(
                 status_code=400,
@@ -192,20 +301,36 @@ async def insert_embedding(request_body: EmbeddingRequest) -> dict | JSONRespons
                 },
             )
 
-        if deleted_entries:
-            await asyncio.to_thread(index.delete, ids=deleted_entries)
+        # Deletes, upserts and success message phrasing are independent of
+        # each other, so run them concurrently
+        if embedding_responses and success_message is None and phrasing_task is None:
+            phrasing_task = asyncio.create_task(
+                phrase_success_message(request_body.text)
+            )
 
+        writes = []
+        if deleted_entries:
+            writes.append(vector_store.delete(request_body.user_id, deleted_entries))
         if new_entries:
-            await asyncio.to_thread(index.upsert, vectors=new_entries)
+            writes.append(
+                vector_store.upsert(
+                    request_body.user_id,
+                    [vector_record(*entry) for entry in new_entries],
+                )
+            )
+        await asyncio.gather(*writes)
+        forget_vectors(request_body.user_id, deleted_entries)
+        record_vectors(request_body.user_id, new_entries)
+        if new_entries:
+            memory_maintenance.schedule(request_body.user_id)
 
         # Handle successful insertion
         if embedding_responses:
-            processed_output = await create_chain(
-                AI_OUTPUT_PROMPT, {"text": request_body.text}
-            )
+            if success_message is None:
+                success_message = await phrasing_task
             return {
                 "user_id": request_body.user_id,
-                "success_message": processed_output.get("sentence", request_body.text),
+                "success_message": success_message,
                 "deleted_entries": deleted_entries,
                 "items": embedding_responses,
             }
@@ -218,6 +343,8 @@ async def insert_embedding(request_body: EmbeddingRequest) -> dict | JSONRespons
             },
         )
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(f"Error inserting data: {e}")
         return JSONResponse(
@@ -227,3 +354,6 @@ async def insert_embedding(request_body: EmbeddingRequest) -> dict | JSONRespons
                 "error": "An unexpected error occurred while saving the memory.",
             },
         )
+    finally:
+        if phrasing_task and not phrasing_task.done():
+            phrasing_task.cancel()
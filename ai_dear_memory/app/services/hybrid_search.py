@@ -0,0 +1,103 @@
+import re
+import math
+import zlib
+from collections import Counter
+from app.core.config import settings
+from app.services.vectors import float32
+
+
+def encode_sparse(text: str) -> dict:
+    """
+    Encode text as a sparse lexical vector of hashed words and character
+    trigrams, so that short names sharing words or spelling score higher.
+
+    Args:
+        text (str): The text to encode.
+
+    Returns:
+        dict: {"indices": list[int], "values": list[float]}, L2-normalized.
+    """
+    features = Counter()
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        features[zlib.crc32(f"w:{token}".encode())] += 1.0
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            features[zlib.crc32(f"c:{padded[i : i + 3]}".encode())] += 0.5
+
+    norm = math.sqrt(sum(value * value for value in features.values())) or 1.0
+    indices = sorted(features)
+    return {"indices": indices, "values": [features[i] / norm for i in indices]}
+
+
+def vector_record(vector_id: str, values: list, metadata: dict):
+    """
+    Build an upsert record, adding sparse values from the item and location
+    names when hybrid search is enabled.
+
+    Args:
+        vector_id (str): The vector ID.
+        values (list): The dense embedding; a float32 array is passed as is.
+        metadata (dict): The vector metadata.
+
+    Returns:
+        tuple | dict: A record accepted by index.upsert.
+    """
+    if not settings.HYBRID_SEARCH:
+        return (vector_id, values, metadata)
+
+    record = {"id": vector_id, "values": values, "metadata": metadata}
+    sparse_values = encode_sparse(
+        f"{metadata.get('item', '')} {metadata.get('location', '')}"
+    )
+    if sparse_values["indices"]:
+        record["sparse_values"] = sparse_values
+    return record
+
+
+def hybrid_query_args(vector: list, text: str | None = None) -> dict:
+    """
+    Build the vector arguments of index.query. With hybrid search, the dense
+    vector is weighted by HYBRID_ALPHA and the sparse encoding of the text by
+    1 - HYBRID_ALPHA.
+
+    Args:
+        vector (list): The dense query vector; a weighted one is a float32 array.
+        text (str | None): The item or location name being looked up.
+
+    Returns:
+        dict: "vector" and, for hybrid queries, "sparse_vector".
+    """
+    if not settings.HYBRID_SEARCH or not text:
+        return {"vector": vector}
+
+    sparse_vector = encode_sparse(text)
+    if not sparse_vector["indices"]:
+        return {"vector": vector}
+
+    alpha = settings.HYBRID_ALPHA
+    return {
+        "vector": float32(value * alpha for value in vector),
+        "sparse_vector": {
+            "indices": sparse_vector["indices"],
+            "values": [value * (1 - alpha) for value in sparse_vector["values"]],
+        },
+    }
+
+
+def hybrid_min_score(min_score: float) -> float:
+    """
+    Convert a minimum cosine similarity into the minimum score of a hybrid
+    query. Hybrid scores are HYBRID_ALPHA times the dense similarity plus the
+    weighted lexical one, which is close to 0 for differently spelled names,
+    so the threshold is scaled by HYBRID_ALPHA: a match that passes on its
+    embedding alone still passes, and shared words only add to its score.
+
+    Args:
+        min_score (float): The threshold for cosine similarity.
+
+    Returns:
+        float: The threshold for the scores of the configured queries.
+    """
+    if not settings.HYBRID_SEARCH:
+        return min_score
+    return min_score * settings.HYBRID_ALPHA
@@ -1,11 +1,70 @@
-from app.prompts.info_extraction import EXTRACTION_PROMPT
+from app.prompts.info_extraction import EXTRACTION_PROMPT, STRUCTURED_EXTRACTION
 from app.services.chain_creation import create_chain
+from app.services import fallbacks
 
 
 async def extract_key_value_pairs(input_text: str) -> dict:
     try:
-        result = await create_chain(EXTRACTION_PROMPT, {"input_text": input_text})
+        result = await create_chain(
+            EXTRACTION_PROMPT,
+            {"input_text": input_text},
+            fallback=fallbacks.key_value_extraction,
+        )
         return result
     except Exception as e:
         print(f"An error occurred: {e}")
         return {}
+
+
+async def extract_item_location_pairs(input_text: str) -> dict:
+    """
+    Extract every item/location pair and the success message from the raw
+    text with a single structured-output call.
+
+    Args:
+        input_text (str): The text the user asked to save.
+
+    Returns:
+        dict: {"entries": [{"item", "location", "sentence"}], "success_message": str}
+        with incomplete entries dropped, or {"error": str} when nothing usable
+        was extracted.
+    """
+    try:
+        result = await create_chain(
+            STRUCTURED_EXTRACTION,
+            {"text": input_text},
+            fallback=fallbacks.structured_extraction,
+        )
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        result = {}
+
+    if not isinstance(result, dict):
+        return {"error": ""}
+    if result.get("error"):
+        return {"error": result["error"]}
+
+    entries = []
+    for entry in result.get("entries") or []:
+        if not isinstance(entry, dict):
+            continue
+        item = str(entry.get("item") or "").strip()
+        location = str(entry.get("location") or "").strip()
+        if not item or not location:
+            continue
+        entries.append(
+            {
+                "item": item,
+                "location": location,
+                "sentence": str(entry.get("sentence") or "").strip()
+                or f"I have kept {item} in the {location}.",
+            }
+        )
+
+    if not entries:
+        return {"error": ""}
+
+    return {
+        "entries": entries,
+        "success_message": str(result.get("success_message") or "").strip(),
+    }
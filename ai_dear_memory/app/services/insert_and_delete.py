@@ -1,16 +1,23 @@
 from app.schemas.embeddings import EmbeddingRequest
 import google.generativeai as genai
 from google.generativeai import types
-from app.services.generate_embeddings import insert_embedding
-from app.services.retrieving_memory import (
-    query_index,
-    extract_valid_matches,
-    sort_by_score,
-)
+from app.services.generate_embeddings import insert_embedding, prepare_insert
+from app.services.retrieving_memory import query_index, extract_valid_matches
 import asyncio
 from fastapi.responses import JSONResponse
-from app.services.utils import get_text_embedding
-from app.core.config import index
+from app.services.utils import embed_query
+from app.services.vector_store import metadata_probe_vector, scan_index
+from app.services import vector_store
+from app.services.name_index import match_name, forget_vectors
+from app.core.config import settings
+from app.services import metrics, fallbacks
+from app.services.circuit_breaker import function_calling_breaker
+from app.services.external_calls import (
+    DeadlineExceeded,
+    call_blocking,
+    sdk_request_options,
+    with_request_deadline,
+)
 from app.services.chain_creation import create_chain
 from app.prompts.text_formatting import FORMAT_TEXT
 from app.prompts.text_formatting import (
@@ -88,29 +95,13 @@ delete_memory_location_declaration = {
 }
 
 
-async def query_index_location(
-    user_id: int, vectors: list, location: str, top_k: int
-) -> list:
-    return await asyncio.gather(
-        *[
-            asyncio.to_thread(
-                index.query,
-                vector=vec,
-                top_k=top_k,
-                filter={"userId": user_id, "location": location.lower().strip()},
-                include_metadata=True,
-            )
-            for vec in vectors
-        ]
-    )
-
-
 async def query_index_item(user_id: int, item: str, vectors: list, top_k: int) -> list:
     return await asyncio.gather(
         *[
-            asyncio.to_thread(
-                index.query,
-                vector=vec,
+            vector_store.query_by_embedding(
+                user_id,
+                vec,
+                item,
                 top_k=top_k,
                 filter={"userId": user_id, "item": item.lower().strip()},
                 include_metadata=True,
@@ -130,32 +121,50 @@ async def prepare_response(input_text: str, user_query: str) -> Dict[str, Any]:
         return {}
 
 
-async def process_items_in_batch(user_id: int, items: list[str], top_k: int = 3):
+async def process_items_in_batch(
+    user_id: int, items: list[str], top_k: int | None = None
+):
     """
     Process multiple items for deletion in a batch.
 
     Args:
         user_id (int): The user ID.
         items (list[str]): List of items to process.
-        top_k (int): Number of top matches to retrieve.
+        top_k (int | None): Number of top matches to retrieve. Defaults to
+            SIMILAR_TOP_K.
 
     Returns:
         list[dict]: A list of dictionaries containing results for each item.
+        Only an item stored under exactly the given name is deleted; close
+        names are returned in similar_items, best first.
     """
-    questions = [f"Where is {item}?" for item in items]
-    query_vectors = await asyncio.gather(*(get_text_embedding(q) for q in questions))
+    top_k = top_k or settings.SIMILAR_TOP_K
+
+    # Misspelled names are only suggested, never deleted in place of the
+    # typed one: "box 1" and "box 2" are close names of different things
+    name_matches = await asyncio.gather(
+        *(match_name(user_id, "item", item) for item in items)
+    )
+
+    query_vectors = await asyncio.gather(
+        *(embed_query(f"Where is {item}?") for item in items)
+    )
     query_results = await asyncio.gather(
         *[
-            query_index_item(user_id, item, [vec], top_k)
+            # Without an embedding, fall back to an exact metadata lookup
+            query_index_item(user_id, item, [vec or metadata_probe_vector()], top_k)
             for item, vec in zip(items, query_vectors)
         ]
     )
 
     results = []
-    for item, query_result in zip(items, query_results):
+    for item, query_vector, query_result, matches in zip(
+        items, query_vectors, query_results, name_matches
+    ):
         if query_result[0]["matches"]:
             result = query_result[0]["matches"][0]
-            await asyncio.to_thread(index.delete, ids=[result["id"]])
+            await vector_store.delete(user_id, [result["id"]])
+            forget_vectors(user_id, [result["id"]])
             results.append(
                 {
                     "exact_item": result["metadata"]["item"],
@@ -164,17 +173,24 @@ async def process_items_in_batch(user_id: int, items: list[str], top_k: int = 3)
                 }
             )
         else:
-            # Handle similar items in batch
-            similar_query_results = await query_index(user_id, query_vectors, top_k)
-            similar_items = set()
+            # Search for similar items with the embedding of this item
+            similar_query_results = (
+                await query_index(user_id, [query_vector], top_k, text=item)
+                if query_vector
+                else []
+            )
+            scores = dict(matches)
             for res in similar_query_results:
-                matches = extract_valid_matches(res["matches"], 0.65)
-                matches = sort_by_score(matches)
-                similar_items.update([m["metadata"]["item"] for m in matches])
+                valid_matches = extract_valid_matches(
+                    res["matches"], settings.SIMILAR_ITEM_MIN_SCORE
+                )
+                for m in valid_matches:
+                    name = m["metadata"]["item"]
+                    scores[name] = max(scores.get(name, 0.0), m["score"])
             results.append(
                 {
                     "exact_item": "",
-                    "similar_items": similar_items,
+                    "similar_items": sorted(scores, key=scores.get, reverse=True),
                     "deleted_id": None,
                 }
             )
@@ -224,7 +240,9 @@ async def delete_memory_item(user_id: int, items: list[str]):
 
         # Generate a single response for all items
         response = await create_chain(
-            CREATE_DELETE_ITEM_RESPONSE, {"items": prompt_input}
+            CREATE_DELETE_ITEM_RESPONSE,
+            {"items": prompt_input},
+            fallback=fallbacks.delete_item_response,
         )
 
         if not any_item_deleted:
@@ -243,6 +261,8 @@ async def delete_memory_item(user_id: int, items: list[str]):
             "items": [],
         }
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(e)
         return JSONResponse(
@@ -264,28 +284,46 @@ async def process_location(user_id: int, location: str):
 
     Returns:
         dict: A dictionary containing exact items, similar locations, and deleted entries.
+        Only memories stored in exactly the given location are deleted; when
+        there are none, close location names are returned in
+        similar_locations, best first.
     """
-    question = f"What did I keep at {location}?"
-    query_vector = await get_text_embedding(question)
-    query_result = await query_index_location(
-        user_id, [query_vector], location, top_k=100
-    )
     exact_items = []
-    similar_locations = set()
+    similar_locations = []
     deleted_entries = []
 
-    if query_result[0]["matches"] != []:
-        results = query_result[0]["matches"]
-        for result in results:
-            await asyncio.to_thread(index.delete, ids=[result.id])
-            deleted_entries.append(result.id)
-            exact_items.append(result["metadata"]["item"])
-    else:
-        query_result_similar = await query_index(user_id, [query_vector], top_k=3)
-        matches = extract_valid_matches(query_result_similar[0]["matches"], 0.75)
-        if matches:
-            for match in matches:
-                similar_locations.add(match["metadata"]["location"])
+    # Delete every memory stored in the location, one batch per page
+    async for page in scan_index(user_id, {"location": location.lower().strip()}):
+        page_ids = [result.id for result in page]
+        await vector_store.delete(user_id, page_ids)
+        forget_vectors(user_id, page_ids)
+        deleted_entries.extend(page_ids)
+        exact_items.extend(result["metadata"]["item"] for result in page)
+
+    if not deleted_entries:
+        # Misspelled names are only suggested, never deleted in their place
+        scores = dict(await match_name(user_id, "location", location))
+        question = f"What did I keep at {location}?"
+        query_vector = await embed_query(question)
+        query_result_similar = (
+            await query_index(
+                user_id, [query_vector], top_k=settings.SIMILAR_TOP_K, text=location
+            )
+            if query_vector
+            else []
+        )
+        matches = (
+            extract_valid_matches(
+                query_result_similar[0]["matches"],
+                settings.DELETE_SIMILAR_LOCATION_MIN_SCORE,
+            )
+            if query_result_similar
+            else []
+        )
+        for match in matches:
+            name = match["metadata"]["location"]
+            scores[name] = max(scores.get(name, 0.0), match["score"])
+        similar_locations = sorted(scores, key=scores.get, reverse=True)
 
     return {
         "exact_items": exact_items,
@@ -340,7 +378,9 @@ async def delete_memory_location(user_id: int, locations: list[str]):
 
         # Generate a single response for all locations
         response = await create_chain(
-            CREATE_DELETE_RESPONSE, {"locations": prompt_input}
+            CREATE_DELETE_RESPONSE,
+            {"locations": prompt_input},
+            fallback=fallbacks.delete_location_response,
         )
 
         if not any_location_deleted:
@@ -359,6 +399,8 @@ async def delete_memory_location(user_id: int, locations: list[str]):
             "items": [],
         }
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(e)
         return JSONResponse(
@@ -370,8 +412,45 @@ async def delete_memory_location(user_id: int, locations: list[str]):
         )
 
 
+metrics.register_gauge(
+    "speculative_insert_hit_rate",
+    lambda: metrics.ratio("speculative_insert_hits", "speculative_insert_started"),
+)
+
+
+def discard_speculative_insert(task: asyncio.Task, started_at: float) -> None:
+    """
+    Cancel or drop a speculative prepare_insert task whose result is not
+    needed and record how much work was wasted.
+
+    Args:
+        task (asyncio.Task): The speculative prepare_insert task.
+        started_at (float): Loop time at which the task was started.
+    """
+    if task.done():
+        metrics.increment("speculative_insert_discarded")
+        if not task.cancelled() and task.exception():
+            print(f"Speculative insert failed: {task.exception()}")
+    else:
+        task.cancel()
+        metrics.increment("speculative_insert_cancelled")
+    metrics.increment(
+        "speculative_insert_wasted_seconds",
+        asyncio.get_running_loop().time() - started_at,
+    )
+
+
+@with_request_deadline
 async def insert_delete(data: EmbeddingRequest):
+    speculative_task = None
     try:
+        if settings.SPECULATIVE_INSERT:
+            # Most saved texts are inserts, so separate and embed them while
+            # the intent is still being classified.
+            started_at = asyncio.get_running_loop().time()
+            speculative_task = asyncio.create_task(prepare_insert(data))
+            metrics.increment("speculative_insert_started")
+
         tools = types.Tool(
             function_declarations=[
                 insert_memory_declaration,
@@ -381,16 +460,56 @@ async def insert_delete(data: EmbeddingRequest):
         )
         model = genai.GenerativeModel("models/gemini-2.0-flash", tools=[tools])
 
-        response = await asyncio.to_thread(model.generate_content, data.text)
-
-        function_call = response.candidates[0].content.parts[0].function_call
-
-        if function_call.name == "insert_embedding":
+        try:
+            response = await call_blocking(
+                "function_call",
+                model.generate_content,
+                data.text,
+                request_options=sdk_request_options(),
+                breaker=function_calling_breaker,
+            )
+            function_call = response.candidates[0].content.parts[0].function_call
+            name, args = function_call.name, function_call.args
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not function_calling_breaker.degraded:
+                raise
+            # Gemini's breaker is open; route with keyword rules
+            print(f"Function calling failed, routing locally: {e}")
+            metrics.increment("fallbacks:function_call")
+            name, args = fallbacks.route_save(data.text) or ("", {})
+            if name in ("delete_memory_item", "delete_memory_location"):
+                # Keyword rules are not trusted to delete memories
+                metrics.increment("fallbacks:delete_rejected")
+                return JSONResponse(
+                    status_code=503,
+                    content={
+                        "status": 503,
+                        "error": "Deleting memories is temporarily unavailable. Please try again later.",
+                    },
+                )
+
+        if speculative_task and name != "insert_embedding":
+            discard_speculative_insert(speculative_task, started_at)
+            speculative_task = None
+
+        if name == "insert_embedding":
+            if speculative_task:
+                task, speculative_task = speculative_task, None
+                metrics.increment("speculative_insert_hits")
+                try:
+                    prepared = await task
+                except Exception as e:
+                    # Redo the preparation as part of the regular insert
+                    print(f"Speculative insert failed: {e}")
+                    prepared = None
+                return await insert_embedding(data, prepared=prepared)
             return await insert_embedding(data)
-        elif function_call.name == "delete_memory_item":
-            return await delete_memory_item(data.user_id, **function_call.args)
-        elif function_call.name == "delete_memory_location":
-            return await delete_memory_location(data.user_id, **function_call.args)
+        elif name == "delete_memory_item":
+            return await delete_memory_item(data.user_id, **args)
+        elif name == "delete_memory_location":
+            return await delete_memory_location(data.user_id, **args)
         else:
             return JSONResponse(
                 status_code=400,
@@ -400,6 +519,15 @@ async def insert_delete(data: EmbeddingRequest):
                 },
             )
 
+    except DeadlineExceeded as e:
+        print(e)
+        return JSONResponse(
+            status_code=504,
+            content={
+                "status": 504,
+                "error": "The request took too long to process. Please try again.",
+            },
+        )
     except Exception as e:
         print(e)
         return JSONResponse(
@@ -409,3 +537,6 @@ async def insert_delete(data: EmbeddingRequest):
                 "error": "An unexpected error occurred while processing the statement. Please try again.",
             },
         )
+    finally:
+        if speculative_task:
+            discard_speculative_insert(speculative_task, started_at)
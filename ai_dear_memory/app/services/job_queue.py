@@ -0,0 +1,347 @@
+import json
+import uuid
+import asyncio
+import datetime
+import functools
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from sqlalchemy import delete, func, or_, update
+from app.core.config import settings
+from app.state_database import StateBase, StateSessionLocal, state_engine
+from app.models.save_job import SaveJob, utc_now
+from app.schemas.embeddings import EmbeddingRequest
+from app.services import cost_accounting, metrics, vector_store
+from app.services.insert_and_delete import insert_delete
+
+
+class QueueFullError(Exception):
+    """Raised when a save cannot be enqueued because of backpressure limits."""
+
+
+# Endpoint name under which the cost of background saves is reported
+SAVE_JOB_ENDPOINT = "POST /user_queries/save (background)"
+
+_workers: list[asyncio.Task] = []
+_wake = asyncio.Event()
+
+
+def _count(session, **filters) -> int:
+    return session.query(func.count(SaveJob.id)).filter_by(**filters).scalar()
+
+
+def _enqueue(user_id: int, text: str) -> str:
+    with StateSessionLocal() as session:
+        if _count(session, status="queued") >= settings.SAVE_QUEUE_MAX_DEPTH:
+            raise QueueFullError("The save queue is full.")
+        if (
+            _count(session, status="queued", user_id=user_id)
+            >= settings.SAVE_QUEUE_MAX_PER_USER
+        ):
+            raise QueueFullError("Too many pending saves for this user.")
+
+        job = SaveJob(id=str(uuid.uuid4()), user_id=user_id, text=text)
+        session.add(job)
+        session.commit()
+        return job.id
+
+
+def _lease_expiry() -> datetime.datetime:
+    return utc_now() + datetime.timedelta(seconds=settings.SAVE_JOB_LEASE_SECONDS)
+
+
+def _claim_next() -> dict | None:
+    """Atomically move the oldest queued job to running, under a new lease."""
+    with StateSessionLocal() as session:
+        while True:
+            job = (
+                session.query(SaveJob)
+                .filter_by(status="queued")
+                .order_by(SaveJob.created_at)
+                .first()
+            )
+            if job is None:
+                return None
+            claim_id = str(uuid.uuid4())
+            claimed = session.execute(
+                update(SaveJob)
+                .where(SaveJob.id == job.id, SaveJob.status == "queued")
+                .values(
+                    status="running",
+                    started_at=utc_now(),
+                    attempts=SaveJob.attempts + 1,
+                    claim_id=claim_id,
+                    lease_expires_at=_lease_expiry(),
+                )
+            ).rowcount
+            session.commit()
+            if claimed:
+                return {
+                    "id": job.id,
+                    "user_id": job.user_id,
+                    "text": job.text,
+                    "created_at": job.created_at,
+                    "claim_id": claim_id,
+                }
+
+
+def _renew_lease(job_id: str, claim_id: str) -> bool:
+    """Extend the lease of a job still held by this claim."""
+    with StateSessionLocal() as session:
+        renewed = session.execute(
+            update(SaveJob)
+            .where(
+                SaveJob.id == job_id,
+                SaveJob.claim_id == claim_id,
+                SaveJob.status == "running",
+            )
+            .values(lease_expires_at=_lease_expiry())
+        ).rowcount
+        session.commit()
+        return bool(renewed)
+
+
+def _finish(job_id: str, claim_id: str, status: str, result_status: int, result) -> bool:
+    """Record the result of a job still held by this claim."""
+    with StateSessionLocal() as session:
+        finished = session.execute(
+            update(SaveJob)
+            .where(SaveJob.id == job_id, SaveJob.claim_id == claim_id)
+            .values(
+                status=status,
+                result_status=result_status,
+                result=json.dumps(result),
+                finished_at=utc_now(),
+            )
+        ).rowcount
+        session.commit()
+        return bool(finished)
+
+
+def _release(job_id: str, claim_id: str) -> None:
+    """Put a job this worker will not finish back in the queue."""
+    with StateSessionLocal() as session:
+        session.execute(
+            update(SaveJob)
+            .where(SaveJob.id == job_id, SaveJob.claim_id == claim_id)
+            .values(status="queued", claim_id=None, lease_expires_at=None)
+        )
+        session.commit()
+
+
+def _requeue_expired() -> None:
+    """
+    Put running jobs whose lease expired back in the queue, or fail them after
+    SAVE_JOB_MAX_ATTEMPTS. Jobs of live workers keep renewing their lease.
+    """
+    expired = (
+        SaveJob.status == "running",
+        or_(SaveJob.lease_expires_at.is_(None), SaveJob.lease_expires_at < utc_now()),
+    )
+    with StateSessionLocal() as session:
+        requeued = session.execute(
+            update(SaveJob)
+            .where(*expired, SaveJob.attempts < settings.SAVE_JOB_MAX_ATTEMPTS)
+            .values(status="queued", claim_id=None, lease_expires_at=None)
+        ).rowcount
+        failed = session.execute(
+            update(SaveJob)
+            .where(*expired)
+            .values(
+                status="failed",
+                result_status=500,
+                finished_at=utc_now(),
+                claim_id=None,
+                lease_expires_at=None,
+            )
+        ).rowcount
+        session.commit()
+    if requeued:
+        metrics.increment("save_jobs_requeued", requeued)
+        _wake.set()
+    if failed:
+        metrics.increment("save_jobs_failed", failed)
+
+
+def _purge_finished() -> None:
+    """
+    Delete finished jobs, which hold the users' texts and results, once they
+    are older than SAVE_JOB_RETENTION_SECONDS.
+    """
+    if settings.SAVE_JOB_RETENTION_SECONDS <= 0:
+        return
+    cutoff = utc_now() - datetime.timedelta(seconds=settings.SAVE_JOB_RETENTION_SECONDS)
+    with StateSessionLocal() as session:
+        purged = session.execute(
+            delete(SaveJob).where(
+                SaveJob.status.in_(("succeeded", "failed")),
+                SaveJob.finished_at < cutoff,
+            )
+        ).rowcount
+        session.commit()
+    if purged:
+        metrics.increment("save_jobs_purged", purged)
+
+
+def queue_depth() -> int:
+    with StateSessionLocal() as session:
+        return _count(session, status="queued")
+
+
+def running_jobs() -> int:
+    with StateSessionLocal() as session:
+        return _count(session, status="running")
+
+
+def _get_job(job_id: str) -> dict | None:
+    with StateSessionLocal() as session:
+        job = session.get(SaveJob, job_id)
+        if job is None:
+            return None
+        return {
+            "job_id": job.id,
+            "user_id": job.user_id,
+            "status": job.status,
+            "result_status": job.result_status,
+            "result": json.loads(job.result) if job.result else None,
+        }
+
+
+async def enqueue_save(data: EmbeddingRequest) -> str:
+    """
+    Store a save request in the durable queue.
+
+    Args:
+        data (EmbeddingRequest): The validated save request.
+
+    Returns:
+        str: The job ID.
+
+    Raises:
+        QueueFullError: If the queue or the user's backlog is at its limit.
+    """
+    try:
+        job_id = await asyncio.to_thread(_enqueue, data.user_id, data.text)
+    except QueueFullError:
+        metrics.increment("save_jobs_rejected")
+        raise
+    metrics.increment("save_jobs_enqueued")
+    _wake.set()
+    return job_id
+
+
+async def get_job(job_id: str) -> dict | None:
+    """Return the status and, once finished, the result of a save job."""
+    return await asyncio.to_thread(_get_job, job_id)
+
+
+def serialize_result(result) -> tuple[int, dict]:
+    """Convert the return value of insert_delete to a status code and JSON body."""
+    if isinstance(result, Response):
+        return result.status_code, json.loads(result.body)
+    return 200, jsonable_encoder(result)
+
+
+async def _keep_lease(job: dict) -> None:
+    while True:
+        await asyncio.sleep(settings.SAVE_JOB_LEASE_SECONDS / 3)
+        try:
+            if not await asyncio.to_thread(_renew_lease, job["id"], job["claim_id"]):
+                print(f"Save job {job['id']} lost its lease")
+                return
+        except Exception as e:
+            print(f"Error renewing the lease of save job {job['id']}: {e}")
+
+
+async def run_job(job: dict) -> None:
+    created_at = job["created_at"]
+    if created_at.tzinfo is None:  # SQLite drops the timezone
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    metrics.increment(
+        "save_jobs_wait_seconds", (utc_now() - created_at).total_seconds()
+    )
+    lease = asyncio.create_task(_keep_lease(job))
+    # Every index write renews the lease first, and is refused once another
+    # worker re-claimed the job, so a save is never applied twice
+    still_claimed = functools.partial(_renew_lease, job["id"], job["claim_id"])
+    try:
+        with cost_accounting.request_scope(
+            SAVE_JOB_ENDPOINT, job["user_id"]
+        ), vector_store.write_scope(still_claimed):
+            result = await insert_delete(
+                EmbeddingRequest(user_id=job["user_id"], text=job["text"])
+            )
+        result_status, body = serialize_result(result)
+        status = "succeeded" if result_status < 500 else "failed"
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back rather than wait for the lease
+        await asyncio.to_thread(_release, job["id"], job["claim_id"])
+        raise
+    except Exception as e:
+        print(f"Save job {job['id']} failed: {e}")
+        result_status, body = 500, {
+            "status": 500,
+            "error": "An unexpected error occurred while saving the memory",
+        }
+        status = "failed"
+    finally:
+        lease.cancel()
+    finished = await asyncio.to_thread(
+        _finish, job["id"], job["claim_id"], status, result_status, body
+    )
+    if not finished:
+        print(f"Save job {job['id']} was taken over by another worker; result dropped")
+        metrics.increment("save_jobs_lease_lost")
+        return
+    metrics.increment(f"save_jobs_{status}")
+
+
+async def _worker() -> None:
+    while True:
+        try:
+            job = await asyncio.to_thread(_claim_next)
+        except Exception as e:
+            print(f"Error claiming save job: {e}")
+            job = None
+        if job is None:
+            _wake.clear()
+            try:
+                await asyncio.wait_for(
+                    _wake.wait(), timeout=settings.SAVE_QUEUE_POLL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job)
+
+
+async def _recovery_loop() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(_requeue_expired)
+        except Exception as e:
+            print(f"Error requeuing expired save jobs: {e}")
+        try:
+            await asyncio.to_thread(_purge_finished)
+        except Exception as e:
+            print(f"Error purging finished save jobs: {e}")
+        await asyncio.sleep(settings.SAVE_JOB_LEASE_SECONDS)
+
+
+async def start_workers() -> None:
+    """Create the queue table if needed, start the worker pool and the recovery of jobs whose worker died."""
+    await asyncio.to_thread(StateBase.metadata.create_all, state_engine)
+    metrics.register_gauge("save_queue_depth", queue_depth)
+    metrics.register_gauge("save_jobs_running", running_jobs)
+    _workers.append(asyncio.create_task(_recovery_loop()))
+    _workers.extend(
+        asyncio.create_task(_worker()) for _ in range(settings.SAVE_WORKERS)
+    )
+
+
+async def stop_workers() -> None:
+    """Cancel the worker pool, putting the jobs it was running back in the queue."""
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
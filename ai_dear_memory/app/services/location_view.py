@@ -0,0 +1,346 @@
+"""
+Materialized location -> items view of the users' memories.
+
+"What did I keep in X?" only needs the items whose location is X. The view
+keeps one row per memory in the state database. vector_store updates it in
+one transaction after every upsert and delete, so renames, deletions and
+maintenance keep it current, and a listing is a single indexed read instead
+of paging through the vector index.
+
+Users whose memories predate the view are listed from the index while a
+background task copies their memories in; from then on they are read from
+the view. Whether a user's view is complete is kept in the state database
+and checked on every listing, so all processes agree on it. If updating the
+view fails, the user is listed from the index again until the view is
+rebuilt. A rebuild only marks the user complete if their memory version
+(app.services.memory_versions) did not change while it ran.
+
+The mark names the index the view was built from, and only processes reading
+that index trust it. The local backend keeps a separate index in each process,
+so there every process has its own index ID. A write from another index
+removes the mark, since its rows do not belong to the index the view mirrors.
+
+Usage (from the ai_dear_memory directory), to rebuild users by hand, or to
+empty the view after the app ran with LOCATION_VIEW off:
+    python -m app.services.location_view --user-id 42
+    python -m app.services.location_view --reset
+"""
+
+import uuid
+import asyncio
+import argparse
+from sqlalchemy import or_
+from app.core.config import settings
+from app.state_database import StateBase, StateSessionLocal, state_engine
+from app.models.location_view import LocationItem, LocationViewUser
+from app.models.save_job import utc_now
+from app.services import memory_versions, metrics, vector_store
+
+# The index the view mirrors: shared by all processes with Pinecone, private
+# to this process with the local backend
+INDEX_ID = (
+    f"local:{uuid.uuid4().hex}"
+    if settings.VECTOR_BACKEND == "local"
+    else f"pinecone:{settings.INDEX_NAME}"
+)
+
+_tables_created = False
+_untrusted: set[int] = set()  # users whose view could not even be unmarked
+_pending_rebuilds: set[int] = set()
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+
+
+def _create_tables() -> None:
+    # Also needed by the command line tools that write memories, so the
+    # tables are created on first use rather than at startup
+    global _tables_created
+    if not _tables_created:
+        StateBase.metadata.create_all(state_engine)
+        _tables_created = True
+
+
+def normalize_location(location: str) -> str:
+    return location.lower().strip()
+
+
+def _view_rows(user_id: int, vectors: list) -> list[LocationItem]:
+    rows = []
+    for vector in vectors:
+        if isinstance(vector, dict):
+            vector_id, metadata = vector["id"], vector["metadata"]
+        else:
+            vector_id, metadata = vector[0], vector[2]
+        if metadata.get("location") and metadata.get("item"):
+            rows.append(
+                LocationItem(
+                    vector_id=vector_id,
+                    user_id=user_id,
+                    location=normalize_location(metadata["location"]),
+                    item=metadata["item"],
+                )
+            )
+    return rows
+
+
+def _unmark_other_indexes(session, user_id: int) -> None:
+    session.query(LocationViewUser).filter(
+        LocationViewUser.user_id == user_id,
+        or_(LocationViewUser.index_id != INDEX_ID, LocationViewUser.index_id.is_(None)),
+    ).delete(synchronize_session=False)
+
+
+def _write(user_id: int, vector_ids: list, rows: list) -> None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        session.query(LocationItem).filter(
+            LocationItem.vector_id.in_(vector_ids)
+        ).delete(synchronize_session=False)
+        session.add_all(rows)
+        _unmark_other_indexes(session, user_id)
+        session.commit()
+
+
+def _unmark(user_id: int) -> None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        session.query(LocationViewUser).filter_by(user_id=user_id).delete()
+        session.commit()
+
+
+async def _invalidate(user_id: int) -> None:
+    try:
+        await asyncio.to_thread(_unmark, user_id)
+    except Exception as e:
+        print(f"Error invalidating location view: {e}")
+        _untrusted.add(user_id)
+
+
+async def _apply(user_id: int, vector_ids: list, rows: list) -> None:
+    try:
+        await asyncio.to_thread(_write, user_id, vector_ids, rows)
+    except Exception as e:
+        print(f"Error updating location view: {e}")
+        await _invalidate(user_id)
+
+
+async def record_upsert(user_id: int, vectors: list) -> None:
+    """
+    Replace the view rows of written vectors.
+
+    Args:
+        user_id (int): The user ID.
+        vectors (list): The records passed to index.upsert.
+    """
+    if not settings.LOCATION_VIEW:
+        return
+    rows = _view_rows(user_id, vectors)
+    ids = [vector["id"] if isinstance(vector, dict) else vector[0] for vector in vectors]
+    await _apply(user_id, ids, rows)
+
+
+async def record_delete(user_id: int, vector_ids: list) -> None:
+    """Remove the view rows of deleted vectors."""
+    if not settings.LOCATION_VIEW:
+        return
+    await _apply(user_id, vector_ids, [])
+
+
+def _delete_user_rows(user_id: int) -> None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        session.query(LocationItem).filter_by(user_id=user_id).delete(
+            synchronize_session=False
+        )
+        _unmark_other_indexes(session, user_id)
+        session.commit()
+
+
+async def record_delete_user(user_id: int) -> None:
+    """Remove all view rows of a user whose memories were deleted at once."""
+    if not settings.LOCATION_VIEW:
+        return
+    try:
+        await asyncio.to_thread(_delete_user_rows, user_id)
+    except Exception as e:
+        print(f"Error updating location view: {e}")
+        await _invalidate(user_id)
+
+
+def _built(session, user_id: int) -> bool:
+    mark = session.get(LocationViewUser, user_id)
+    return mark is not None and mark.index_id == INDEX_ID
+
+
+def _is_built(user_id: int) -> bool:
+    _create_tables()
+    with StateSessionLocal() as session:
+        return _built(session, user_id)
+
+
+def _select(user_id: int, location: str) -> list[tuple[str, str]] | None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        if not _built(session, user_id):
+            return None
+        return [
+            (row.vector_id, row.item)
+            for row in session.query(LocationItem.vector_id, LocationItem.item).filter_by(
+                user_id=user_id, location=location
+            )
+        ]
+
+
+async def preload(user_id: int) -> None:
+    """Look up whether the user's view is complete, rebuilding it if not."""
+    if not settings.LOCATION_VIEW:
+        return
+    if not await asyncio.to_thread(_is_built, user_id):
+        schedule_rebuild(user_id)
+
+
+async def list_items(user_id: int, location: str) -> list[tuple[str, str]] | None:
+    """
+    List the memories stored in a location from the view.
+
+    Args:
+        user_id (int): The user ID.
+        location (str): The stored location name.
+
+    Returns:
+        list[tuple[str, str]] | None: (vector_id, item) pairs, or None when the
+        view is disabled or does not hold all of the user's memories yet. The
+        caller must then list the location from the index.
+    """
+    if not settings.LOCATION_VIEW:
+        return None
+    try:
+        rows = (
+            None
+            if user_id in _untrusted
+            else await asyncio.to_thread(_select, user_id, normalize_location(location))
+        )
+    except Exception as e:
+        print(f"Error reading location view: {e}")
+        return None
+    if rows is None:
+        schedule_rebuild(user_id)
+        metrics.increment("location_view_misses")
+        return None
+    metrics.increment("location_view_reads")
+    return rows
+
+
+def _replace_user(user_id: int, rows: list) -> None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        session.query(LocationItem).filter_by(user_id=user_id).delete(
+            synchronize_session=False
+        )
+        session.add_all(rows)
+        session.merge(
+            LocationViewUser(user_id=user_id, built_at=utc_now(), index_id=INDEX_ID)
+        )
+        session.commit()
+
+
+async def rebuild(user_id: int) -> bool:
+    """
+    Copy all of a user's memories from the index into the view.
+
+    The user's memory version is read before the index is scanned and again
+    once the rows are replaced. Writers increase it before updating the view,
+    so a write that the replaced rows may have overwritten always shows up as
+    a new version, and the user is then left unmarked. Users who wrote within
+    WRITE_OVERLAY_SECONDS are not rebuilt yet, as the scan may miss the write.
+
+    Returns:
+        bool: Whether the view now holds the user's memories. False when the
+        user's memories were written recently or meanwhile; the rebuild is
+        retried later.
+    """
+    version = await memory_versions.settled_version(user_id)
+    if version is None:
+        return False
+    rows = []
+    async for page in vector_store.scan_index(user_id):
+        rows.extend(
+            _view_rows(user_id, [(match["id"], None, match["metadata"]) for match in page])
+        )
+    if await memory_versions.settled_version(user_id) != version:
+        return False
+    await asyncio.to_thread(_replace_user, user_id, rows)
+    if await memory_versions.settled_version(user_id) != version:
+        await asyncio.to_thread(_unmark, user_id)
+        return False
+    _untrusted.discard(user_id)
+    metrics.increment("location_view_rebuilds")
+    return True
+
+
+def schedule_rebuild(user_id: int) -> None:
+    """Queue a user for a background rebuild of their view."""
+    if _wakeup is None:
+        return
+    _pending_rebuilds.add(user_id)
+    _wakeup.set()
+
+
+async def _rebuild_loop() -> None:
+    while True:
+        await _wakeup.wait()
+        _wakeup.clear()
+        while _pending_rebuilds:
+            user_id = _pending_rebuilds.pop()
+            try:
+                if not await rebuild(user_id):
+                    _pending_rebuilds.add(user_id)
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error rebuilding location view of user {user_id}: {e}")
+
+
+def _reset() -> None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        session.query(LocationItem).delete()
+        session.query(LocationViewUser).delete()
+        session.commit()
+
+
+async def start() -> None:
+    """Create the view tables if needed and start the rebuild task."""
+    global _wakeup, _task
+    if not settings.LOCATION_VIEW:
+        return
+    await asyncio.to_thread(_create_tables)
+    metrics.register_gauge("location_view_pending_users", lambda: len(_pending_rebuilds))
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_rebuild_loop())
+
+
+async def stop() -> None:
+    global _wakeup, _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = _wakeup = None
+
+
+async def main(args) -> None:
+    if args.reset:
+        await asyncio.to_thread(_reset)
+        print("Emptied the location view; users are rebuilt when they next list a location.")
+    for user_id in args.user_id:
+        if await rebuild(user_id):
+            print(f"Rebuilt the location view of user {user_id}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--user-id", type=int, action="append", default=[])
+    parser.add_argument("--reset", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,316 @@
+"""
+Keep every user's memories bounded: merge duplicate entries for the same item
+and evict memories above MEMORY_QUOTA_PER_USER.
+
+Inside the app, users are queued for maintenance when they save and processed
+by a background task every MAINTENANCE_INTERVAL_SECONDS. A pass works on the
+complete list of the user's memories (vector_store.scan_index), so users are
+deferred while the index may not show all of their writes yet: within
+WRITE_OVERLAY_SECONDS of their last write, or when their memories are written
+during the pass. The same pass can be run by hand for specific users:
+    python -m app.services.memory_maintenance --user-id 42 --dry-run
+"""
+
+import asyncio
+import argparse
+import datetime
+from collections import Counter
+from app.core.config import settings
+from app.state_database import StateBase, StateSessionLocal, state_engine
+from app.models.memory_usage import MemoryUsage
+from app.models.save_job import utc_now
+from app.services import memory_versions, metrics, vector_store
+from app.services.name_index import forget_vectors, normalize_name, similarity
+
+EVICTION_POLICIES = ("oldest", "least_retrieved")
+
+_pending_users: set[int] = set()
+_retrievals: Counter = Counter()  # (user_id, vector_id) -> retrievals not yet stored
+_last_retrieved: dict[tuple, datetime.datetime] = {}
+_task: asyncio.Task | None = None
+
+
+def _tracking_retrievals() -> bool:
+    return (
+        settings.MAINTENANCE_INTERVAL_SECONDS > 0
+        and settings.MEMORY_QUOTA_PER_USER > 0
+        and settings.QUOTA_EVICTION == "least_retrieved"
+    )
+
+
+def record_retrievals(user_id: int, vector_ids) -> None:
+    """
+    Count memories returned to the user. Counts are kept in memory and stored
+    by the maintenance task, and only while least-retrieved eviction is on.
+    """
+    if not _tracking_retrievals():
+        return
+    now = utc_now()
+    for vector_id in vector_ids:
+        _retrievals[(user_id, vector_id)] += 1
+        _last_retrieved[(user_id, vector_id)] = now
+
+
+def schedule(user_id: int) -> None:
+    """Queue a user whose memories changed for the next maintenance pass."""
+    if settings.MAINTENANCE_INTERVAL_SECONDS > 0:
+        _pending_users.add(user_id)
+
+
+def pending_users() -> int:
+    return len(_pending_users)
+
+
+def _take_retrievals() -> tuple[dict, dict]:
+    retrievals, last_retrieved = dict(_retrievals), dict(_last_retrieved)
+    _retrievals.clear()
+    _last_retrieved.clear()
+    return retrievals, last_retrieved
+
+
+def _store_retrievals(retrievals: dict, last_retrieved: dict) -> None:
+    if not retrievals:
+        return
+    with StateSessionLocal() as session:
+        rows = {
+            row.vector_id: row
+            for row in session.query(MemoryUsage).filter(
+                MemoryUsage.vector_id.in_([vector_id for _, vector_id in retrievals])
+            )
+        }
+        for (user_id, vector_id), count in retrievals.items():
+            row = rows.get(vector_id)
+            if row is None:
+                row = MemoryUsage(vector_id=vector_id, user_id=user_id, retrieval_count=0)
+                session.add(row)
+                rows[vector_id] = row
+            row.retrieval_count += count
+            row.last_retrieved_at = last_retrieved[(user_id, vector_id)]
+        session.commit()
+
+
+async def flush_retrievals() -> None:
+    """Store the retrieval counts collected since the last flush."""
+    await asyncio.to_thread(_store_retrievals, *_take_retrievals())
+
+
+def _load_usage(user_id: int) -> dict:
+    with StateSessionLocal() as session:
+        return {
+            row.vector_id: (row.retrieval_count, row.last_retrieved_at)
+            for row in session.query(MemoryUsage).filter_by(user_id=user_id)
+        }
+
+
+def _forget_usage(vector_ids: list) -> None:
+    with StateSessionLocal() as session:
+        session.query(MemoryUsage).filter(
+            MemoryUsage.vector_id.in_(vector_ids)
+        ).delete(synchronize_session=False)
+        session.commit()
+
+
+def _saved_at(metadata: dict) -> datetime.datetime:
+    """UTC save time of a memory, naive so it compares with database values."""
+    try:
+        saved_at = datetime.datetime.fromisoformat(metadata["datetime"])
+    except (KeyError, TypeError, ValueError):
+        # Written before save times were recorded
+        return datetime.datetime.min
+    if saved_at.tzinfo is not None:
+        saved_at = saved_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return saved_at
+
+
+def find_duplicates(memories: list, min_score: float) -> list:
+    """
+    Group memories by item name and return the ids of every entry that is not
+    the latest of its group.
+
+    Args:
+        memories (list): Index matches with metadata.
+        min_score (float): Name similarity at which two items are the same
+            item; 1.0 only merges names that are equal once normalized.
+
+    Returns:
+        list: Vector ids of the superseded entries.
+    """
+    latest_first = sorted(memories, key=lambda m: _saved_at(m["metadata"]), reverse=True)
+    kept_names = []
+    duplicates = []
+    for memory in latest_first:
+        name = normalize_name(memory["metadata"].get("item", ""))
+        if any(
+            name == kept or (min_score < 1 and similarity(name, kept) >= min_score)
+            for kept in kept_names
+        ):
+            duplicates.append(memory["id"])
+        else:
+            kept_names.append(name)
+    return duplicates
+
+
+def choose_evictions(memories: list, quota: int, policy: str, usage: dict) -> list:
+    """
+    Pick the memories to remove so that at most `quota` remain.
+
+    Args:
+        memories (list): Index matches with metadata.
+        quota (int): Memories to keep; 0 keeps all of them.
+        policy (str): "oldest" evicts by save time, "least_retrieved" by
+            retrieval count, then by last retrieval (or save) time.
+        usage (dict): vector id -> (retrieval_count, last_retrieved_at).
+
+    Returns:
+        list: Vector ids to evict.
+    """
+    if not quota or len(memories) <= quota:
+        return []
+    if policy not in EVICTION_POLICIES:
+        raise ValueError(f"Unknown QUOTA_EVICTION {policy!r}")
+
+    def eviction_order(memory):
+        saved_at = _saved_at(memory["metadata"])
+        if policy == "oldest":
+            return (saved_at,)
+        count, last_retrieved_at = usage.get(memory["id"], (0, None))
+        if last_retrieved_at is not None:
+            last_retrieved_at = last_retrieved_at.replace(tzinfo=None)
+        return (count, max(saved_at, last_retrieved_at or saved_at))
+
+    ordered = sorted(memories, key=eviction_order)
+    return [memory["id"] for memory in ordered[: len(memories) - quota]]
+
+
+async def _remove(user_id: int, vector_ids: list) -> None:
+    page_size = settings.SCAN_PAGE_SIZE
+    for start in range(0, len(vector_ids), page_size):
+        batch = vector_ids[start : start + page_size]
+        await vector_store.delete(user_id, batch)
+        forget_vectors(user_id, batch)
+        await asyncio.to_thread(_forget_usage, batch)
+
+
+async def maintain_user(
+    user_id: int,
+    quota: int | None = None,
+    policy: str | None = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Compact a user's memories and enforce the quota.
+
+    Args:
+        user_id (int): The user to maintain.
+        quota (int | None): Defaults to MEMORY_QUOTA_PER_USER.
+        policy (str | None): Defaults to QUOTA_EVICTION.
+        dry_run (bool): Report what would be removed without removing it.
+
+    Returns:
+        dict: {"memories", "compacted", "evicted"} with the removed vector ids,
+        and "deferred" when the user wrote recently or during the pass, in
+        which case nothing is removed.
+    """
+    quota = settings.MEMORY_QUOTA_PER_USER if quota is None else quota
+    policy = policy or settings.QUOTA_EVICTION
+    deferred = {"memories": 0, "compacted": [], "evicted": [], "deferred": True}
+
+    version = await memory_versions.settled_version(user_id)
+    if version is None:
+        return deferred
+    memories = []
+    async for page in vector_store.scan_index(user_id):
+        memories.extend(page)
+
+    compacted = find_duplicates(memories, settings.COMPACTION_NAME_MIN_SCORE)
+    superseded = set(compacted)
+    remaining = [memory for memory in memories if memory["id"] not in superseded]
+    usage = (
+        await asyncio.to_thread(_load_usage, user_id)
+        if quota and policy == "least_retrieved"
+        else {}
+    )
+    evicted = choose_evictions(remaining, quota, policy, usage)
+    if await memory_versions.settled_version(user_id) != version:
+        return deferred
+
+    if not dry_run and (compacted or evicted):
+        await _remove(user_id, compacted + evicted)
+        metrics.increment("memories_compacted", len(compacted))
+        metrics.increment("memories_evicted", len(evicted))
+    return {"memories": len(memories), "compacted": compacted, "evicted": evicted}
+
+
+async def run_pending() -> None:
+    """Maintain every queued user, throttled to MAINTENANCE_USERS_PER_SECOND."""
+    await flush_retrievals()
+    users = list(_pending_users)
+    _pending_users.clear()
+    for user_id in users:
+        try:
+            if (await maintain_user(user_id)).get("deferred"):
+                _pending_users.add(user_id)
+        except asyncio.CancelledError:
+            _pending_users.add(user_id)
+            raise
+        except Exception as e:
+            print(f"Error maintaining memories of user {user_id}: {e}")
+            _pending_users.add(user_id)
+        await asyncio.sleep(1 / settings.MAINTENANCE_USERS_PER_SECOND)
+
+
+async def _maintenance_loop() -> None:
+    while True:
+        await asyncio.sleep(settings.MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            await run_pending()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error running memory maintenance: {e}")
+
+
+async def start() -> None:
+    """Create the usage table if needed and start the maintenance task."""
+    global _task
+    if settings.MAINTENANCE_INTERVAL_SECONDS <= 0:
+        return
+    await asyncio.to_thread(StateBase.metadata.create_all, state_engine)
+    metrics.register_gauge("maintenance_pending_users", pending_users)
+    _task = asyncio.create_task(_maintenance_loop())
+
+
+async def stop() -> None:
+    """Stop the maintenance task and store the collected retrieval counts."""
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+    await flush_retrievals()
+
+
+async def main(args) -> None:
+    await asyncio.to_thread(StateBase.metadata.create_all, state_engine)
+    for user_id in args.user_id:
+        result = await maintain_user(
+            user_id, quota=args.quota, policy=args.eviction, dry_run=args.dry_run
+        )
+        if result.get("deferred"):
+            print(f"User {user_id}: memories written recently, try again later.")
+            continue
+        action = "Would remove" if args.dry_run else "Removed"
+        print(
+            f"User {user_id}: {result['memories']} memories. {action} "
+            f"{len(result['compacted'])} duplicates and {len(result['evicted'])} over quota."
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--user-id", type=int, action="append", required=True)
+    parser.add_argument("--quota", type=int, help="Defaults to MEMORY_QUOTA_PER_USER")
+    parser.add_argument("--eviction", choices=EVICTION_POLICIES)
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(main(parser.parse_args()))
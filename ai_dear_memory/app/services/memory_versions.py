@@ -0,0 +1,149 @@
+"""
+Per-user memory versions and the ETags of GET /user_queries/retrieve.
+
+A user's version is increased in the state database after every write to
+their memories (vector_store.upsert and vector_store.delete, so saves,
+deletions, renames and maintenance all count), which keeps it consistent
+across app processes. The ETag of an answer combines the version with the
+normalized query: a client sending it back in If-None-Match gets 304 Not
+Modified, without any Gemini or index call, until the user's memories change.
+
+The index only shows a write to every reader some time after it returns, so
+answers are not tagged within WRITE_OVERLAY_SECONDS of the user's last write:
+they may still miss it. Neither are answers of users whose last write could
+not be recorded, until this process records it.
+
+The ETags are weak, as the wording of an answer is generated and may differ
+between two computations of the same answer.
+"""
+
+import re
+import asyncio
+import hashlib
+import datetime
+from sqlalchemy.exc import IntegrityError
+from app.core.config import settings
+from app.state_database import StateBase, StateSessionLocal, state_engine
+from app.models.memory_version import MemoryVersion
+from app.models.save_job import utc_now
+
+_tables_created = False
+_unrecorded: set[int] = set()  # users whose last bump failed in this process
+
+
+def _create_tables() -> None:
+    global _tables_created
+    if not _tables_created:
+        StateBase.metadata.create_all(state_engine)
+        _tables_created = True
+
+
+def _read(user_id: int) -> tuple[int, datetime.datetime | None]:
+    _create_tables()
+    with StateSessionLocal() as session:
+        row = session.get(MemoryVersion, user_id)
+        if row is None:
+            return 0, None
+        written_at = row.written_at
+        if written_at is not None and written_at.tzinfo is None:  # SQLite drops it
+            written_at = written_at.replace(tzinfo=datetime.timezone.utc)
+        return row.version, written_at
+
+
+def _increment(user_id: int) -> None:
+    _create_tables()
+    with StateSessionLocal() as session:
+        for _ in range(2):
+            updated = (
+                session.query(MemoryVersion)
+                .filter_by(user_id=user_id)
+                .update(
+                    {
+                        MemoryVersion.version: MemoryVersion.version + 1,
+                        MemoryVersion.written_at: utc_now(),
+                    }
+                )
+            )
+            if not updated:
+                session.add(
+                    MemoryVersion(user_id=user_id, version=1, written_at=utc_now())
+                )
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                # Another process created the row first; increment it instead
+                session.rollback()
+
+
+async def current(user_id: int) -> int:
+    """Return the version of a user's memories; 0 if they were never written."""
+    version, _ = await asyncio.to_thread(_read, user_id)
+    return version
+
+
+async def settled_version(user_id: int) -> int | None:
+    """
+    Return the version of a user's memories if every reader of the index now
+    sees all of their writes: the last one is older than WRITE_OVERLAY_SECONDS
+    and was recorded. Returns None otherwise, retrying a failed record.
+    """
+    if user_id in _unrecorded:
+        await bump(user_id)
+        return None
+    version, written_at = await asyncio.to_thread(_read, user_id)
+    if written_at is not None:
+        age = (utc_now() - written_at).total_seconds()
+        if age < settings.WRITE_OVERLAY_SECONDS:
+            return None
+    return version
+
+
+async def bump(user_id: int) -> None:
+    """
+    Record a write to a user's memories. Called once the write is done, so an
+    answer computed before it can never carry the new version. Versions are
+    kept up to date with CONDITIONAL_RETRIEVE off as well, so turning it back
+    on cannot validate answers that changed meanwhile. If the write cannot be
+    recorded, this process stops tagging the user's answers until it is.
+    """
+    try:
+        await asyncio.to_thread(_increment, user_id)
+        _unrecorded.discard(user_id)
+    except Exception as e:
+        _unrecorded.add(user_id)
+        print(f"Error updating memory version of user {user_id}: {e}")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase a query and drop the spacing and punctuation around its words."""
+    return " ".join(re.findall(r"[\w'-]+", text.lower()))
+
+
+def etag(user_id: int, version: int, text: str) -> str:
+    """
+    Build the ETag of the answer to a query.
+
+    Args:
+        user_id (int): The user ID.
+        version (int): The version of the user's memories.
+        text (str): The query, without its "Dear Memory" prefix.
+
+    Returns:
+        str: A weak ETag, e.g. W/"42-3-5f1c0a9e2b7d4c61".
+    """
+    digest = hashlib.sha256(normalize_query(text).encode()).hexdigest()[:16]
+    return f'W/"{user_id}-{version}-{digest}"'
+
+
+def matches(if_none_match: str | None, tag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = tag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
@@ -0,0 +1,54 @@
+from collections import Counter
+from typing import Callable
+
+_counters: Counter = Counter()
+_gauges: dict[str, Callable[[], float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    """
+    Increase a named counter.
+
+    Args:
+        name (str): The counter name.
+        value (float): The amount to add.
+    """
+    _counters[name] += value
+
+
+def register_gauge(name: str, read: Callable[[], float]) -> None:
+    """
+    Register a gauge whose value is read every time metrics are collected.
+
+    Args:
+        name (str): The gauge name.
+        read (Callable[[], float]): Function returning the current value.
+    """
+    _gauges[name] = read
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    """Return the ratio of two counters, or 0 when the denominator is 0."""
+    total = _counters[denominator]
+    return _counters[numerator] / total if total else 0.0
+
+
+def snapshot() -> dict:
+    """
+    Collect the current value of every counter and gauge.
+
+    Returns:
+        dict: Metric name to value.
+    """
+    values = dict(_counters)
+    for name, read in _gauges.items():
+        try:
+            values[name] = read()
+        except Exception as e:
+            print(f"Error reading gauge {name}: {e}")
+    return values
+
+
+def reset() -> None:
+    """Clear all counters. Gauges stay registered."""
+    _counters.clear()
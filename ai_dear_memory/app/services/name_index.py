@@ -0,0 +1,227 @@
+import time
+import asyncio
+from collections import OrderedDict, defaultdict
+from app.core.config import settings
+from app.services import vector_store
+
+FIELDS = ("item", "location")
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def character_ngrams(name: str, n: int = 3) -> set[str]:
+    padded = f"  {name} "
+    return {padded[i : i + n] for i in range(len(padded) - n + 1)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """Edit-distance similarity in [0, 1]; 1 means identical."""
+    longest = max(len(a), len(b))
+    return 1 - edit_distance(a, b) / longest if longest else 1.0
+
+
+class NameIndex:
+    """
+    Character n-gram index over the names stored in one metadata field
+    (item or location) of a single user's memories.
+    """
+
+    def __init__(self):
+        self.vector_ids = defaultdict(set)  # name -> vector ids
+        self.names_by_vector = {}  # vector id -> name
+        self.ngrams = defaultdict(set)  # ngram -> names
+
+    def add(self, name: str, vector_id: str) -> None:
+        name = normalize_name(name)
+        if not name:
+            return
+        self.remove(vector_id)
+        self.vector_ids[name].add(vector_id)
+        self.names_by_vector[vector_id] = name
+        for gram in character_ngrams(name):
+            self.ngrams[gram].add(name)
+
+    def remove(self, vector_id: str) -> None:
+        name = self.names_by_vector.pop(vector_id, None)
+        if name is None:
+            return
+        self.vector_ids[name].discard(vector_id)
+        if not self.vector_ids[name]:
+            del self.vector_ids[name]
+            for gram in character_ngrams(name):
+                self.ngrams[gram].discard(name)
+                if not self.ngrams[gram]:
+                    del self.ngrams[gram]
+
+    def match(self, query: str, min_score: float, limit: int = 5) -> list[tuple]:
+        """
+        Find stored names close to the query.
+
+        Args:
+            query (str): The (possibly misspelled) name.
+            min_score (float): Minimum similarity to return.
+            limit (int): Maximum number of matches.
+
+        Returns:
+            list[tuple]: (name, score) pairs, best first.
+        """
+        query = normalize_name(query)
+        if not query:
+            return []
+        if query in self.vector_ids:
+            return [(query, 1.0)]
+
+        candidates = set()
+        for gram in character_ngrams(query):
+            candidates.update(self.ngrams.get(gram, ()))
+
+        scored = [(name, similarity(query, name)) for name in candidates]
+        scored = [(name, round(score, 3)) for name, score in scored if score >= min_score]
+        return sorted(scored, key=lambda x: x[1], reverse=True)[:limit]
+
+
+# user_id -> {"item": NameIndex, "location": NameIndex}, least recently used
+# first; at most NAME_INDEX_MAX_USERS are kept
+_user_indexes: OrderedDict[int, dict] = OrderedDict()
+_hydrated_at = {}  # user_id -> time of the last full load
+_hydrations = {}  # user_id -> in-flight hydration task
+_writes_during_hydration = {}  # user_id -> writes to replay once loaded
+
+
+def _indexes(user_id: int) -> dict:
+    if user_id in _user_indexes:
+        _user_indexes.move_to_end(user_id)
+    else:
+        _user_indexes[user_id] = {field: NameIndex() for field in FIELDS}
+        while len(_user_indexes) > settings.NAME_INDEX_MAX_USERS:
+            evicted, _ = _user_indexes.popitem(last=False)
+            _hydrated_at.pop(evicted, None)
+    return _user_indexes[user_id]
+
+
+def _add(indexes: dict, vectors: list) -> None:
+    for vector_id, _, metadata in vectors:
+        for field in FIELDS:
+            if metadata.get(field):
+                indexes[field].add(metadata[field], vector_id)
+
+
+def _forget(indexes: dict, vector_ids: list) -> None:
+    for vector_id in vector_ids:
+        for field in FIELDS:
+            indexes[field].remove(vector_id)
+
+
+def record_vectors(user_id: int, vectors: list) -> None:
+    """
+    Add or update names from written vectors.
+
+    Args:
+        user_id (int): The user ID.
+        vectors (list): (vector_id, values, metadata) tuples as passed to upsert.
+    """
+    if user_id in _writes_during_hydration:
+        _writes_during_hydration[user_id].append((_add, vectors))
+    _add(_indexes(user_id), vectors)
+
+
+def forget_vectors(user_id: int, vector_ids: list) -> None:
+    """Remove deleted vectors from the user's name index."""
+    if user_id in _writes_during_hydration:
+        _writes_during_hydration[user_id].append((_forget, vector_ids))
+    _forget(_indexes(user_id), vector_ids)
+
+
+async def _hydrate(user_id: int) -> None:
+    # Writes made while the index is scanned may or may not be in the scan;
+    # they are applied again, in order, on top of it
+    _writes_during_hydration[user_id] = []
+    try:
+        indexes = {field: NameIndex() for field in FIELDS}
+        async for page in vector_store.scan_index(user_id):
+            _add(indexes, [(match["id"], None, match["metadata"]) for match in page])
+        for apply, writes in _writes_during_hydration[user_id]:
+            apply(indexes, writes)
+    finally:
+        del _writes_during_hydration[user_id]
+    _indexes(user_id)  # counts towards NAME_INDEX_MAX_USERS
+    _user_indexes[user_id] = indexes
+    _hydrated_at[user_id] = time.monotonic()
+
+
+async def ensure_loaded(user_id: int) -> None:
+    """Load the user's stored names once per NAME_INDEX_TTL_SECONDS."""
+    loaded_at = _hydrated_at.get(user_id)
+    if loaded_at and time.monotonic() - loaded_at < settings.NAME_INDEX_TTL_SECONDS:
+        return
+    if user_id not in _hydrations:
+        _hydrations[user_id] = asyncio.create_task(_hydrate(user_id))
+    try:
+        await asyncio.shield(_hydrations[user_id])
+    finally:
+        if _hydrations.get(user_id) and _hydrations[user_id].done():
+            del _hydrations[user_id]
+
+
+def clear() -> None:
+    _user_indexes.clear()
+    _hydrated_at.clear()
+    _hydrations.clear()
+    _writes_during_hydration.clear()
+
+
+def best_match(matches: list) -> str | None:
+    """Return the best stored name if it is close enough to be used as-is."""
+    if matches and matches[0][1] >= settings.FUZZY_MATCH_MIN_SCORE:
+        return matches[0][0]
+    return None
+
+
+async def match_name(
+    user_id: int, field: str, name: str, min_score: float | None = None
+) -> list:
+    """
+    Find the user's stored item or location names close to the given name.
+
+    Args:
+        user_id (int): The user ID.
+        field (str): "item" or "location".
+        name (str): The name as typed by the user.
+        min_score (float | None): Minimum similarity to return. Defaults to
+            FUZZY_SUGGEST_MIN_SCORE.
+
+    Returns:
+        list[tuple]: (name, score) pairs, best first. Empty when fuzzy matching
+        is disabled or the index could not be loaded.
+    """
+    if not settings.FUZZY_MATCHING:
+        return []
+    try:
+        await ensure_loaded(user_id)
+    except Exception as e:
+        print(f"Error loading name index: {e}")
+        return []
+    if min_score is None:
+        min_score = settings.FUZZY_SUGGEST_MIN_SCORE
+    return _indexes(user_id)[field].match(name, min_score)
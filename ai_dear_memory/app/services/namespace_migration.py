@@ -0,0 +1,169 @@
+"""
+Copy memories from the shared namespace into the configured NAMESPACE_LAYOUT.
+
+The job is meant to run while the app keeps serving with NAMESPACE_DUAL_READ
+enabled. It pages through the shared namespace, writes every vector into its
+user's namespace and records its progress in a checkpoint file after each
+batch, so it can be stopped and resumed at any time. Once it has finished,
+turn NAMESPACE_DUAL_READ off.
+
+Usage (from the ai_dear_memory directory):
+    python -m app.services.namespace_migration --checkpoint migration.json
+"""
+
+import os
+import json
+import asyncio
+import argparse
+from collections import defaultdict
+from app.core.config import index, settings
+from app.services.vector_store import SHARED_NAMESPACE, namespace_for
+
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"pagination_token": None, "copied": 0, "skipped": 0, "done": False}
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+async def _present(ids: list, namespace: str) -> set:
+    fetched = await asyncio.to_thread(index.fetch, ids=ids, namespace=namespace)
+    return set(fetched.vectors)
+
+
+async def copy_batch(ids: list, delete_source: bool) -> tuple[int, int]:
+    """
+    Copy one batch of vectors from the shared namespace to their users'
+    namespaces. Vectors already present in the target were written by the app
+    after the migration started and are newer, so they are left untouched.
+
+    The app deletes a memory from both namespaces while dual-reading. To not
+    bring back a memory deleted while its batch is being copied, the source
+    is fetched again right before each upsert, and copies whose source is
+    gone right after the upsert are deleted again.
+
+    Returns:
+        tuple[int, int]: Number of copied and skipped vectors.
+    """
+    fetched = await asyncio.to_thread(index.fetch, ids=ids, namespace=SHARED_NAMESPACE)
+
+    by_namespace = defaultdict(list)
+    for vector_id, vector_data in fetched.vectors.items():
+        metadata = dict(vector_data["metadata"] or {})
+        if metadata.get("userId") is None:
+            print(f"Skipping vector {vector_id} without a userId")
+            continue
+        # Pinecone returns metadata numbers as floats
+        user_id = int(metadata["userId"])
+        metadata["userId"] = user_id
+        record = {"id": vector_id, "values": list(vector_data["values"]), "metadata": metadata}
+        sparse_values = vector_data.get("sparse_values")
+        if sparse_values:
+            record["sparse_values"] = sparse_values
+        by_namespace[namespace_for(user_id)].append(record)
+
+    copied = skipped = 0
+    migrated = []  # ids now held by their user's namespace
+    for namespace, records in by_namespace.items():
+        existing = await _present([r["id"] for r in records], namespace)
+        skipped += len(existing)
+        migrated.extend(existing)
+        records = [r for r in records if r["id"] not in existing]
+        if records:
+            source = await _present([r["id"] for r in records], SHARED_NAMESPACE)
+            records = [r for r in records if r["id"] in source]
+        if not records:
+            continue
+        await asyncio.to_thread(index.upsert, vectors=records, namespace=namespace)
+        record_ids = [r["id"] for r in records]
+        source = await _present(record_ids, SHARED_NAMESPACE)
+        deleted = [vector_id for vector_id in record_ids if vector_id not in source]
+        if deleted:
+            await asyncio.to_thread(index.delete, ids=deleted, namespace=namespace)
+        copied += len(record_ids) - len(deleted)
+        migrated.extend(vector_id for vector_id in record_ids if vector_id in source)
+
+    if delete_source and migrated:
+        await asyncio.to_thread(index.delete, ids=migrated, namespace=SHARED_NAMESPACE)
+    return copied, skipped
+
+
+async def migrate_namespaces(
+    checkpoint_path: str,
+    batch_size: int = 100,
+    batches_per_second: float = 2.0,
+    delete_source: bool = False,
+    max_batches: int | None = None,
+) -> dict:
+    """
+    Run (or resume) the namespace migration.
+
+    Args:
+        checkpoint_path (str): File recording the migration progress.
+        batch_size (int): Vectors copied per batch.
+        batches_per_second (float): Throttle applied between batches.
+        delete_source (bool): Remove copied vectors from the shared namespace.
+        max_batches (int | None): Stop after this many batches.
+
+    Returns:
+        dict: The checkpoint state.
+    """
+    if settings.NAMESPACE_LAYOUT == "shared":
+        raise ValueError("Set NAMESPACE_LAYOUT to 'user' or 'bucket' before migrating.")
+
+    state = load_checkpoint(checkpoint_path)
+    batches = 0
+    while not state["done"]:
+        page = await asyncio.to_thread(
+            index.list_paginated,
+            limit=batch_size,
+            pagination_token=state["pagination_token"],
+            namespace=SHARED_NAMESPACE,
+        )
+        ids = [vector.id for vector in page.vectors]
+        if ids:
+            copied, skipped = await copy_batch(ids, delete_source)
+            state["copied"] += copied
+            state["skipped"] += skipped
+
+        next_token = page.pagination.next if page.pagination else None
+        state["pagination_token"] = next_token
+        state["done"] = not next_token
+        save_checkpoint(checkpoint_path, state)
+        print(f"Migrated {state['copied']} vectors ({state['skipped']} already present)")
+
+        batches += 1
+        if max_batches and batches >= max_batches:
+            break
+        if not state["done"]:
+            await asyncio.sleep(1 / batches_per_second)
+
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--checkpoint", default="namespace_migration.json")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batches-per-second", type=float, default=2.0)
+    parser.add_argument("--delete-source", action="store_true")
+    parser.add_argument("--max-batches", type=int)
+    args = parser.parse_args()
+
+    asyncio.run(
+        migrate_namespaces(
+            args.checkpoint,
+            batch_size=args.batch_size,
+            batches_per_second=args.batches_per_second,
+            delete_source=args.delete_source,
+            max_batches=args.max_batches,
+        )
+    )
@@ -0,0 +1,136 @@
+"""
+Short-lived cache of item and location lookups that found nothing.
+
+Users often ask again for something they never saved ("where's my
+passport?"). A not-found lookup costs an embedding, a filtered and an
+unfiltered index query; its result, with the similar-name suggestions, is kept
+for NEGATIVE_CACHE_TTL_SECONDS per user and normalized name.
+
+Entries are keyed off the user's memory version (see memory_versions), which
+every write increases in the state database: lookups read it before they
+start, results are stored with it and only served while it is unchanged, so
+a save handled by any app process is visible at once, and a lookup racing a
+save cannot cache the state from before it. Nothing is cached or served
+within WRITE_OVERLAY_SECONDS of a write, while the index may not show it yet.
+"""
+
+import copy
+import time
+from collections import OrderedDict, defaultdict
+from app.core.config import settings
+from app.services import memory_versions, metrics
+
+# key -> (expiry time, memory version, result), oldest first
+_entries: OrderedDict[tuple, tuple[float, int, dict]] = OrderedDict()
+_keys_by_user: defaultdict[int, set] = defaultdict(set)
+
+metrics.register_gauge("negative_cache_entries", lambda: len(_entries))
+
+
+def _key(user_id: int, field: str, name: str, min_score: float) -> tuple:
+    # Same normalization as name_index, which cannot be imported here: it
+    # depends on vector_store, which invalidates this cache
+    return (user_id, field, " ".join(name.lower().split()), min_score)
+
+
+async def version(user_id: int) -> int | None:
+    """
+    Return the user's memory version, to be passed to get() and store(), or
+    None when the cache cannot be used: it is disabled, or the user's last
+    write is too recent for every reader of the index to see it.
+    """
+    if settings.NEGATIVE_CACHE_TTL_SECONDS <= 0:
+        return None
+    try:
+        return await memory_versions.settled_version(user_id)
+    except Exception as e:
+        print(f"Error reading memory version of user {user_id}: {e}")
+        return None
+
+
+def get(
+    user_id: int, field: str, name: str, min_score: float, version: int | None
+) -> dict | None:
+    """
+    Return the cached not-found result of a lookup.
+
+    Args:
+        user_id (int): The user ID.
+        field (str): "item" or "location".
+        name (str): The name as typed by the user.
+        min_score (float): Minimum score of the similar-name suggestions.
+        version (int | None): The user's version() when the lookup started.
+
+    Returns:
+        dict | None: A copy of the cached result, or None.
+    """
+    if version is None:
+        return None
+    key = _key(user_id, field, name, min_score)
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    expires_at, stored_version, result = entry
+    if expires_at < time.monotonic() or stored_version != version:
+        _discard(key)
+        return None
+    metrics.increment("negative_cache_hits")
+    return copy.deepcopy(result)
+
+
+def store(
+    user_id: int,
+    field: str,
+    name: str,
+    min_score: float,
+    result: dict,
+    version: int | None,
+) -> None:
+    """
+    Cache a not-found result under the memory version read before the lookup
+    started; a write since then makes it stale at once.
+
+    Args:
+        user_id (int): The user ID.
+        field (str): "item" or "location".
+        name (str): The name as typed by the user.
+        min_score (float): Minimum score of the similar-name suggestions.
+        result (dict): The lookup result.
+        version (int | None): The user's version() when the lookup started.
+    """
+    if version is None:
+        return
+    key = _key(user_id, field, name, min_score)
+    _discard(key)
+    _entries[key] = (
+        time.monotonic() + settings.NEGATIVE_CACHE_TTL_SECONDS,
+        version,
+        copy.deepcopy(result),
+    )
+    _keys_by_user[user_id].add(key)
+    metrics.increment("negative_cache_stores")
+    while len(_entries) > settings.NEGATIVE_CACHE_MAX_ENTRIES:
+        _discard(next(iter(_entries)))
+
+
+def _discard(key: tuple) -> None:
+    if _entries.pop(key, None) is None:
+        return
+    keys = _keys_by_user[key[0]]
+    keys.discard(key)
+    if not keys:
+        del _keys_by_user[key[0]]
+
+
+def invalidate_user(user_id: int) -> None:
+    """
+    Drop the user's cached results after this process wrote their memories.
+    They are stale already; this only frees them before their expiry.
+    """
+    for key in _keys_by_user.pop(user_id, ()):
+        _entries.pop(key, None)
+
+
+def clear() -> None:
+    _entries.clear()
+    _keys_by_user.clear()
@@ -0,0 +1,195 @@
+"""
+Provider-side caching of the static system messages of the prompts.
+
+Gemini refuses to cache less than a model-specific number of tokens
+(PROMPT_CACHE_MIN_TOKENS), more than any single system message holds. With
+PROMPT_CACHING, the static system messages of all prompts are therefore
+uploaded together as one Gemini cached content, a section per prompt. Calls
+reference the cache and only send their other messages, the first of which
+names the section to follow. The cache is recreated shortly before it expires,
+and dropped when Gemini no longer knows it. When the sections together stay
+below PROMPT_CACHE_MIN_TOKENS, prompts are sent as is.
+"""
+
+import time
+import datetime
+import threading
+from google.generativeai.caching import CachedContent
+from langchain_core.prompts import ChatPromptTemplate
+from app.core.config import genai, settings
+from app.prompts import info_extraction, item_matching, text_formatting
+from app.services import metrics
+
+# Recreate the cache when it has less than this left to live
+REFRESH_MARGIN_SECONDS = 60
+# Wait this long before trying again after the cache could not be created
+RETRY_SECONDS = 300
+
+PREFIX_HEADER = (
+    "This system instruction holds the instructions of several tasks, one "
+    "section per task. Every request names the section to follow: follow only "
+    "that section and ignore all the others."
+)
+SECTION_INSTRUCTION = 'Follow the instructions of section "{section}".'
+
+
+class CachedPrompt:
+    def __init__(
+        self, tokens: int | None, name: str | None = None, expires_at: float = float("inf")
+    ):
+        self.tokens = tokens
+        self.name = name
+        self.expires_at = expires_at
+
+
+_entry: CachedPrompt | None = None  # the shared cache
+_refreshing = False  # whether some thread is creating the shared cache
+_lock = threading.Lock()  # guards the two above; never held across Gemini calls
+_system_messages: dict[int, str | None] = {}  # prompt id -> system message
+_sections: dict[int, str] | None = None  # prompt id -> section name
+_prefix: str | None = None  # the shared system instruction
+
+
+def system_message(prompt_template) -> str | None:
+    """Return the text of the prompt's system message if it is fully static."""
+    key = id(prompt_template)
+    if key not in _system_messages:
+        text = None
+        if prompt_template and prompt_template[0][0] == "system":
+            prompt = ChatPromptTemplate.from_messages([prompt_template[0]])
+            if not prompt.input_variables:
+                text = prompt.format_messages()[0].content
+        _system_messages[key] = text
+    return _system_messages[key]
+
+
+def shared_prefix() -> str:
+    """Return the system instruction holding the static system message of every prompt."""
+    global _sections, _prefix
+    if _prefix is None:
+        sections, parts = {}, [PREFIX_HEADER]
+        for module in (info_extraction, item_matching, text_formatting):
+            for name, value in vars(module).items():
+                text = system_message(value) if name.isupper() else None
+                if text is not None:
+                    sections[id(value)] = name
+                    parts.append(f"### Section {name}\n\n{text.strip()}")
+        _sections, _prefix = sections, "\n\n".join(parts)
+    return _prefix
+
+
+def section(prompt_template) -> str | None:
+    """Return the name of the prompt's section of the shared prefix, if it has one."""
+    shared_prefix()
+    return _sections.get(id(prompt_template))
+
+
+def cached_messages(prompt_template) -> list:
+    """
+    Return the messages to send along with the shared cache: the prompt's
+    messages without its system message, the first one naming the section.
+    """
+    instruction = SECTION_INSTRUCTION.format(section=section(prompt_template))
+    messages = list(prompt_template[1:])
+    if messages and messages[0][0] == "human":
+        role, text = messages[0]
+        messages[0] = (role, f"{instruction}\n\n{text}")
+    else:
+        messages.insert(0, ("human", instruction))
+    return messages
+
+
+def count_tokens(text: str) -> int:
+    return genai.GenerativeModel(settings.CHAT_MODEL).count_tokens(text).total_tokens
+
+
+def create_cached_content(text: str, ttl_seconds: int) -> str:
+    cached = CachedContent.create(
+        model=settings.CHAT_MODEL,
+        system_instruction=text,
+        ttl=datetime.timedelta(seconds=ttl_seconds),
+    )
+    return cached.name
+
+
+def delete_cached_content(name: str) -> None:
+    CachedContent.get(name).delete()
+
+
+def _refresh(entry: CachedPrompt | None) -> CachedPrompt:
+    text = shared_prefix()
+    tokens = entry.tokens if entry else None
+    if tokens is None:
+        try:
+            tokens = count_tokens(text)
+        except Exception as e:
+            print(f"Error counting prompt tokens: {e}")
+            return CachedPrompt(None, expires_at=time.time() + RETRY_SECONDS)
+    if tokens < settings.PROMPT_CACHE_MIN_TOKENS:
+        return CachedPrompt(tokens)
+    try:
+        name = create_cached_content(text, settings.PROMPT_CACHE_TTL_SECONDS)
+    except Exception as e:
+        print(f"Error caching prompt: {e}")
+        return CachedPrompt(tokens, expires_at=time.time() + RETRY_SECONDS)
+    metrics.increment("prompt_cache_created")
+    if entry and entry.name:
+        metrics.increment("prompt_cache_refreshed")
+    return CachedPrompt(
+        tokens, name, expires_at=time.time() + settings.PROMPT_CACHE_TTL_SECONDS
+    )
+
+
+def cached_content(prompt_template) -> str | None:
+    """
+    Return the name of the shared cached content if it holds the prompt's
+    system message, creating or refreshing it if needed. Only one thread
+    creates the cache; the others keep using the current one, or the uncached
+    prompt, meanwhile.
+
+    Returns:
+        str | None: The cache name, or None when the prompt is not cached.
+    """
+    global _entry, _refreshing
+    if not settings.PROMPT_CACHING or section(prompt_template) is None:
+        return None
+
+    entry = _entry
+    if entry is None or entry.expires_at - time.time() < REFRESH_MARGIN_SECONDS:
+        with _lock:
+            entry = _entry
+            stale = entry is None or entry.expires_at - time.time() < REFRESH_MARGIN_SECONDS
+            if not stale or _refreshing:
+                return entry.name if entry else None
+            _refreshing = True
+        try:
+            refreshed = _refresh(entry)
+        finally:
+            with _lock:
+                _refreshing = False
+        with _lock:
+            entry = _entry = refreshed
+    return entry.name
+
+
+def invalidate(name: str) -> None:
+    """Forget a cache that Gemini no longer knows, so the next call recreates it."""
+    with _lock:
+        # Another thread may already have replaced it
+        if _entry and _entry.name == name:
+            _entry.name = None
+            _entry.expires_at = 0
+            metrics.increment("prompt_cache_expired")
+
+
+def delete_all() -> None:
+    """Delete the cache created by this process."""
+    global _entry
+    with _lock:
+        name = _entry.name if _entry else None
+        _entry = None
+    if name:
+        try:
+            delete_cached_content(name)
+        except Exception as e:
+            print(f"Error deleting cached prompt {name}: {e}")
@@ -0,0 +1,175 @@
+"""
+Re-embed stored memories with EMBEDDING_MODEL.
+
+Run it after switching EMBEDDING_MODEL, with the old model set as
+EMBEDDING_PREVIOUS_MODEL so the app keeps reading both generations meanwhile.
+The job pages through every namespace, re-embeds the sentences of the vectors
+written by another model in one batched call per page and rewrites them in
+place. Its progress is recorded in a checkpoint file after each batch, so it
+can be stopped and resumed at any time. Once it has finished, clear
+EMBEDDING_PREVIOUS_MODEL.
+
+Usage (from the ai_dear_memory directory):
+    python -m app.services.reembedding --checkpoint reembedding.json
+"""
+
+import os
+import json
+import asyncio
+import argparse
+from app.core.config import index, settings
+from app.services.namespace_migration import save_checkpoint
+from app.services.utils import get_text_embedding
+from app.services.vector_store import SHARED_NAMESPACE
+
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {
+        "model": settings.EMBEDDING_MODEL,
+        "namespaces": None,
+        "namespace_index": 0,
+        "pagination_token": None,
+        "reembedded": 0,
+        "skipped": 0,
+        "done": False,
+    }
+
+
+async def list_namespaces() -> list[str]:
+    stats = await asyncio.to_thread(index.describe_index_stats)
+    return sorted(stats.namespaces) or [SHARED_NAMESPACE]
+
+
+async def reembed_batch(namespace: str, ids: list, model: str) -> tuple[int, int]:
+    """
+    Re-embed the vectors of one batch that were not embedded with `model`.
+    Vectors without their original sentence are skipped, and so are vectors
+    the app rewrote while the batch was being embedded; those still carry an
+    old model tag and are picked up by the next run.
+
+    Returns:
+        tuple[int, int]: Number of re-embedded and skipped vectors.
+    """
+    fetched = await asyncio.to_thread(index.fetch, ids=ids, namespace=namespace)
+    stale = {
+        vector_id: vector_data
+        for vector_id, vector_data in fetched.vectors.items()
+        if vector_data["metadata"].get("embeddingModel") != model
+    }
+    embeddable = {
+        vector_id: vector_data
+        for vector_id, vector_data in stale.items()
+        if vector_data["metadata"].get("originalText")
+    }
+    skipped = len(stale) - len(embeddable)
+    if not embeddable:
+        return 0, skipped
+
+    embeddings = await get_text_embedding(
+        [vector_data["metadata"]["originalText"] for vector_data in embeddable.values()],
+        model=model,
+    )
+    if not embeddings:
+        raise RuntimeError("Embedding the batch failed; run the job again to resume.")
+
+    latest = await asyncio.to_thread(index.fetch, ids=list(embeddable), namespace=namespace)
+    records = []
+    for (vector_id, vector_data), values in zip(embeddable.items(), embeddings):
+        current = latest.vectors.get(vector_id)
+        if current is None or dict(current["metadata"]) != dict(vector_data["metadata"]):
+            skipped += 1
+            continue
+        metadata = {
+            **vector_data["metadata"],
+            "embeddingModel": model,
+            "embeddingDimension": len(values),
+        }
+        record = {"id": vector_id, "values": values, "metadata": metadata}
+        sparse_values = vector_data.get("sparse_values")
+        if sparse_values:
+            record["sparse_values"] = sparse_values
+        records.append(record)
+
+    if records:
+        await asyncio.to_thread(index.upsert, vectors=records, namespace=namespace)
+    return len(records), skipped
+
+
+async def reembed(
+    checkpoint_path: str,
+    batch_size: int = 50,
+    batches_per_second: float = 1.0,
+    max_batches: int | None = None,
+) -> dict:
+    """
+    Run (or resume) the re-embedding job.
+
+    Args:
+        checkpoint_path (str): File recording the job progress.
+        batch_size (int): Vectors re-embedded per batch (and per embedding call).
+        batches_per_second (float): Throttle applied between batches.
+        max_batches (int | None): Stop after this many batches.
+
+    Returns:
+        dict: The checkpoint state.
+    """
+    state = load_checkpoint(checkpoint_path)
+    if state["model"] != settings.EMBEDDING_MODEL:
+        raise ValueError(
+            f"The checkpoint re-embeds with {state['model']}, but EMBEDDING_MODEL "
+            f"is {settings.EMBEDDING_MODEL}. Use a new checkpoint file."
+        )
+    if state["namespaces"] is None:
+        state["namespaces"] = await list_namespaces()
+
+    batches = 0
+    while not state["done"]:
+        namespace = state["namespaces"][state["namespace_index"]]
+        page = await asyncio.to_thread(
+            index.list_paginated,
+            limit=batch_size,
+            pagination_token=state["pagination_token"],
+            namespace=namespace,
+        )
+        ids = [vector.id for vector in page.vectors]
+        if ids:
+            reembedded, skipped = await reembed_batch(namespace, ids, state["model"])
+            state["reembedded"] += reembedded
+            state["skipped"] += skipped
+
+        next_token = page.pagination.next if page.pagination else None
+        state["pagination_token"] = next_token
+        if not next_token:
+            state["namespace_index"] += 1
+            state["done"] = state["namespace_index"] >= len(state["namespaces"])
+        save_checkpoint(checkpoint_path, state)
+        print(f"Re-embedded {state['reembedded']} vectors ({state['skipped']} skipped)")
+
+        batches += 1
+        if max_batches and batches >= max_batches:
+            break
+        if not state["done"]:
+            await asyncio.sleep(1 / batches_per_second)
+
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--checkpoint", default="reembedding.json")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--batches-per-second", type=float, default=1.0)
+    parser.add_argument("--max-batches", type=int)
+    args = parser.parse_args()
+
+    asyncio.run(
+        reembed(
+            args.checkpoint,
+            batch_size=args.batch_size,
+            batches_per_second=args.batches_per_second,
+            max_batches=args.max_batches,
+        )
+    )
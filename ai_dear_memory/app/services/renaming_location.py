@@ -1,8 +1,12 @@
 import asyncio
-from app.core.config import index
+from app.services import vector_store
 from fastapi.responses import JSONResponse
 from app.services.utils import fetch_vectors
+from app.services.name_index import record_vectors
+from app.services.hybrid_search import vector_record
 from app.services.chain_creation import create_chain
+from app.services import fallbacks
+from app.services.external_calls import DeadlineExceeded, with_request_deadline
 from app.prompts.text_formatting import RENAME_LOCATION
 
 
@@ -17,6 +21,7 @@ async def rename_texts(vectors, original_location, modified_location):
                     "original_location": original_location,
                     "modified_location": modified_location,
                 },
+                fallback=fallbacks.rename_text,
             )
         )
         for vector_data in vectors.values()
@@ -25,13 +30,14 @@ async def rename_texts(vectors, original_location, modified_location):
     updated_texts = await asyncio.gather(*rename_tasks)
 
     # Update metadata with new text
-    for (vector_id, vector_data), updated_text in zip(vectors.items(), updated_texts):
+    for vector_data, updated_text in zip(vectors.values(), updated_texts):
         vector_data["metadata"]["originalText"] = updated_text["answer"]
         vector_data["metadata"]["location"] = modified_location
 
     return vectors
 
 
+@with_request_deadline
 async def update_memory(user_id, vector_ids, original_location, modified_location):
     """Fetch vectors, rename locations, and update index."""
     try:
@@ -54,12 +60,24 @@ async def update_memory(user_id, vector_ids, original_location, modified_locatio
         ]
 
         # Perform a single batch upsert
-        await asyncio.to_thread(index.upsert, vectors=upsert_data)
+        await vector_store.upsert(
+            user_id, [vector_record(*entry) for entry in upsert_data]
+        )
+        record_vectors(user_id, upsert_data)
 
         return JSONResponse(
             status_code=200,
             content={"status": 200, "message": "Location renamed successfully."},
         )
 
+    except DeadlineExceeded as e:
+        print(e)
+        return JSONResponse(
+            status_code=504,
+            content={
+                "status": 504,
+                "error": "The request took too long to process. Please try again.",
+            },
+        )
     except Exception as e:
         raise e
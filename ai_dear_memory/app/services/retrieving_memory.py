@@ -1,12 +1,25 @@
+import json
 import asyncio
 from typing import Dict, Any
-from app.core.config import index
+from app.core.config import settings
 import google.generativeai as genai
 from google.generativeai import types
 from fastapi.responses import JSONResponse
 from app.schemas.embeddings import EmbeddingRequest
-from app.services.utils import get_text_embedding
+from app.services.utils import embed_query
+from app.services.vector_store import metadata_probe_vector, scan_index
+from app.services import location_view, vector_store
+from app.services.name_index import match_name, best_match
+from app.services.hybrid_search import hybrid_min_score
 from app.services.chain_creation import create_chain
+from app.services import metrics, fallbacks, memory_maintenance, negative_cache
+from app.services.circuit_breaker import function_calling_breaker
+from app.services.external_calls import (
+    DeadlineExceeded,
+    call_blocking,
+    sdk_request_options,
+    with_request_deadline,
+)
 from app.prompts.text_formatting import (
     FORMAT_TEXT,
     RETRIEVAL_LOCATION_RESPONSE,
@@ -73,12 +86,15 @@ RETRIEVAL_ITEM_BASED_DEC = {
 }
 
 
-async def query_index(user_id: str, vectors: list, top_k: int) -> list:
+async def query_index(
+    user_id: str, vectors: list, top_k: int, text: str | None = None
+) -> list:
     return await asyncio.gather(
         *[
-            asyncio.to_thread(
-                index.query,
-                vector=vec,
+            vector_store.query_by_embedding(
+                user_id,
+                vec,
+                text,
                 top_k=top_k,
                 filter={"userId": user_id},
                 include_metadata=True,
@@ -89,6 +105,7 @@ async def query_index(user_id: str, vectors: list, top_k: int) -> list:
 
 
 def extract_valid_matches(matches, min_score: float) -> list:
+    min_score = hybrid_min_score(min_score)
     return (
         [match for match in matches if match["score"] >= min_score] if matches else []
     )
@@ -105,9 +122,10 @@ def sort_by_score(matches):
 async def query_index_item(user_id: int, item: str, vectors: list, top_k: int) -> list:
     return await asyncio.gather(
         *[
-            asyncio.to_thread(
-                index.query,
-                vector=vec,
+            vector_store.query_by_embedding(
+                user_id,
+                vec,
+                item,
                 top_k=top_k,
                 filter={"userId": user_id, "item": item.lower().strip()},
                 include_metadata=True,
@@ -117,35 +135,62 @@ async def query_index_item(user_id: int, item: str, vectors: list, top_k: int) -
     )
 
 
-async def query_index_location(
-    user_id: str, location: str, vectors: list, top_k: int
-) -> list:
-    return await asyncio.gather(
-        *[
-            asyncio.to_thread(
-                index.query,
-                vector=vec,
-                top_k=top_k,
-                filter={"userId": user_id, "location": location.lower().strip()},
-                include_metadata=True,
-            )
-            for vec in vectors
-        ]
-    )
+async def process_item(data: EmbeddingRequest, item: str, min_score: float):
+    version = await negative_cache.version(data.user_id)
+    cached = negative_cache.get(data.user_id, "item", item, min_score, version)
+    if cached:
+        return cached
+    result = set()
+    similar_items = set()
 
+    # Resolve misspellings against the user's stored item names first; an
+    # exact metadata lookup needs no embedding. The answer names the stored
+    # item, so a close name ("red pin" for "red pen") is visible as such.
+    name_matches = await match_name(data.user_id, "item", item)
+    stored_item = best_match(name_matches)
+    if stored_item:
+        query_result = await query_index_item(
+            data.user_id, stored_item, [metadata_probe_vector()], top_k=1
+        )
+        if query_result and query_result[0]["matches"]:
+            top_match = query_result[0]["matches"][0]
+            result.add(top_match["metadata"]["location"])
+            memory_maintenance.record_retrievals(data.user_id, [top_match["id"]])
+            return {
+                "exact_location": result,
+                "similar_items": similar_items,
+                "item": top_match["metadata"]["item"],
+                "status_code": 200,
+            }
 
-async def process_item(data: EmbeddingRequest, item: str, min_score: float):
     question = f"Where is {item}"
-    query_vector = await get_text_embedding(question)
-
-    query_result = await query_index_item(data.user_id, item, [query_vector], top_k=3)
+    query_vector = await embed_query(question)
+    if not query_vector:
+        # Embeddings are unavailable; answer exact names from metadata alone
+        query_result = await query_index_item(
+            data.user_id, item, [metadata_probe_vector()], top_k=1
+        )
+        if query_result[0]["matches"]:
+            top_match = query_result[0]["matches"][0]
+            result.add(top_match["metadata"]["location"])
+            memory_maintenance.record_retrievals(data.user_id, [top_match["id"]])
+        similar_items.update(name for name, _ in name_matches)
+        return {
+            "exact_location": result,
+            "similar_items": similar_items,
+            "item": item,
+            "status_code": 200 if result else 404,
+        }
 
-    result = set()
-    similar_items = set()
+    query_result = await query_index_item(
+        data.user_id, item, [query_vector], top_k=settings.SIMILAR_TOP_K
+    )
+    exact_matches = query_result[0]["matches"] if query_result else []
 
-    if query_result and query_result[0]["matches"]:
-        top_match = query_result[0]["matches"][0]
+    if exact_matches:
+        top_match = exact_matches[0]
         result.add(top_match["metadata"]["location"])
+        memory_maintenance.record_retrievals(data.user_id, [top_match["id"]])
         return {
             "exact_location": result,
             "similar_items": similar_items,
@@ -154,34 +199,60 @@ async def process_item(data: EmbeddingRequest, item: str, min_score: float):
         }
 
     else:
-        query_result = await query_index(data.user_id, [query_vector], top_k=3)
+        query_result = await query_index(
+            data.user_id, [query_vector], top_k=settings.SIMILAR_TOP_K, text=item
+        )
         matches = extract_valid_matches(query_result[0]["matches"], min_score)
         matches = sort_by_score(matches)
 
         if matches:
             for match in matches:
                 similar_items.add(match["metadata"]["item"])
-        return {
+        similar_items.update(name for name, _ in name_matches)
+        response = {
             "exact_location": result,
             "similar_items": similar_items,
             "item": item,
             "status_code": 404,
         }
+        negative_cache.store(data.user_id, "item", item, min_score, response, version)
+        return response
 
 
-async def process_location(data: EmbeddingRequest, location: str, min_score=0.70):
-    question = f"What did I keep in {location}?"
-    query_vector = await get_text_embedding(question)
-
-    query_result = await query_index_location(
-        data.user_id, location, [query_vector], top_k=100
-    )
-
+async def process_location(
+    data: EmbeddingRequest, location: str, min_score: float | None = None
+):
+    if min_score is None:
+        min_score = settings.SIMILAR_LOCATION_MIN_SCORE
+    version = await negative_cache.version(data.user_id)
+    cached = negative_cache.get(data.user_id, "location", location, min_score, version)
+    if cached:
+        return cached
     result = set()
     similar_locations = set()
-    if query_result and query_result[0]["matches"]:
-        for match in query_result[0]["matches"]:
-            result.add(match["metadata"]["item"])
+
+    # Resolve misspellings against the user's stored location names first
+    name_matches = await match_name(data.user_id, "location", location)
+    lookup_location = best_match(name_matches) or location
+
+    stored = await location_view.list_items(data.user_id, lookup_location)
+    if stored is not None:
+        result.update(item for _, item in stored)
+        memory_maintenance.record_retrievals(
+            data.user_id, [vector_id for vector_id, _ in stored]
+        )
+    else:
+        # Enumerate every memory stored in the location, page by page
+        async for page in scan_index(
+            data.user_id, {"location": lookup_location.lower().strip()}
+        ):
+            for match in page:
+                result.add(match["metadata"]["item"])
+            memory_maintenance.record_retrievals(
+                data.user_id, [match["id"] for match in page]
+            )
+
+    if result:
         return {
             "exact_items": result,
             "similar_locations": similar_locations,
@@ -189,23 +260,45 @@ async def process_location(data: EmbeddingRequest, location: str, min_score=0.70
             "status_code": 200,
         }
     else:
-        query_result = await query_index(data.user_id, [query_vector], top_k=3)
-        matches = extract_valid_matches(query_result[0]["matches"], 0.70)
+        question = f"What did I keep in {location}?"
+        query_vector = await embed_query(question)
+        query_result = (
+            await query_index(
+                data.user_id,
+                [query_vector],
+                top_k=settings.SIMILAR_TOP_K,
+                text=location,
+            )
+            if query_vector
+            else []
+        )
+        matches = (
+            extract_valid_matches(query_result[0]["matches"], min_score)
+            if query_result
+            else []
+        )
         matches = sort_by_score(matches)
 
         if matches:
             for match in matches:
                 similar_locations.add(match["metadata"]["location"])
-        return {
+        similar_locations.update(name for name, _ in name_matches)
+        response = {
             "exact_items": result,
             "similar_locations": similar_locations,
             "location": location,
             "status_code": 404,
         }
+        if query_vector:
+            # Without embeddings the suggestions are incomplete; don't keep them
+            negative_cache.store(
+                data.user_id, "location", location, min_score, response, version
+            )
+        return response
 
 
 async def retrieving_memory_by_item(
-    data: EmbeddingRequest, items: list[str], min_score=0.65
+    data: EmbeddingRequest, items: list[str], min_score: float | None = None
 ):
     """
     Retrieve information about specific items the user is asking about.
@@ -213,7 +306,8 @@ async def retrieving_memory_by_item(
     Args:
         data (EmbeddingRequest): The request containing user_id and text.
         items (list[str]): List of items to retrieve information for.
-        min_score (float): Minimum score threshold for valid matches.
+        min_score (float | None): Minimum score of similar items. Defaults to
+            SIMILAR_ITEM_MIN_SCORE.
 
     Returns:
         JSONResponse: The response containing the retrieved memory or an error message.
@@ -228,13 +322,15 @@ async def retrieving_memory_by_item(
                 },
             )
 
+        if min_score is None:
+            min_score = settings.SIMILAR_ITEM_MIN_SCORE
+
+        version = await negative_cache.version(data.user_id)
         # Process each item asynchronously
         responses = await asyncio.gather(
             *(process_item(data, item, min_score) for item in items)
         )
 
-        result = await create_chain(RETRIEVAL_ITEM_RESPONSE, {"responses": responses})
-
         any_success = False
 
         for response in responses:
@@ -244,10 +340,33 @@ async def retrieving_memory_by_item(
 
         status_code = 200 if any_success else 404
 
+        # A question for things that are all missing gets the same answer
+        # until the user saves something; reuse it instead of a chat call
+        answer_key = json.dumps(list(items))
+        result = (
+            None
+            if any_success
+            else negative_cache.get(
+                data.user_id, "item_answer", answer_key, min_score, version
+            )
+        )
+        if result is None:
+            result = await create_chain(
+                RETRIEVAL_ITEM_RESPONSE,
+                {"responses": responses},
+                fallback=fallbacks.item_response,
+            )
+            if not any_success and result:
+                negative_cache.store(
+                    data.user_id, "item_answer", answer_key, min_score, result, version
+                )
+
         result["status"] = status_code
 
         return JSONResponse(status_code=status_code, content=result)
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -259,7 +378,7 @@ async def retrieving_memory_by_item(
 
 
 async def retrieving_memory_by_location(
-    data: EmbeddingRequest, locations: list[str], min_score=0.75
+    data: EmbeddingRequest, locations: list[str], min_score: float | None = None
 ):
     try:
         if not locations:
@@ -270,6 +389,7 @@ async def retrieving_memory_by_location(
                     "error": "Sorry, I am not able to understand the location you are asking for. Please try again.",
                 },
             )
+        version = await negative_cache.version(data.user_id)
         # Process each location asynchronously
         responses = await asyncio.gather(
             *(process_location(data, location, min_score) for location in locations)
@@ -284,14 +404,39 @@ async def retrieving_memory_by_location(
 
         status_code = 200 if any_success else 404
 
-        result = await create_chain(
-            RETRIEVAL_LOCATION_RESPONSE, {"responses": responses}
+        answer_key = json.dumps(list(locations))
+        answer_min_score = (
+            settings.SIMILAR_LOCATION_MIN_SCORE if min_score is None else min_score
+        )
+        result = (
+            None
+            if any_success
+            else negative_cache.get(
+                data.user_id, "location_answer", answer_key, answer_min_score, version
+            )
         )
+        if result is None:
+            result = await create_chain(
+                RETRIEVAL_LOCATION_RESPONSE,
+                {"responses": responses},
+                fallback=fallbacks.location_response,
+            )
+            if not any_success and result:
+                negative_cache.store(
+                    data.user_id,
+                    "location_answer",
+                    answer_key,
+                    answer_min_score,
+                    result,
+                    version,
+                )
 
         result["status"] = status_code
 
         return JSONResponse(status_code=status_code, content=result)
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         print(e)
         return JSONResponse(
@@ -313,6 +458,7 @@ async def prepare_response(input_text: str, user_query: str) -> Dict[str, Any]:
         return {}
 
 
+@with_request_deadline
 async def smart_retrieval(request_body: EmbeddingRequest) -> Dict[str, Any]:
     try:
         tools = types.Tool(
@@ -320,26 +466,42 @@ async def smart_retrieval(request_body: EmbeddingRequest) -> Dict[str, Any]:
         )
         model = genai.GenerativeModel("models/gemini-1.5-pro", tools=[tools])
 
-        response = await asyncio.to_thread(model.generate_content, request_body.text)
-
-        parts = response.candidates[0].content.parts if response.candidates else []
-        if not parts or not parts[0].function_call:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "status": 400,
-                    "error": "Sorry, I am not able to process the query. Please rephrase and try again.",
-                },
+        try:
+            response = await call_blocking(
+                "function_call",
+                model.generate_content,
+                request_body.text,
+                request_options=sdk_request_options(),
+                breaker=function_calling_breaker,
             )
-
-        function_call = parts[0].function_call
-
-        if function_call.name == "retrieving_memory_by_location":
-            return await retrieving_memory_by_location(
-                request_body, **function_call.args
-            )
-        elif function_call.name == "retrieving_memory_by_item":
-            return await retrieving_memory_by_item(request_body, **function_call.args)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not function_calling_breaker.degraded:
+                raise
+            # Gemini's breaker is open; route with keyword rules
+            print(f"Function calling failed, routing locally: {e}")
+            metrics.increment("fallbacks:function_call")
+            response = None
+
+        if response is None:
+            name, args = fallbacks.route_query(request_body.text) or ("", {})
+        else:
+            parts = response.candidates[0].content.parts if response.candidates else []
+            if not parts or not parts[0].function_call:
+                return JSONResponse(
+                    status_code=400,
+                    content={
+                        "status": 400,
+                        "error": "Sorry, I am not able to process the query. Please rephrase and try again.",
+                    },
+                )
+            name, args = parts[0].function_call.name, parts[0].function_call.args
+
+        if name == "retrieving_memory_by_location":
+            return await retrieving_memory_by_location(request_body, **args)
+        elif name == "retrieving_memory_by_item":
+            return await retrieving_memory_by_item(request_body, **args)
         else:
             return JSONResponse(
                 status_code=400,
@@ -349,6 +511,14 @@ async def smart_retrieval(request_body: EmbeddingRequest) -> Dict[str, Any]:
                 },
             )
 
+    except DeadlineExceeded:
+        return JSONResponse(
+            status_code=504,
+            content={
+                "status": 504,
+                "error": "The request took too long to process. Please try again.",
+            },
+        )
     except Exception:
         return JSONResponse(
             status_code=500,
@@ -0,0 +1,112 @@
+"""
+Stamp memories saved before the savedAt metadata field existed.
+
+vector_store.scan_index enumerates users with more memories than one query
+returns by querying ranges of savedAt, a numeric copy of the "datetime" field.
+Memories without it cannot be split that way: when a user has more of them
+than one query returns in the shared or a bucket namespace, the whole
+namespace is listed instead. This job pages through every namespace and sets
+savedAt on the memories missing it, recording its progress in a checkpoint
+file after each batch, so it can be stopped and resumed at any time. It can
+run while the app keeps serving.
+
+Usage (from the ai_dear_memory directory):
+    python -m app.services.saved_at_backfill --checkpoint backfill.json
+"""
+
+import os
+import json
+import asyncio
+import argparse
+import datetime
+from app.core.config import index
+from app.services.namespace_migration import save_checkpoint
+
+
+def load_checkpoint(path: str) -> dict:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"finished_namespaces": [], "pagination_token": None, "stamped": 0}
+
+
+def saved_at(metadata: dict) -> float:
+    """The savedAt value of a memory: its "datetime", or 0 when it has none."""
+    try:
+        return datetime.datetime.fromisoformat(metadata["datetime"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+async def stamp_batch(ids: list, namespace: str) -> int:
+    """Set savedAt on the vectors of a batch missing it. Returns how many."""
+    fetched = await asyncio.to_thread(index.fetch, ids=ids, namespace=namespace)
+    stamped = 0
+    for vector_id, vector_data in fetched.vectors.items():
+        metadata = vector_data["metadata"] or {}
+        if metadata.get("savedAt") is not None:
+            continue
+        await asyncio.to_thread(
+            index.update,
+            id=vector_id,
+            set_metadata={"savedAt": saved_at(metadata)},
+            namespace=namespace,
+        )
+        stamped += 1
+    return stamped
+
+
+async def backfill_saved_at(
+    checkpoint_path: str, batch_size: int = 100, batches_per_second: float = 2.0
+) -> dict:
+    """
+    Run (or resume) the backfill.
+
+    Args:
+        checkpoint_path (str): File recording the backfill progress.
+        batch_size (int): Vectors listed and fetched per batch.
+        batches_per_second (float): Throttle applied between batches.
+
+    Returns:
+        dict: The checkpoint state.
+    """
+    state = load_checkpoint(checkpoint_path)
+    stats = await asyncio.to_thread(index.describe_index_stats)
+    for namespace in sorted(stats.namespaces):
+        if namespace in state["finished_namespaces"]:
+            continue
+        while True:
+            page = await asyncio.to_thread(
+                index.list_paginated,
+                limit=batch_size,
+                pagination_token=state["pagination_token"],
+                namespace=namespace,
+            )
+            ids = [vector.id for vector in page.vectors]
+            if ids:
+                state["stamped"] += await stamp_batch(ids, namespace)
+            state["pagination_token"] = page.pagination.next if page.pagination else None
+            if not state["pagination_token"]:
+                state["finished_namespaces"].append(namespace)
+            save_checkpoint(checkpoint_path, state)
+            print(f"Stamped {state['stamped']} vectors")
+            if not state["pagination_token"]:
+                break
+            await asyncio.sleep(1 / batches_per_second)
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--checkpoint", default="saved_at_backfill.json")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batches-per-second", type=float, default=2.0)
+    args = parser.parse_args()
+
+    asyncio.run(
+        backfill_saved_at(
+            args.checkpoint,
+            batch_size=args.batch_size,
+            batches_per_second=args.batches_per_second,
+        )
+    )
@@ -0,0 +1,40 @@
+import json
+import time
+import asyncio
+import threading
+from fastapi import Request
+from app.core.config import settings
+
+_lock = threading.Lock()
+
+
+def _append(line: str) -> None:
+    with _lock, open(settings.TRAFFIC_TRACE_PATH, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+
+
+async def record_request(request: Request) -> None:
+    """
+    Append a request to the TRAFFIC_TRACE_PATH trace, in the format replayed
+    by benchmarks/load_test.py. Traces contain the users' saved texts, so
+    recording is meant for staging environments or consenting test users.
+
+    Args:
+        request (Request): The incoming request.
+    """
+    body = await request.body()
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        payload = None
+    record = {
+        "at": time.time(),
+        "method": request.method,
+        "path": request.url.path,
+        "params": dict(request.query_params),
+        "json": payload,
+    }
+    try:
+        await asyncio.to_thread(_append, json.dumps(record))
+    except OSError as e:
+        print(f"Error recording traffic trace: {e}")
@@ -1,5 +1,13 @@
 import asyncio
-from app.core.config import genai, index
+from array import array
+from app.core.config import genai, settings
+from app.services import cost_accounting, vector_store, vectors
+from app.services.circuit_breaker import embedding_breaker
+from app.services.external_calls import (
+    DeadlineExceeded,
+    call_blocking,
+    sdk_request_options,
+)
 
 
 def remove_dear_memory_prefix(text: str) -> str:
@@ -28,13 +36,18 @@ async def fetch_vectors(user_id, vector_ids):
         vector_ids (list): A list of vector IDs to fetch.
 
     Returns:
-        dict: A dictionary of vectors (vector_id: vector_data) that match the user_id.
+        dict: A dictionary of vectors (vector_id: vector_data) that match the
+        user_id, with their values as float32 arrays.
     """
 
-    response = await asyncio.to_thread(index.fetch, ids=vector_ids)
+    response = await vector_store.fetch(user_id, vector_ids)
 
     user_vectors = {
-        vector_id: vector_data
+        vector_id: {
+            "id": vector_id,
+            "values": vectors.float32(vector_data["values"]),
+            "metadata": vector_data["metadata"],
+        }
         for vector_id, vector_data in response.vectors.items()
         if vector_data["metadata"]["userId"] == user_id
     }
@@ -43,25 +56,76 @@ async def fetch_vectors(user_id, vector_ids):
 
 
 async def get_text_embedding(
-    text: str | list[str], model: str = "models/gemini-embedding-exp-03-07"
-) -> list[float] | list[list[float]] | None:
+    text: str | list[str], model: str | None = None
+) -> array | list[array] | None:
     """
     Generates vector embeddings for given text(s) using the specified Gemini model.
 
     Args:
         text (str | list[str]): A single string or list of strings to embed.
-        model (str): The embedding model to use.
+        model (str | None): The embedding model to use. Defaults to EMBEDDING_MODEL.
 
     Returns:
-        Embedding(s) as list[float] or list[list[float]], matching input type.
+        Embedding(s) as a float32 array or a list of them, matching input type.
     """
     try:
         if not isinstance(text, (str, list)):
             raise ValueError("Input must be a string or a list of strings.")
 
-        response = await asyncio.to_thread(genai.embed_content, model, text)
-        return response.get("embedding", [])
+        cost_accounting.add("embedding_input_tokens", cost_accounting.estimate_tokens(text))
+        response = await call_blocking(
+            "embed_content",
+            genai.embed_content,
+            model or settings.EMBEDDING_MODEL,
+            text,
+            hedge=True,
+            breaker=embedding_breaker,
+            request_options=sdk_request_options(),
+        )
+        embedding = response.get("embedding", [])
+        if isinstance(text, str):
+            return vectors.float32(embedding)
+        return [vectors.float32(values) for values in embedding]
+
+    except DeadlineExceeded:
+        raise
 
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
+
+
+class QueryEmbedding(array):
+    """
+    Query embedding by the current model that also carries the embedding by
+    EMBEDDING_PREVIOUS_MODEL, for vector_store.query_by_embedding.
+    """
+
+    def __new__(cls, values: array, previous: array):
+        embedding = super().__new__(cls, "f", values)
+        embedding.previous = previous
+        return embedding
+
+
+async def embed_query(text: str) -> array | None:
+    """
+    Embed a question for a similarity query. While EMBEDDING_PREVIOUS_MODEL is
+    set, the question is embedded with both models concurrently.
+
+    Args:
+        text (str): The question to embed.
+
+    Returns:
+        array | None: The embedding, a QueryEmbedding when both models
+        answered, or None when the current model failed.
+    """
+    if not settings.EMBEDDING_PREVIOUS_MODEL:
+        return await get_text_embedding(text)
+
+    current, previous = await asyncio.gather(
+        get_text_embedding(text),
+        get_text_embedding(text, model=settings.EMBEDDING_PREVIOUS_MODEL),
+    )
+    if not current or not previous:
+        return current
+    return QueryEmbedding(current, previous)
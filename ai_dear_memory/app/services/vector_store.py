@@ -0,0 +1,420 @@
+import math
+import time
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from app.core.config import index, settings
+from app.core.local_index import Record, matches_filter
+from app.services.hybrid_search import hybrid_query_args
+from app.services import cost_accounting, location_view, memory_versions, negative_cache
+from app.services import metrics, vectors, write_overlay
+from app.services.external_calls import call_blocking
+
+SHARED_NAMESPACE = ""
+QUERY_TOP_K_LIMIT = 1000  # Pinecone's top_k limit for queries returning metadata
+LIST_PAGE_SIZE = 100  # Pinecone's limit for list_paginated
+SAVED_AT_EPOCH = 1704067200.0  # 2024-01-01, first split of the savedAt range
+MIN_SAVED_AT_RANGE = 0.001  # seconds; narrower ranges are not split further
+
+# Blocking callable run before every write of the current task; see write_scope
+_write_check: ContextVar = ContextVar("write_check", default=None)
+
+
+class WriteRevoked(Exception):
+    """Raised when a write is attempted by a caller that may no longer write."""
+
+
+@contextmanager
+def write_scope(check):
+    """
+    Run a block whose vector writes are each preceded by check(), a blocking
+    callable returning whether the caller may still write. A background save
+    job uses it so that it stops writing once another worker took it over.
+    """
+    token = _write_check.set(check)
+    try:
+        yield
+    finally:
+        _write_check.reset(token)
+
+
+async def _check_write() -> None:
+    check = _write_check.get()
+    if check and not await asyncio.to_thread(check):
+        metrics.increment("index_writes_revoked")
+        raise WriteRevoked("The caller may no longer write")
+
+
+@lru_cache(maxsize=1)
+def metadata_probe_vector() -> list[float]:
+    """
+    Constant unit vector for queries that are answered by their metadata
+    filter alone, so no embedding has to be generated for them.
+
+    Returns:
+        list[float]: A vector of the index dimension.
+    """
+    dimension = settings.INDEX_DIMENSION
+    return [1 / math.sqrt(dimension)] * dimension
+
+
+def namespace_for(user_id: int) -> str:
+    """
+    Return the index namespace holding a user's memories for the configured
+    NAMESPACE_LAYOUT: "shared" (one namespace for everybody), "user" (one
+    namespace per user) or "bucket" (users hashed into NAMESPACE_BUCKETS).
+    """
+    if settings.NAMESPACE_LAYOUT == "user":
+        return f"user-{user_id}"
+    if settings.NAMESPACE_LAYOUT == "bucket":
+        return f"bucket-{int(user_id) % settings.NAMESPACE_BUCKETS}"
+    return SHARED_NAMESPACE
+
+
+def read_namespaces(user_id: int) -> list[str]:
+    """
+    Namespaces to read a user's memories from. While a migration is running
+    (NAMESPACE_DUAL_READ), the shared namespace is read as well.
+    """
+    namespace = namespace_for(user_id)
+    if settings.NAMESPACE_DUAL_READ and namespace != SHARED_NAMESPACE:
+        return [namespace, SHARED_NAMESPACE]
+    return [namespace]
+
+
+def merge_matches(responses: list, top_k: int) -> Record:
+    """Merge query responses from several namespaces; earlier ones win ties on id."""
+    merged = {}
+    for response in responses:
+        for match in response["matches"]:
+            merged.setdefault(match["id"], match)
+    matches = sorted(merged.values(), key=lambda match: match["score"], reverse=True)
+    return Record(matches=matches[:top_k])
+
+
+async def query(user_id: int, **kwargs):
+    """
+    Run index.query against the user's namespace(s).
+
+    Args:
+        user_id (int): The user whose memories are queried.
+        **kwargs: Arguments of index.query (vector, top_k, filter, ...).
+
+    Returns:
+        The query response, with matches merged across namespaces when
+        dual-reading and with the user's recent writes merged in.
+    """
+    if "vector" in kwargs:
+        kwargs["vector"] = vectors.request_values(kwargs["vector"])
+    # Over-fetch the matches the user's recent writes may hide, so that a
+    # short page still means the index has no more matches
+    top_k = min(
+        kwargs["top_k"] + write_overlay.hidden_bound(user_id),
+        max(kwargs["top_k"], QUERY_TOP_K_LIMIT),
+    )
+    namespaces = read_namespaces(user_id)
+    responses = await asyncio.gather(
+        *(
+            call_blocking(
+                "index.query",
+                index.query,
+                hedge=True,
+                namespace=namespace,
+                **{**kwargs, "top_k": top_k},
+            )
+            for namespace in namespaces
+        )
+    )
+    response = (
+        responses[0] if len(responses) == 1 else merge_matches(responses, top_k)
+    )
+    return write_overlay.merge_query(user_id, response, kwargs)
+
+
+async def query_by_embedding(user_id: int, vector: list, text: str | None = None, **kwargs):
+    """
+    Run a similarity query for a query embedding, with the sparse encoding of
+    the text when hybrid search is enabled.
+
+    While two embedding models are in use, the embedding returned by
+    utils.embed_query also carries the previous model's embedding; each
+    generation of stored vectors is then queried with the embedding of its own
+    model and the matches are merged. Vectors without a model tag belong to the
+    previous generation.
+
+    Args:
+        user_id (int): The user whose memories are queried.
+        vector (list): The query embedding.
+        text (str | None): The item or location name being looked up.
+        **kwargs: Other arguments of index.query (top_k, filter, ...).
+    """
+    previous = getattr(vector, "previous", None)
+    if previous is None:
+        return await query(user_id, **hybrid_query_args(vector, text), **kwargs)
+
+    filter = kwargs.pop("filter", None) or {}
+    current_model = settings.EMBEDDING_MODEL
+    responses = await asyncio.gather(
+        query(
+            user_id,
+            **hybrid_query_args(vector, text),
+            filter={**filter, "embeddingModel": current_model},
+            **kwargs,
+        ),
+        query(
+            user_id,
+            **hybrid_query_args(previous, text),
+            filter={**filter, "embeddingModel": {"$ne": current_model}},
+            **kwargs,
+        ),
+    )
+    return merge_matches(responses, kwargs["top_k"])
+
+
+async def fetch(user_id: int, ids: list):
+    """Fetch vectors by id from the user's namespace(s) and recent writes."""
+    namespaces = read_namespaces(user_id)
+    responses = await asyncio.gather(
+        *(
+            call_blocking(
+                "index.fetch", index.fetch, hedge=True, ids=ids, namespace=namespace
+            )
+            for namespace in namespaces
+        )
+    )
+    if len(responses) == 1:
+        return write_overlay.merge_fetch(user_id, responses[0], ids)
+    fetched = {}
+    for response in responses:
+        for vector_id, vector_data in response.vectors.items():
+            fetched.setdefault(vector_id, vector_data)
+    return write_overlay.merge_fetch(user_id, Record(vectors=fetched), ids)
+
+
+async def upsert(user_id: int, vectors: list):
+    """
+    Write vectors to the user's namespace. While dual-reading, stale copies in
+    the shared namespace are removed so the migration cannot resurrect them.
+    Once written, the vectors are visible to the user's reads through the
+    write overlay, the user's memory version is increased, the location view
+    is updated and the user's cached not-found lookups are dropped.
+    """
+    await _check_write()
+    namespace = namespace_for(user_id)
+    cost_accounting.add("index_vectors_written", len(vectors))
+    response = await call_blocking(
+        "index.upsert", index.upsert, vectors=vectors, namespace=namespace
+    )
+    if settings.NAMESPACE_DUAL_READ and namespace != SHARED_NAMESPACE:
+        ids = [v["id"] if isinstance(v, dict) else v[0] for v in vectors]
+        await call_blocking(
+            "index.delete", index.delete, ids=ids, namespace=SHARED_NAMESPACE
+        )
+    write_overlay.record_upsert(user_id, vectors)
+    # The version goes first: a location view rebuild racing with this write
+    # then sees it change (see location_view.rebuild)
+    await memory_versions.bump(user_id)
+    await location_view.record_upsert(user_id, vectors)
+    negative_cache.invalidate_user(user_id)
+    return response
+
+
+async def delete(user_id: int, ids: list):
+    """
+    Delete vectors by id from every namespace the user is read from, hide
+    them from the user's reads until the index catches up, increase the
+    user's memory version and remove them from the location view.
+    """
+    await _check_write()
+    cost_accounting.add("index_vectors_deleted", len(ids))
+    await asyncio.gather(
+        *(
+            call_blocking("index.delete", index.delete, ids=ids, namespace=namespace)
+            for namespace in read_namespaces(user_id)
+        )
+    )
+    write_overlay.record_delete(user_id, ids)
+    await memory_versions.bump(user_id)
+    await location_view.record_delete(user_id, ids)
+    negative_cache.invalidate_user(user_id)
+
+
+def _per_user(namespace: str) -> bool:
+    return settings.NAMESPACE_LAYOUT == "user" and namespace != SHARED_NAMESPACE
+
+
+async def _listed_vectors(namespace: str):
+    """Yield the vectors of a whole namespace, listed and fetched page by page."""
+    token = None
+    while True:
+        listed = await call_blocking(
+            "index.list",
+            index.list_paginated,
+            limit=LIST_PAGE_SIZE,
+            pagination_token=token,
+            namespace=namespace,
+        )
+        ids = [vector.id for vector in listed.vectors]
+        if ids:
+            fetched = await call_blocking(
+                "index.fetch", index.fetch, ids=ids, namespace=namespace
+            )
+            yield fetched.vectors
+        token = listed.pagination.next if listed.pagination else None
+        if not token:
+            break
+
+
+async def _queried_vectors(namespace: str, filter: dict, kwargs: dict):
+    """
+    Yield a user's vectors matching a filter in a shared or bucket namespace
+    with filtered queries, splitting the savedAt range of any query that
+    returns a full page. The cost grows with the matches, not the namespace.
+    """
+
+    async def run(range_filter: dict) -> tuple[dict, bool]:
+        response = await call_blocking(
+            "index.query",
+            index.query,
+            hedge=True,
+            namespace=namespace,
+            **{**kwargs, "filter": {**filter, "savedAt": range_filter}},
+        )
+        matches = response["matches"]
+        vectors = {match["id"]: {"metadata": match["metadata"]} for match in matches}
+        return vectors, len(matches) >= kwargs["top_k"]
+
+    vectors, full = await run({"$exists": False})
+    if full:
+        # Too many memories saved before savedAt existed to split by it; see
+        # app.services.saved_at_backfill
+        print(f"Listing namespace {namespace or '(shared)'} to enumerate unstamped memories")
+        metrics.increment("scan_namespace_listings")
+        async for vectors in _listed_vectors(namespace):
+            yield vectors
+        return
+    yield vectors
+
+    ranges = [(SAVED_AT_EPOCH, time.time() + 86400), (0.0, SAVED_AT_EPOCH)]
+    while ranges:
+        low, high = ranges.pop()
+        vectors, full = await run({"$gte": low, "$lt": high})
+        if full and high - low > MIN_SAVED_AT_RANGE:
+            middle = (low + high) / 2
+            ranges.extend([(middle, high), (low, middle)])
+            continue
+        if full:
+            print(f"More than {kwargs['top_k']} memories saved at {low}; some are skipped")
+        yield vectors
+
+
+async def _enumerate(user_id: int, filter: dict, kwargs: dict):
+    """
+    Enumerate a user's vectors matching a filter without relying on query
+    paging: per-user namespaces are listed and fetched, shared and bucket
+    namespaces are split into filtered queries. Yields pages of matches with
+    the user's recent writes merged in.
+    """
+    page_size = kwargs["top_k"]
+    seen = set()
+    for namespace in read_namespaces(user_id):
+        pages = (
+            _listed_vectors(namespace)
+            if _per_user(namespace)
+            else _queried_vectors(namespace, filter, kwargs)
+        )
+        async for vectors in pages:
+            ids = [vector_id for vector_id in vectors if vector_id not in seen]
+            if not ids:
+                continue
+            fetched = write_overlay.merge_fetch(
+                user_id, Record(vectors={i: vectors[i] for i in ids}), ids
+            )
+            page = []
+            for vector_id, vector_data in fetched.vectors.items():
+                metadata = dict(vector_data["metadata"] or {})
+                if matches_filter(metadata, filter):
+                    page.append(Record(id=vector_id, score=0.0, metadata=metadata))
+            seen.update(ids)
+            for start in range(0, len(page), page_size):
+                yield page[start : start + page_size]
+    recent = [
+        match
+        for match in write_overlay.recent_matches(user_id, filter)
+        if match["id"] not in seen
+    ]
+    if recent:
+        yield recent
+
+
+async def scan_index(user_id: int, filter: dict | None = None, page_size: int | None = None):
+    """
+    Enumerate every vector of a user matching a metadata filter, page by page.
+
+    A single metadata-only query of page_size matches answers the usual case:
+    when the index returns fewer, they are all of them. Otherwise a per-user
+    namespace is listed with list_paginated and fetched, and a shared or
+    bucket namespace is queried again over ranges of the savedAt timestamp,
+    halving any range that still fills a page.
+
+    Args:
+        user_id (int): The user whose memories are enumerated.
+        filter (dict | None): Additional metadata filter, e.g. {"location": "drawer"}.
+        page_size (int | None): Matches per page. Defaults to SCAN_PAGE_SIZE.
+
+    Yields:
+        list: The matches of each page, with metadata.
+    """
+    page_size = page_size or settings.SCAN_PAGE_SIZE
+    page_filter = {"userId": user_id, **(filter or {})}
+    kwargs = {
+        "vector": vectors.request_values(metadata_probe_vector()),
+        "top_k": page_size,
+        "filter": page_filter,
+        "include_metadata": True,
+    }
+    responses = await asyncio.gather(
+        *(
+            call_blocking(
+                "index.query", index.query, hedge=True, namespace=namespace, **kwargs
+            )
+            for namespace in read_namespaces(user_id)
+        )
+    )
+    if any(len(response["matches"]) >= page_size for response in responses):
+        async for page in _enumerate(user_id, page_filter, kwargs):
+            yield page
+        return
+
+    # Complete answer: merge in the user's recent writes without truncating
+    top_k = sum(len(response["matches"]) for response in responses)
+    top_k += len(write_overlay.recent_matches(user_id, page_filter))
+    response = write_overlay.merge_query(
+        user_id, merge_matches(responses, top_k), {**kwargs, "top_k": top_k}
+    )
+    if response["matches"]:
+        yield response["matches"]
+
+
+async def delete_user(user_id: int) -> None:
+    """
+    Delete all memories of a user. With one namespace per user this is a
+    single namespace drop; otherwise the user's vectors are enumerated.
+    """
+    if settings.NAMESPACE_LAYOUT == "user":
+        await _check_write()
+        await call_blocking(
+            "index.delete",
+            index.delete,
+            delete_all=True,
+            namespace=namespace_for(user_id),
+        )
+        write_overlay.record_delete_all(user_id)
+        await memory_versions.bump(user_id)
+        await location_view.record_delete_user(user_id)
+        if not settings.NAMESPACE_DUAL_READ:
+            return
+
+    async for page in scan_index(user_id):
+        await delete(user_id, [match["id"] for match in page])
@@ -0,0 +1,24 @@
+"""
+Compact float32 vectors.
+
+Embeddings are held as array("f") buffers from the moment Gemini returns them
+until they are written to the index: 4 bytes per value instead of a list slot
+and a boxed float (about 32 bytes), so a 3072-dimension embedding takes 12 KB
+instead of about 100 KB. Gemini embeddings are float32 values, so nothing is
+lost. The Pinecone client converts arrays itself when it builds an upsert
+request; query vectors are converted with request_values.
+"""
+
+from array import array
+
+
+def float32(values) -> array:
+    """Return values as a float32 array, without copying one that already is."""
+    if isinstance(values, array) and values.typecode == "f":
+        return values
+    return array("f", values)
+
+
+def request_values(values) -> list[float]:
+    """Return a vector as the list of floats an index request is made of."""
+    return values if isinstance(values, list) else values.tolist()
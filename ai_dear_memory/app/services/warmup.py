@@ -0,0 +1,184 @@
+"""
+Warm a new app process up before it reports ready.
+
+The first requests of a fresh worker would otherwise pay for the TLS
+handshakes to Gemini and Pinecone, the lazy gRPC channel setup of the Gemini
+clients and the compilation of the prompt chains. The warm-up runs in the
+background at startup: it opens WARMUP_CONNECTIONS index connections (and
+pool threads) with cheap stats calls, probes the embedding, function-calling
+and chat clients with a one-word embedding and free token counts, builds
+every prompt chain (and its cached content with PROMPT_CACHING) and loads the
+name index and location view of the users most recently active before the
+last shutdown. GET /ready answers 503 until it is done, or until
+WARMUP_TIMEOUT_SECONDS have passed.
+"""
+
+import time
+import asyncio
+from app.core.config import index, settings
+from app.state_database import StateBase, StateSessionLocal, state_engine
+from app.models.active_user import ActiveUser
+from app.models.save_job import utc_now
+from app.prompts import info_extraction, item_matching, text_formatting
+from app.services import (
+    chain_creation,
+    cost_accounting,
+    location_view,
+    metrics,
+    name_index,
+    prompt_cache,
+)
+from app.services.external_calls import call_blocking
+from app.services.utils import get_text_embedding
+
+# Hot users loaded at the same time
+PRELOAD_CONCURRENCY = 4
+
+_ready = asyncio.Event()
+_task: asyncio.Task | None = None
+_durations: dict[str, float] = {}
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def all_prompts() -> list:
+    return [
+        value
+        for module in (info_extraction, item_matching, text_formatting)
+        for name, value in vars(module).items()
+        if name.isupper()
+    ]
+
+
+async def _open_index_connections() -> None:
+    await asyncio.gather(
+        *(
+            call_blocking("index.describe_index_stats", index.describe_index_stats)
+            for _ in range(settings.WARMUP_CONNECTIONS)
+        )
+    )
+
+
+async def _probe_gemini() -> None:
+    # Token counts are free; they open the channels of the Gemini client used
+    # for function calling and of the LangChain chat client
+    await asyncio.gather(
+        get_text_embedding("warm-up"),
+        call_blocking("count_tokens", prompt_cache.count_tokens, "warm-up"),
+        call_blocking("count_tokens", chain_creation.count_chat_tokens, "warm-up"),
+    )
+
+
+def _build_chains() -> None:
+    for prompt_template in all_prompts():
+        chain_creation.get_chain(prompt_template)
+        prompt_cache.cached_content(prompt_template)  # None without PROMPT_CACHING
+
+
+def _load_active_users(limit: int) -> list[int]:
+    with StateSessionLocal() as session:
+        return [
+            row.user_id
+            for row in session.query(ActiveUser.user_id)
+            .order_by(ActiveUser.last_seen_at.desc())
+            .limit(limit)
+        ]
+
+
+async def _preload_user(user_id: int, slots: asyncio.Semaphore) -> None:
+    async with slots:
+        if settings.FUZZY_MATCHING:
+            await name_index.ensure_loaded(user_id)
+        await location_view.preload(user_id)
+
+
+async def _preload_hot_users() -> None:
+    user_ids = await asyncio.to_thread(_load_active_users, settings.WARMUP_HOT_USERS)
+    slots = asyncio.Semaphore(PRELOAD_CONCURRENCY)
+    await asyncio.gather(*(_preload_user(user_id, slots) for user_id in user_ids))
+
+
+STEPS = {
+    "index_connections": _open_index_connections,
+    "gemini_clients": _probe_gemini,
+    "prompt_chains": lambda: asyncio.to_thread(_build_chains),
+    "hot_users": _preload_hot_users,
+}
+
+
+async def _step(name: str, run) -> None:
+    if name == "hot_users" and settings.WARMUP_HOT_USERS <= 0:
+        return
+    start = time.monotonic()
+    try:
+        await run()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Warm-up step {name} failed: {e}")
+        metrics.increment(f"warmup_failures:{name}")
+    _durations[name] = time.monotonic() - start
+
+
+async def warm_up() -> None:
+    """Run every warm-up step; a failing step is logged and skipped."""
+    start = time.monotonic()
+    # The steps use different dependencies and can overlap
+    await asyncio.gather(*(_step(name, run) for name, run in STEPS.items()))
+    _durations["total"] = time.monotonic() - start
+    print(
+        "Warm-up done: "
+        + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in _durations.items())
+    )
+
+
+async def _run() -> None:
+    try:
+        await asyncio.wait_for(warm_up(), settings.WARMUP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print(f"Warm-up did not finish in {settings.WARMUP_TIMEOUT_SECONDS} s; reporting ready")
+        metrics.increment("warmup_timeouts")
+    finally:
+        _ready.set()
+
+
+def _save_active_users(user_ids: list[int]) -> None:
+    now = utc_now()
+    with StateSessionLocal() as session:
+        for user_id in user_ids:
+            session.merge(ActiveUser(user_id=user_id, last_seen_at=now))
+        session.commit()
+
+
+async def start() -> None:
+    """Start warming up; readiness is reported once it is done."""
+    global _task
+    _ready.clear()
+    metrics.register_gauge("ready", lambda: int(is_ready()))
+    for name in (*STEPS, "total"):
+        metrics.register_gauge(
+            f"warmup_seconds:{name}", lambda name=name: _durations.get(name, 0.0)
+        )
+    if not settings.WARMUP:
+        _ready.set()
+        return
+    if settings.WARMUP_HOT_USERS > 0:
+        await asyncio.to_thread(StateBase.metadata.create_all, state_engine)
+    _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    """Stop a running warm-up and remember the most recently active users."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    if settings.WARMUP and settings.WARMUP_HOT_USERS > 0:
+        user_ids = cost_accounting.recent_users(settings.WARMUP_HOT_USERS)
+        try:
+            await asyncio.to_thread(_save_active_users, user_ids)
+        except Exception as e:
+            print(f"Error saving the active users: {e}")
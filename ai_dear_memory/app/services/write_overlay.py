@@ -0,0 +1,204 @@
+"""
+Read-your-writes overlay over the eventually consistent vector index.
+
+Pinecone can take a few seconds to make a write visible: a question asked
+right after a save may not find the new memory, and one asked right after a
+delete may still find the old one, so clients retry. vector_store records
+every acknowledged upsert and delete here for WRITE_OVERLAY_SECONDS, and
+merges them into the results of its queries and fetches: upserted vectors
+are scored against the query like the index would (they are kept in a small
+LocalIndex per user), their index copies are replaced, and deleted vectors
+are dropped. Item and location lookups, the duplicate check of saves and
+the rename path all read through it.
+
+The overlay belongs to the process that handled the write; a request served
+by another worker still sees the index as it is. Overlays of users who do not
+read again are swept on later writes, once per WRITE_OVERLAY_SECONDS.
+"""
+
+import time
+from app.core.config import settings
+from app.core.local_index import LocalIndex, Record, matches_filter
+from app.services import metrics
+
+
+class UserOverlay:
+    """Recent writes of one user, each kept until its expiry time."""
+
+    def __init__(self):
+        self.index = LocalIndex(settings.INDEX_DIMENSION, metric=settings.index_metric)
+        self.written: dict[str, float] = {}
+        self.tombstones: dict[str, float] = {}
+        self.cleared_until = 0.0  # all older index entries deleted
+
+    def expire(self, now: float) -> None:
+        expired = [vector_id for vector_id, until in self.written.items() if until <= now]
+        if expired:
+            self.index.delete(ids=expired)
+            for vector_id in expired:
+                del self.written[vector_id]
+        for vector_id in [i for i, until in self.tombstones.items() if until <= now]:
+            del self.tombstones[vector_id]
+
+    def empty(self) -> bool:
+        return not self.written and not self.tombstones and not self.cleared_until
+
+    def hides(self, vector_id: str, now: float) -> bool:
+        """Whether the index copy of a vector is outdated."""
+        return (
+            vector_id in self.written
+            or vector_id in self.tombstones
+            or self.cleared_until > now
+        )
+
+
+_overlays: dict[int, UserOverlay] = {}
+_swept_at = 0.0
+
+metrics.register_gauge("write_overlay_users", lambda: len(_overlays))
+
+
+def _current(user_id: int) -> UserOverlay | None:
+    overlay = _overlays.get(user_id)
+    if overlay is None:
+        return None
+    now = time.monotonic()
+    overlay.expire(now)
+    if overlay.cleared_until <= now:
+        overlay.cleared_until = 0.0
+    if overlay.empty():
+        del _overlays[user_id]
+        return None
+    return overlay
+
+
+def _sweep() -> None:
+    # Overlays are otherwise only dropped when their user reads again
+    global _swept_at
+    now = time.monotonic()
+    if now - _swept_at < settings.WRITE_OVERLAY_SECONDS:
+        return
+    _swept_at = now
+    for user_id in list(_overlays):
+        _current(user_id)
+
+
+def record_upsert(user_id: int, vectors: list) -> None:
+    """
+    Keep acknowledged upserts visible to the user's reads.
+
+    Args:
+        user_id (int): The user ID.
+        vectors (list): The records passed to index.upsert.
+    """
+    if settings.WRITE_OVERLAY_SECONDS <= 0:
+        return
+    _sweep()
+    overlay = _overlays.setdefault(user_id, UserOverlay())
+    until = time.monotonic() + settings.WRITE_OVERLAY_SECONDS
+    overlay.index.upsert(vectors=vectors)
+    for vector in vectors:
+        vector_id = vector["id"] if isinstance(vector, dict) else vector[0]
+        overlay.written[vector_id] = until
+        overlay.tombstones.pop(vector_id, None)
+
+
+def record_delete(user_id: int, vector_ids: list) -> None:
+    """Hide acknowledged deletes from the user's reads."""
+    if settings.WRITE_OVERLAY_SECONDS <= 0:
+        return
+    _sweep()
+    overlay = _overlays.setdefault(user_id, UserOverlay())
+    until = time.monotonic() + settings.WRITE_OVERLAY_SECONDS
+    overlay.index.delete(ids=vector_ids)
+    for vector_id in vector_ids:
+        overlay.written.pop(vector_id, None)
+        overlay.tombstones[vector_id] = until
+
+
+def record_delete_all(user_id: int) -> None:
+    """Hide every vector the index still returns for a user deleted at once."""
+    if settings.WRITE_OVERLAY_SECONDS <= 0:
+        return
+    _sweep()
+    overlay = UserOverlay()
+    overlay.cleared_until = time.monotonic() + settings.WRITE_OVERLAY_SECONDS
+    _overlays[user_id] = overlay
+
+
+def hidden_bound(user_id: int) -> int:
+    """
+    Upper bound on the index matches the overlay can drop from a user's query:
+    the copies of recently upserted and deleted vectors. Queries over-fetch by
+    this many, so a merged page is only shorter than top_k when the index has
+    no more matches. After a delete of all the user's vectors every index match
+    is dropped and the overlay alone is the answer, so the bound is 0.
+    """
+    overlay = _current(user_id)
+    if overlay is None or overlay.cleared_until:
+        return 0
+    return len(overlay.written) + len(overlay.tombstones)
+
+
+def merge_query(user_id: int, response, kwargs: dict):
+    """
+    Merge the user's recent writes into an index query response.
+
+    Args:
+        user_id (int): The user whose memories were queried.
+        response: The index query response, fetched with up to
+            hidden_bound(user_id) more matches than top_k.
+        kwargs (dict): The arguments of the query (vector, top_k, filter, ...).
+
+    Returns:
+        The response, or a Record with the merged matches when the user has
+        recent writes.
+    """
+    overlay = _current(user_id)
+    if overlay is None:
+        if len(response["matches"]) > kwargs["top_k"]:
+            return Record(matches=response["matches"][: kwargs["top_k"]])
+        return response
+    now = time.monotonic()
+    recent = overlay.index.query(**kwargs)["matches"]
+    matches = [
+        match for match in response["matches"] if not overlay.hides(match["id"], now)
+    ]
+    if len(matches) < len(response["matches"]):
+        metrics.increment("write_overlay_hidden", len(response["matches"]) - len(matches))
+    if recent:
+        metrics.increment("write_overlay_matches", len(recent))
+    matches = sorted(matches + recent, key=lambda match: match["score"], reverse=True)
+    return Record(matches=matches[: kwargs["top_k"]])
+
+
+def recent_matches(user_id: int, filter: dict | None) -> list:
+    """The user's recently upserted vectors matching a metadata filter."""
+    overlay = _current(user_id)
+    if overlay is None or not overlay.written:
+        return []
+    fetched = overlay.index.fetch(ids=list(overlay.written)).vectors
+    return [
+        Record(id=vector_id, score=0.0, metadata=dict(vector_data["metadata"]))
+        for vector_id, vector_data in fetched.items()
+        if matches_filter(vector_data["metadata"], filter)
+    ]
+
+
+def merge_fetch(user_id: int, response, ids: list):
+    """Merge the user's recent writes into an index fetch response."""
+    overlay = _current(user_id)
+    if overlay is None:
+        return response
+    now = time.monotonic()
+    vectors = {
+        vector_id: vector_data
+        for vector_id, vector_data in response.vectors.items()
+        if not overlay.hides(vector_id, now)
+    }
+    vectors.update(overlay.index.fetch(ids=ids).vectors)
+    return Record(vectors=vectors)
+
+
+def clear() -> None:
+    _overlays.clear()
@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, declarative_base
+from app.core.config import settings
+
+# Database for state owned by the app itself (background jobs, ...). A local
+# SQLite file by default; set STATE_DATABASE_URL to the MySQL URI to share it
+# between hosts.
+state_engine = create_engine(
+    settings.STATE_DATABASE_URL,
+    connect_args=(
+        {"check_same_thread": False}
+        if settings.STATE_DATABASE_URL.startswith("sqlite")
+        else {}
+    ),
+)
+
+# Create session factory
+StateSessionLocal = sessionmaker(bind=state_engine, autocommit=False, autoflush=False)
+
+# Base class for the ORM models stored in the state database
+StateBase = declarative_base()
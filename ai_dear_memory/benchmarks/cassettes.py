@@ -0,0 +1,472 @@
+"""
+Record the Gemini and Pinecone calls of real request flows once, then replay
+them offline.
+
+`record()` wraps the Gemini embedding and function-calling clients, the
+LangChain chat model of `chain_creation` and the vector index, and writes
+every call with its response and latency to a cassette. `replay()` configures
+the app offline, like `stubs.install()`, and answers the same calls from the
+cassette, waiting for the recorded latencies times `latency_scale`.
+
+Calls are matched by a key built from their arguments. Generated IDs,
+timestamps and embeddings are reduced to placeholders or digests, so a
+replayed flow finds the calls recorded for it; a key seen several times
+replays its responses in recorded order. A call whose key was not recorded
+raises LookupError and is counted in stubs.calls["cassette:misses"]. With
+`fuzzy=True` (load_test --cassette-fuzzy) it gets the next unused response of
+the same kind instead, for flows whose keys are not stable (for instance a
+prompt listing an unordered set); its answer may then belong to another call.
+
+Cassettes are gzipped JSON lines; float vectors are stored as base64 float32.
+
+Run from the `ai_dear_memory` directory. Recording calls the real services
+with the credentials from `.env`; replaying needs no network:
+    python -m benchmarks.cassettes record trace.jsonl --output flows.cassette.gz
+    python -m benchmarks.load_test replay trace.jsonl --cassette flows.cassette.gz
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import argparse
+import threading
+from array import array
+from collections import defaultdict, deque
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import Runnable
+
+from benchmarks import stubs
+
+# Settings that change which calls are made and what they look like; they are
+# stored in the cassette and applied when replaying
+RECORDED_SETTINGS = (
+    "INDEX_DIMENSION",
+    "EMBEDDING_MODEL",
+    "EMBEDDING_PREVIOUS_MODEL",
+    "CHAT_MODEL",
+    "HYBRID_SEARCH",
+    "NAMESPACE_LAYOUT",
+    "NAMESPACE_BUCKETS",
+    "STRUCTURED_EXTRACTION",
+    "FUZZY_MATCHING",
+    "PROMPT_CACHING",
+)
+
+# Index methods and the stubs.calls counter of their replays
+INDEX_METHODS = {
+    "query": "index_query",
+    "fetch": "index_query",
+    "list_paginated": "index_query",
+    "describe_index_stats": "index_query",
+    "upsert": "index_write",
+    "delete": "index_write",
+}
+
+# Float lists at least this long are stored as float32 and keyed by digest
+MIN_VECTOR_LENGTH = 16
+
+_ID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+_TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?(?:[+-]\d\d:\d\d|Z)?")
+
+
+def _is_vector(value) -> bool:
+    if isinstance(value, array):
+        return len(value) >= MIN_VECTOR_LENGTH
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) >= MIN_VECTOR_LENGTH
+        and all(isinstance(v, float) for v in value)
+    )
+
+
+def _float32(values) -> bytes:
+    return array("f", values).tobytes()
+
+
+def _normalize(value):
+    """Reduce call arguments to the parts that identify the call."""
+    if isinstance(value, str):
+        return _TIMESTAMP.sub("<time>", _ID.sub("<id>", value))
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if _is_vector(value):
+        return "vector:" + hashlib.sha1(_float32(value)).hexdigest()[:16]
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return _normalize(str(value))
+
+
+def call_key(kind: str, *args, **kwargs) -> str:
+    kwargs.pop("request_options", None)  # carries the remaining deadline
+    normalized = json.dumps([kind, _normalize(args), _normalize(kwargs)], sort_keys=True)
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def to_plain(value):
+    """Convert an SDK response to JSON-compatible values."""
+    if not isinstance(value, dict):
+        if hasattr(value, "to_dict"):
+            value = value.to_dict()
+        elif hasattr(value, "__dict__"):
+            value = vars(value)
+    if isinstance(value, dict):
+        return {str(key): to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, array)):
+        return [to_plain(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _pack(value):
+    if _is_vector(value):
+        return {"__f32__": base64.b64encode(_float32(value)).decode()}
+    if isinstance(value, dict):
+        return {key: _pack(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_pack(item) for item in value]
+    return value
+
+
+def _unpack(value):
+    if isinstance(value, dict):
+        if "__f32__" in value:
+            return array("f", base64.b64decode(value["__f32__"])).tolist()
+        return {key: _unpack(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unpack(item) for item in value]
+    return value
+
+
+def _record(value):
+    """Wrap index responses in Records, like the local index returns them."""
+    from app.core.local_index import Record
+
+    if isinstance(value, dict):
+        return Record({key: _record(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_record(item) for item in value]
+    return value
+
+
+def _tool_names(tools) -> list[str]:
+    return [
+        declaration.name
+        for tool in tools or []
+        for declaration in tool.function_declarations
+    ]
+
+
+def _prompt_messages(prompt_value) -> list:
+    return [(message.type, message.content) for message in prompt_value.to_messages()]
+
+
+class Recorder:
+    """Appends recorded calls to a cassette file."""
+
+    def __init__(self, path: str, settings: dict):
+        self.path = path
+        self.count = 0
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._file.write(json.dumps({"cassette": 1, "settings": settings}) + "\n")
+
+    def add(self, kind: str, key: str, latency: float, response) -> None:
+        """Record a call answered with JSON-compatible response values."""
+        line = {
+            "kind": kind,
+            "key": key,
+            "latency": round(latency, 4),
+            "response": _pack(response),
+        }
+        with self._lock:
+            self._file.write(json.dumps(line) + "\n")
+            self.count += 1
+
+    def call(self, kind: str, key: str, fn, *args, **kwargs):
+        """Run fn and record its response under key."""
+        start = time.perf_counter()
+        response = fn(*args, **kwargs)
+        self.add(kind, key, time.perf_counter() - start, to_plain(response))
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Player:
+    """Answers calls from a recorded cassette."""
+
+    def __init__(self, path: str, latency_scale: float = 1.0, fuzzy: bool = False):
+        self.latency_scale = latency_scale
+        self.fuzzy = fuzzy
+        self.entries = []
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            self.settings = json.loads(file.readline())["settings"]
+            for line in file:
+                self.entries.append(json.loads(line))
+        self._lock = threading.Lock()
+        self.rewind()
+
+    def rewind(self) -> None:
+        """Start replaying the cassette from the beginning again."""
+        with self._lock:
+            self._by_key = defaultdict(deque)
+            self._by_kind = defaultdict(deque)
+            for position, entry in enumerate(self.entries):
+                self._by_key[entry["key"]].append(position)
+                self._by_kind[entry["kind"]].append(position)
+            self._used = set()
+
+    def _next(self, kind: str, key: str) -> dict:
+        with self._lock:
+            positions = self._by_key.get(key)
+            if positions:
+                # The last response of a key answers every later call
+                position = positions.popleft() if len(positions) > 1 else positions[0]
+            else:
+                stubs.calls["cassette:misses"] += 1
+                if not self.fuzzy:
+                    raise LookupError(f"The cassette has no {kind} call with key {key}")
+                unused = self._by_kind[kind]
+                while len(unused) > 1 and unused[0] in self._used:
+                    unused.popleft()
+                if not unused:
+                    raise LookupError(f"The cassette has no {kind} call")
+                position = unused[0]
+            self._used.add(position)
+            return self.entries[position]
+
+    def play(self, kind: str, key: str, counter: str):
+        entry = self._next(kind, key)
+        stubs.calls[counter] += 1
+        time.sleep(entry["latency"] * self.latency_scale)
+        return _unpack(entry["response"])
+
+
+class RecordingIndex:
+    """Vector index wrapper recording the calls listed in INDEX_METHODS."""
+
+    def __init__(self, index, recorder: Recorder):
+        self.index = index
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        method = getattr(self.index, name)
+        if name not in INDEX_METHODS:
+            return method
+
+        def call(*args, **kwargs):
+            kind = f"index.{name}"
+            key = call_key(kind, *args, **kwargs)
+            return self.recorder.call(kind, key, method, *args, **kwargs)
+
+        return call
+
+
+class PlayerIndex:
+    """Vector index answering from a cassette."""
+
+    def __init__(self, player: Player):
+        self.player = player
+
+    def __getattr__(self, name):
+        if name not in INDEX_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            kind = f"index.{name}"
+            response = self.player.play(
+                kind, call_key(kind, *args, **kwargs), INDEX_METHODS[name]
+            )
+            return _record(response)
+
+        return call
+
+
+class RecordingChatModel(Runnable):
+    """Chat model wrapper recording the answers of the wrapped model."""
+
+    def __init__(self, model, recorder: Recorder):
+        self.model = model
+        self.recorder = recorder
+
+    def invoke(self, input, config=None, **kwargs):
+        key = call_key(
+            "chain", _prompt_messages(input), cached=bool(kwargs.get("cached_content"))
+        )
+        model = self.model.bind(**kwargs) if kwargs else self.model
+        start = time.perf_counter()
+        message = model.invoke(input, config)
+        self.recorder.add(
+            "chain",
+            key,
+            time.perf_counter() - start,
+            {"content": message.content, "usage_metadata": to_plain(message.usage_metadata)},
+        )
+        return message
+
+
+class PlayerChatModel(Runnable):
+    """Chat model answering from a cassette."""
+
+    def __init__(self, player: Player):
+        self.player = player
+
+    def invoke(self, input, config=None, **kwargs):
+        key = call_key(
+            "chain", _prompt_messages(input), cached=bool(kwargs.get("cached_content"))
+        )
+        response = self.player.play("chain", key, "chain")
+        return AIMessage(
+            content=response["content"], usage_metadata=response["usage_metadata"]
+        )
+
+
+def record(path: str):
+    """
+    Record the external calls of the app to a cassette. Must be called before
+    any `app.services` module is imported, with the app configured for the
+    services to record (the real ones, or the stand-ins of `stubs.install()`).
+
+    Returns:
+        Recorder: Close it once the flows have run.
+    """
+    from app.core import config
+
+    settings = {name: str(getattr(config.settings, name)) for name in RECORDED_SETTINGS}
+    recorder = Recorder(path, settings)
+
+    embed_content = config.genai.embed_content
+
+    def recording_embed_content(model, content, **kwargs):
+        key = call_key("embed", model, content)
+        return recorder.call("embed", key, embed_content, model, content, **kwargs)
+
+    class RecordingModel(config.genai.GenerativeModel):
+        def __init__(self, model_name, tools=None, **kwargs):
+            super().__init__(model_name, tools=tools, **kwargs)
+            self._cassette_args = (model_name, _tool_names(tools))
+
+        def generate_content(self, contents, **kwargs):
+            key = call_key("function_call", *self._cassette_args, contents)
+            return recorder.call(
+                "function_call", key, super().generate_content, contents, **kwargs
+            )
+
+    config.genai.embed_content = recording_embed_content
+    config.genai.GenerativeModel = RecordingModel
+    config.index = RecordingIndex(config.index, recorder)
+
+    from app.services import chain_creation
+
+    chain_creation.llm = RecordingChatModel(chain_creation.llm, recorder)
+    return recorder
+
+
+def replay(
+    path: str, latency_scale: float = 1.0, fuzzy: bool = False, **settings_overrides
+):
+    """
+    Configure the app offline and answer its external calls from a cassette.
+    Must be called before any `app.services` module is imported.
+
+    Args:
+        path (str): The cassette file.
+        latency_scale (float): Multiplier of the recorded latencies.
+        fuzzy (bool): Answer calls missing from the cassette with the next
+            unused response of their kind instead of raising LookupError.
+        **settings_overrides: App settings to override.
+
+    Returns:
+        Player: The cassette player; rewind() it to replay from the start.
+    """
+    from google.generativeai import protos
+    from google.generativeai.types import GenerateContentResponse
+
+    player = Player(path, latency_scale, fuzzy)
+    stubs.offline_environment(**{**player.settings, **settings_overrides})
+
+    from app.core import config
+
+    def embed_content(model, content, **kwargs):
+        return player.play("embed", call_key("embed", model, content), "embed")
+
+    class PlayerModel:
+        def __init__(self, model_name, tools=None, **kwargs):
+            self._cassette_args = (model_name, _tool_names(tools))
+
+        def generate_content(self, contents, **kwargs):
+            key = call_key("function_call", *self._cassette_args, contents)
+            response = player.play("function_call", key, "function_call")
+            return GenerateContentResponse.from_response(
+                protos.GenerateContentResponse(response)
+            )
+
+    config.genai.embed_content = embed_content
+    config.genai.GenerativeModel = PlayerModel
+    config.index = PlayerIndex(player)
+
+    from app.services import chain_creation, prompt_cache
+
+    chain_creation.llm = PlayerChatModel(player)
+    chain_creation.count_chat_tokens = stubs.count_tokens
+    prompt_cache.count_tokens = stubs.count_tokens
+    prompt_cache.create_cached_content = stubs.create_cached_content
+    prompt_cache.delete_cached_content = stubs.delete_cached_content
+    return player
+
+
+async def record_trace(args) -> None:
+    import httpx
+
+    os.environ.update(dict(setting.split("=", 1) for setting in args.set))
+    recorder = record(args.output)
+
+    from app.main import app
+    from benchmarks.load_test import Replayer, load_trace
+
+    records = load_trace(args.trace)
+    statuses = defaultdict(int)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://cassette"
+        ) as client:
+            replayer = Replayer(client, 0, args.timeout)
+            loop = asyncio.get_running_loop()
+            # One request at a time, so the calls are recorded in a stable order
+            for request in records:
+                result = await replayer.send(request, loop.time())
+                statuses[result["status"]] += 1
+    recorder.close()
+    print(
+        f"Recorded {recorder.count} calls of {len(records)} requests "
+        f"(statuses {dict(statuses)}) to {args.output}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser(
+        "record", help="Send a trace to the app and record its external calls"
+    )
+    record_parser.add_argument("trace")
+    record_parser.add_argument("--output", required=True)
+    record_parser.add_argument("--timeout", type=float, default=60.0)
+    record_parser.add_argument("--set", action="append", default=[], metavar="SETTING=VALUE")
+    args = parser.parse_args()
+    asyncio.run(record_trace(args))
+
+
+if __name__ == "__main__":
+    main()
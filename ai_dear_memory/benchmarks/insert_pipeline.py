@@ -0,0 +1,66 @@
+"""
+Compare the structured single-call insert pipeline with the legacy
+ITEM_SEPARATION -> EXTRACTION_PROMPT -> AI_OUTPUT_PROMPT chain, with and
+without speculative success message phrasing.
+
+Run from the `ai_dear_memory` directory:
+    python -m benchmarks.insert_pipeline
+"""
+
+import time
+import asyncio
+import statistics
+
+from benchmarks import stubs
+
+settings = stubs.install()
+
+from app.schemas.embeddings import EmbeddingRequest  # noqa: E402
+from app.services.generate_embeddings import insert_embedding  # noqa: E402
+
+TEXTS = [
+    "I kept my keys in the drawer",
+    "I put the charger on the desk and the wallet in the travel bag",
+    "I kept my phone on the sofa, later I kept it on the table",
+    "I placed the passport in the safe, the glasses on the shelf and the watch in the cupboard",
+    "I stored the umbrella in the car, the laptop in the backpack, the notebook on the bed and the pen in the pencil box",
+]
+
+
+async def run(structured: bool, speculative: bool, first_user_id: int) -> dict:
+    settings.STRUCTURED_EXTRACTION = structured
+    settings.SPECULATIVE_SUCCESS_MESSAGE = speculative
+    stubs.calls.clear()
+    latencies = []
+    for user_id, text in enumerate(TEXTS, start=first_user_id):
+        start = time.perf_counter()
+        await insert_embedding(EmbeddingRequest(user_id=user_id, text=text))
+        latencies.append(time.perf_counter() - start)
+    return {
+        "llm_calls": stubs.calls["chain"] / len(TEXTS),
+        "embed_calls": stubs.calls["embed"] / len(TEXTS),
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+async def main():
+    print(f"{'mode':<24}{'llm calls':>12}{'embed calls':>13}{'mean ms':>10}{'max ms':>10}")
+    modes = (
+        ("multi-call", False, False),
+        ("multi-call speculative", False, True),
+        ("structured", True, False),
+    )
+    for offset, (label, structured, speculative) in enumerate(modes):
+        # Fresh users per mode so no save is rejected as a duplicate
+        result = await run(
+            structured, speculative, first_user_id=offset * len(TEXTS) + 1
+        )
+        print(
+            f"{label:<24}{result['llm_calls']:>12.1f}{result['embed_calls']:>13.1f}"
+            f"{result['mean_ms']:>10.0f}{result['max_ms']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,423 @@
+"""
+Replay a traffic trace against the four /user_queries endpoints at a sweep
+of open-loop arrival rates and report throughput and latency, fully offline
+on the stand-ins from `benchmarks.stubs` or on the calls recorded in a
+cassette (`benchmarks.cassettes`).
+
+A trace is a JSON lines file with one request per line:
+    {"at": 12.5, "method": "POST", "path": "/user_queries/save",
+     "params": {}, "json": {"user_id": 3, "text": "..."}, "session": 17}
+
+Traces are recorded from a running app with TRAFFIC_TRACE_PATH, or generated
+with Zipfian user popularity and per-user sessions separated by think times.
+Generated rename and delete requests carry "vector_ids": null and a
+"location"; the replayer fills in the IDs returned by earlier saves.
+
+Run from the `ai_dear_memory` directory:
+    python -m benchmarks.load_test generate --output trace.jsonl
+    python -m benchmarks.load_test replay trace.jsonl --rates 1,2,4,8,16
+"""
+
+import sys
+import json
+import random
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+
+from benchmarks import cassettes, stubs
+
+ITEMS = [
+    "keys", "wallet", "passport", "charger", "glasses", "watch", "umbrella",
+    "laptop", "headphones", "notebook", "pen", "remote", "phone", "earrings",
+    "scissors", "tape", "medicine", "sunscreen", "camera", "tickets",
+]
+LOCATIONS = [
+    "drawer", "desk", "blue bag", "backpack", "cupboard", "shelf", "safe",
+    "car", "sofa", "bedside table", "wardrobe", "kitchen counter", "garage",
+    "suitcase", "pencil box",
+]
+DEFAULT_MIX = "save=0.35,retrieve=0.5,rename=0.05,delete=0.1"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def generate_trace(
+    sessions: int,
+    users: int,
+    zipf: float,
+    session_rate: float,
+    mean_ops: float,
+    think_seconds: float,
+    mix: dict,
+    seed: int,
+) -> list[dict]:
+    """
+    Generate sessions of saves, retrievals, renames and deletes. Users are
+    drawn with Zipfian popularity, sessions start as a Poisson process and
+    the requests of a session are separated by exponential think times.
+
+    Returns:
+        list[dict]: Trace records sorted by arrival time.
+    """
+    rng = random.Random(seed)
+    weights = [1 / rank**zipf for rank in range(1, users + 1)]
+    ops, op_weights = list(mix), list(mix.values())
+    stored = defaultdict(dict)  # user -> item -> location, as the trace goes
+    records = []
+    start = 0.0
+
+    for session in range(sessions):
+        start += rng.expovariate(session_rate)
+        user_id = rng.choices(range(1, users + 1), weights)[0]
+        at = start
+        for _ in range(max(1, round(rng.expovariate(1 / mean_ops)))):
+            op = rng.choices(ops, op_weights)[0]
+            memories = stored[user_id]
+            if op in ("rename", "delete", "retrieve") and not memories:
+                op = "save"
+            record = {"at": round(at, 3), "session": session}
+
+            if op == "save":
+                pairs = [
+                    (rng.choice(ITEMS), rng.choice(LOCATIONS))
+                    for _ in range(rng.choice((1, 1, 1, 2)))
+                ]
+                memories.update(pairs)
+                text = " and ".join(
+                    f"my {item} in the {location}" for item, location in pairs
+                )
+                record.update(
+                    method="POST",
+                    path="/user_queries/save",
+                    params={},
+                    json={"user_id": user_id, "text": f"I kept {text}"},
+                )
+            elif op == "retrieve":
+                if rng.random() < 0.7:
+                    item = rng.choice(list(memories))
+                    text = f"Where is my {item}?"
+                else:
+                    text = f"What's in the {rng.choice(list(memories.values()))}?"
+                record.update(
+                    method="GET",
+                    path="/user_queries/retrieve",
+                    params={"user_id": user_id, "text": text},
+                    json=None,
+                )
+            elif op == "rename":
+                original = rng.choice(list(memories.values()))
+                modified = rng.choice(LOCATIONS)
+                for item, location in memories.items():
+                    if location == original:
+                        memories[item] = modified
+                record.update(
+                    method="PUT",
+                    path="/user_queries/rename-location",
+                    params={},
+                    json={
+                        "user_id": user_id,
+                        "vector_ids": None,
+                        "original_location": original,
+                        "modified_location": modified,
+                    },
+                    location=original,
+                )
+            else:
+                location = rng.choice(list(memories.values()))
+                for item in [i for i, loc in memories.items() if loc == location]:
+                    del memories[item]
+                record.update(
+                    method="DELETE",
+                    path="/user_queries/delete",
+                    params={},
+                    json={"user_id": user_id, "vector_ids": None},
+                    location=location,
+                )
+            records.append(record)
+            at += rng.expovariate(1 / think_seconds)
+
+    return sorted(records, key=lambda record: record["at"])
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    records.sort(key=lambda record: record["at"])
+    first = records[0]["at"] if records else 0
+    for record in records:
+        record["at"] -= first
+    return records
+
+
+def retime(records: list[dict], rate: float) -> list[dict]:
+    """
+    Rescale session start times so the trace arrives at `rate` requests per
+    second on average. Think times within a session are kept, since they are
+    human; requests without a session are rescaled individually.
+    """
+    if not records:
+        return []
+    session_starts = {}
+    for record in records:
+        session_starts.setdefault(record.get("session", id(record)), record["at"])
+    span = max(session_starts.values()) or 1.0
+    scale = (len(records) / rate) / span
+    retimed = []
+    for record in records:
+        session_start = session_starts[record.get("session", id(record))]
+        at = session_start * scale + (record["at"] - session_start)
+        retimed.append({**record, "at": at})
+    return sorted(retimed, key=lambda record: record["at"])
+
+
+class Replayer:
+    """Sends trace records to the app and tracks the vector IDs it saved."""
+
+    def __init__(self, client, user_offset: int, timeout: float):
+        self.client = client
+        self.user_offset = user_offset
+        self.timeout = timeout
+        self.saved = defaultdict(lambda: defaultdict(set))  # user -> location -> ids
+
+    def prepare(self, record: dict) -> tuple[dict, dict | None]:
+        params = dict(record.get("params") or {})
+        payload = dict(record["json"]) if record.get("json") else None
+        if "user_id" in params:
+            params["user_id"] = int(params["user_id"]) + self.user_offset
+        if payload and "user_id" in payload:
+            payload["user_id"] += self.user_offset
+            if payload.get("vector_ids") is None and "vector_ids" in payload:
+                locations = self.saved[payload["user_id"]]
+                payload["vector_ids"] = sorted(locations.get(record["location"], ()))
+        return params, payload
+
+    def observe(self, record: dict, payload: dict | None, response) -> None:
+        if response.status_code != 200 or not payload:
+            return
+        locations = self.saved[payload["user_id"]]
+        if record["path"].endswith("/save"):
+            body = response.json()
+            for deleted in body.get("deleted_entries") or []:
+                for ids in locations.values():
+                    ids.discard(deleted)
+            for item in body.get("items") or []:
+                locations[item["location"].lower()].add(item["vector_id"])
+        elif record["path"].endswith("/rename-location"):
+            ids = locations.pop(payload["original_location"], set())
+            locations[payload["modified_location"]].update(ids)
+        elif record["path"].endswith("/delete"):
+            for ids in locations.values():
+                ids.difference_update(payload["vector_ids"])
+
+    async def send(self, record: dict, scheduled: float) -> dict:
+        params, payload = self.prepare(record)
+        loop = asyncio.get_running_loop()
+        sent = loop.time()
+        try:
+            response = await asyncio.wait_for(
+                self.client.request(
+                    record["method"], record["path"], params=params, json=payload
+                ),
+                self.timeout,
+            )
+            status = response.status_code
+            self.observe(record, payload, response)
+        except asyncio.TimeoutError:
+            status = "timeout"
+        done = loop.time()
+        return {
+            "path": record["path"],
+            "status": status,
+            # Measured from the scheduled arrival, so queueing in an overloaded
+            # process is included
+            "latency": done - scheduled,
+            "service": done - sent,
+            "done": done,
+        }
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run_rate(app, records: list[dict], rate: float, args, user_offset: int) -> dict:
+    import httpx
+
+    end = args.warmup + args.duration
+    schedule = [r for r in retime(records, rate) if r["at"] <= end]
+    stubs.calls.clear()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://load-test"
+        ) as client:
+            replayer = Replayer(client, user_offset, args.timeout)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            tasks = []
+            for record in schedule:
+                scheduled = start + record["at"]
+                delay = scheduled - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(replayer.send(record, scheduled)))
+            results = await asyncio.gather(*tasks)
+
+    # Sessions ramp up over the first think times; only requests arriving
+    # after the warm-up are measured
+    window_start = start + args.warmup
+    results = [
+        r
+        for record, r in zip(schedule, results)
+        if record["at"] >= args.warmup
+    ]
+    elapsed = max((r["done"] for r in results), default=window_start) - window_start
+    latencies = [r["latency"] for r in results if r["status"] != "timeout"]
+    statuses = Counter(
+        r["status"] if r["status"] == "timeout" else f"{r['status'] // 100}xx"
+        for r in results
+    )
+    ok = sum(1 for r in results if r["status"] != "timeout" and r["status"] < 500)
+    external_calls = sum(
+        count for name, count in stubs.calls.items() if ":" not in name
+    )
+    return {
+        "rate": rate,
+        "sent": len(results),
+        "arrivals": len(results) / args.duration,
+        "throughput": ok / elapsed if elapsed else 0.0,
+        "ok": ok / len(results) if results else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "timeouts": statuses["timeout"],
+        "statuses": dict(statuses),
+        "calls_per_request": external_calls / len(schedule) if schedule else 0.0,
+        "cassette_misses": stubs.calls["cassette:misses"],
+    }
+
+
+def print_report(results: list[dict], slo: float, fuzzy: bool = False) -> None:
+    print(
+        f"{'offered/s':>10}{'arrived/s':>10}{'sent':>7}{'ok/s':>8}{'ok %':>7}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'timeouts':>10}{'calls/req':>11}"
+    )
+    for r in results:
+        print(
+            f"{r['rate']:>10.1f}{r['arrivals']:>10.1f}{r['sent']:>7}"
+            f"{r['throughput']:>8.2f}{r['ok'] * 100:>7.1f}"
+            f"{r['p50'] * 1000:>9.0f}{r['p95'] * 1000:>9.0f}{r['p99'] * 1000:>9.0f}"
+            f"{r['timeouts']:>10}{r['calls_per_request']:>11.1f}"
+        )
+
+    within_slo = [r for r in results if r["p99"] <= slo and r["ok"] >= 0.99]
+    if within_slo:
+        best = max(within_slo, key=lambda r: r["throughput"])
+        print(
+            f"\nSaturation throughput: {best['throughput']:.2f} req/s "
+            f"(offered {best['rate']:.1f}/s, p99 {best['p99'] * 1000:.0f} ms <= SLO {slo * 1000:.0f} ms)"
+        )
+    else:
+        print(f"\nNo rate met the p99 SLO of {slo * 1000:.0f} ms")
+    overload = results[-1]
+    print(
+        f"At {overload['rate']:.1f}/s offered: {overload['throughput']:.2f} ok/s, "
+        f"p99 {overload['p99'] * 1000:.0f} ms, {overload['timeouts']} timeouts, "
+        f"statuses {overload['statuses']}"
+    )
+    misses = sum(r["cassette_misses"] for r in results)
+    if misses and fuzzy:
+        print(f"{misses} calls were not found in the cassette and got the next recorded response of their kind")
+    elif misses:
+        print(f"{misses} calls were not found in the cassette and failed; --cassette-fuzzy answers them with the next recorded response of their kind")
+
+
+async def replay(args) -> None:
+    overrides = dict(setting.split("=", 1) for setting in args.set)
+    if args.cassette:
+        player = cassettes.replay(
+            args.cassette, args.latency_scale, args.cassette_fuzzy, **overrides
+        )
+    else:
+        player = None
+        stubs.install(**overrides)
+        for name in stubs.LATENCY:
+            stubs.LATENCY[name] *= args.latency_scale
+
+    from app.main import app
+
+    records = load_trace(args.trace)
+    results = []
+    for index, rate in enumerate(float(rate) for rate in args.rates.split(",")):
+        if player:
+            # The cassette holds the calls of the recorded users; every rate
+            # replays it from the start
+            player.rewind()
+            user_offset = 0
+        else:
+            # Fresh users per rate so earlier runs do not change the index contents
+            user_offset = (index + 1) * 1_000_000
+        results.append(await run_rate(app, records, rate, args, user_offset=user_offset))
+        print(f"  {rate:.1f}/s done", file=sys.stderr)
+    print_report(results, args.slo_ms / 1000, args.cassette_fuzzy)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Generate a synthetic trace")
+    generate.add_argument("--output", required=True)
+    generate.add_argument("--sessions", type=int, default=400)
+    generate.add_argument("--users", type=int, default=200)
+    generate.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of user popularity")
+    generate.add_argument("--session-rate", type=float, default=1.0, help="Sessions started per second")
+    generate.add_argument("--mean-ops", type=float, default=4.0, help="Mean requests per session")
+    generate.add_argument("--think-seconds", type=float, default=8.0, help="Mean think time within a session")
+    generate.add_argument("--mix", default=DEFAULT_MIX)
+    generate.add_argument("--seed", type=int, default=7)
+
+    replay_parser = commands.add_parser("replay", help="Replay a trace at several arrival rates")
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument("--rates", default="1,2,4,8,16", help="Offered requests per second")
+    replay_parser.add_argument("--duration", type=float, default=60.0, help="Seconds of measured arrivals per rate")
+    replay_parser.add_argument("--warmup", type=float, default=30.0, help="Seconds of unmeasured arrivals before the measurement")
+    replay_parser.add_argument("--timeout", type=float, default=30.0, help="Client timeout per request")
+    replay_parser.add_argument("--slo-ms", type=float, default=5000.0, help="p99 latency objective")
+    replay_parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for the simulated Gemini and index latencies")
+    replay_parser.add_argument("--cassette", help="Answer external calls from a cassette recorded with benchmarks.cassettes instead of the stand-ins")
+    replay_parser.add_argument("--cassette-fuzzy", action="store_true", help="Answer calls missing from the cassette with the next recorded response of their kind instead of failing them")
+    replay_parser.add_argument("--set", action="append", default=[], metavar="SETTING=VALUE", help="Override an app setting, e.g. --set HEDGING=true")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        records = generate_trace(
+            args.sessions,
+            args.users,
+            args.zipf,
+            args.session_rate,
+            args.mean_ops,
+            args.think_seconds,
+            parse_mix(args.mix),
+            args.seed,
+        )
+        with open(args.output, "w", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+        print(f"Wrote {len(records)} requests to {args.output}")
+    else:
+        asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
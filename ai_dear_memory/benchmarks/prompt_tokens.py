@@ -0,0 +1,128 @@
+"""
+Report the input tokens and chat latency of every prompt with and without
+the shared cache of system messages (PROMPT_CACHING).
+
+Chat calls go to the offline stand-in, which counts input and cached tokens
+and charges --ms-per-1k-tokens of latency for every thousand input tokens that
+are not served from the cache. With --real-tokens, system messages are counted
+by the Gemini tokenizer (GEMINI_API_KEY must be set) instead of estimated.
+
+Run from the `ai_dear_memory` directory:
+    python -m benchmarks.prompt_tokens
+    python -m benchmarks.prompt_tokens --min-tokens 32768   # as if the shared prefix were too small
+"""
+
+import os
+import time
+import argparse
+import functools
+
+from benchmarks import stubs
+
+SAMPLE_VALUES = {
+    "text": "I kept my keys in the drawer and the wallet in the travel bag",
+    "input_text": "I kept my keys in the drawer",
+    "user_query": "Where are my keys?",
+    "responses": [
+        {"item": "keys", "exact_location": ["drawer"], "similar_items": [], "status_code": 200}
+    ],
+    "items": [{"item": "keys", "exact_item": "keys", "similar_items": []}],
+    "locations": [{"location": "drawer", "exact_items": ["keys"], "similar_locations": []}],
+}
+
+
+def sample_input(prompt_template) -> dict:
+    from langchain_core.prompts import ChatPromptTemplate
+
+    variables = ChatPromptTemplate.from_messages(prompt_template).input_variables
+    return {name: SAMPLE_VALUES.get(name, "drawer") for name in variables}
+
+
+def measure(prompt_template, calls: int) -> tuple[float, float, float]:
+    """Return the input tokens, cached tokens and latency per call."""
+    from app.services.chain_creation import invoke_chain
+
+    input_data = sample_input(prompt_template)
+    stubs.calls.clear()
+    start = time.perf_counter()
+    for _ in range(calls):
+        invoke_chain(prompt_template, input_data)
+    elapsed = time.perf_counter() - start
+    return (
+        stubs.calls["tokens:chain_input"] / calls,
+        stubs.calls["tokens:chain_cached"] / calls,
+        elapsed / calls * 1000,
+    )
+
+
+def prompts():
+    for module in (stubs.info_extraction, stubs.item_matching, stubs.text_formatting):
+        for name, value in vars(module).items():
+            if name.isupper():
+                yield name, value
+
+
+def main(args) -> None:
+    overrides = {}
+    if args.min_tokens is not None:
+        overrides["PROMPT_CACHE_MIN_TOKENS"] = args.min_tokens
+    if args.real_tokens:
+        import google.generativeai as genai
+
+        # Keep the real model class; install() replaces it with the stand-in
+        tokenizer_class = genai.GenerativeModel
+        overrides["GEMINI_API_KEY"] = os.environ["GEMINI_API_KEY"]
+    settings = stubs.install(**overrides)
+    stubs.LATENCY["chain_per_1k_input_tokens"] = args.ms_per_1k_tokens / 1000
+
+    from app.services import prompt_cache
+
+    if args.real_tokens:
+        tokenizer = tokenizer_class(settings.CHAT_MODEL)
+
+        @functools.lru_cache(maxsize=None)
+        def count_tokens(text: str) -> int:
+            return tokenizer.count_tokens(text).total_tokens if text else 0
+
+        stubs.count_tokens = prompt_cache.count_tokens = count_tokens
+
+    print(
+        f"{'prompt':<28}{'system':>8}{'cached':>8}{'in/call':>9}{'in/call':>9}"
+        f"{'saved':>7}{'from':>8}{'ms/call':>9}{'ms/call':>9}"
+    )
+    print(
+        f"{'':<28}{'tokens':>8}{'':>8}{'plain':>9}{'cached':>9}{'':>7}{'cache':>8}"
+        f"{'plain':>9}{'cached':>9}"
+    )
+    totals = [0.0, 0.0]
+    for name, prompt_template in prompts():
+        settings.PROMPT_CACHING = False
+        plain_tokens, _, plain_ms = measure(prompt_template, args.calls)
+        settings.PROMPT_CACHING = True
+        cached_tokens, read_tokens, cached_ms = measure(prompt_template, args.calls)
+        system_tokens = stubs.count_tokens(prompt_cache.system_message(prompt_template) or "")
+        cached = prompt_cache.cached_content(prompt_template) is not None
+        totals[0] += plain_tokens
+        totals[1] += cached_tokens
+        print(
+            f"{name:<28}{system_tokens:>8}{'yes' if cached else 'no':>8}"
+            f"{plain_tokens:>9.0f}{cached_tokens:>9.0f}"
+            f"{1 - cached_tokens / plain_tokens:>7.0%}{read_tokens:>8.0f}"
+            f"{plain_ms:>9.0f}{cached_ms:>9.0f}"
+        )
+    print(
+        f"\nInput tokens per call of every prompt: {totals[0]:.0f} plain, {totals[1]:.0f} "
+        f"cached ({1 - totals[1] / totals[0]:.0%} saved). Shared prefix: "
+        f"{stubs.count_tokens(prompt_cache.shared_prefix())} tokens, read from the cache "
+        f"at a discount; PROMPT_CACHE_MIN_TOKENS={settings.PROMPT_CACHE_MIN_TOKENS}. "
+        f"Caches created: {len(stubs.CACHES)}."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=5, help="Calls per prompt and mode")
+    parser.add_argument("--min-tokens", type=int, help="Override PROMPT_CACHE_MIN_TOKENS")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=40.0)
+    parser.add_argument("--real-tokens", action="store_true")
+    main(parser.parse_args())
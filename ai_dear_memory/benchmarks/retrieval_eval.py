@@ -0,0 +1,230 @@
+"""
+Evaluate item and location retrieval on a labeled dataset of saves and
+questions (exact names, plurals, typos, synonyms and absent items) over a
+grid of settings, reporting answer and suggestion precision/recall next to
+the external calls and latency per question. The app's caches and views are
+reset before each grid point, so every point is measured from the same state.
+
+Answers are the exact locations (or items) returned for a question;
+suggestions are the similar names offered when nothing exact was found.
+
+Run from the `ai_dear_memory` directory:
+    python -m benchmarks.retrieval_eval
+    python -m benchmarks.retrieval_eval --grid SIMILAR_ITEM_MIN_SCORE=0.6,0.65,0.7 --grid FUZZY_MATCHING=true,false
+
+The stand-in embeddings only capture spelling, so synonym results are only
+meaningful with --real-embeddings, which embeds with Gemini (GEMINI_API_KEY
+must be set) while keeping the local index.
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from benchmarks import stubs
+
+DATASET = Path(__file__).with_name("retrieval_dataset.json")
+# Both change the answers on the bundled dataset with the stand-in embeddings;
+# location suggestions and SIMILAR_TOP_K barely do there
+DEFAULT_GRID = [
+    "FUZZY_MATCH_MIN_SCORE=0.7,0.8,0.9",
+    "SIMILAR_ITEM_MIN_SCORE=0.3,0.4,0.5",
+]
+
+
+def parse_grid(specs: list[str]) -> list[tuple[str, list[str]]]:
+    grid = []
+    for spec in specs:
+        name, values = spec.split("=", 1)
+        grid.append((name.strip(), [value.strip() for value in values.split(",")]))
+    return grid
+
+
+def coerce(current, value: str):
+    """Convert a grid value to the type of the current setting."""
+    if isinstance(current, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    return type(current)(value)
+
+
+async def load_dataset(dataset: dict, first_user_id: int) -> list[tuple[int, dict]]:
+    """Save every user's memories and return (user_id, question) pairs."""
+    from app.schemas.embeddings import EmbeddingRequest
+    from app.services.generate_embeddings import insert_embedding
+    from app.services.name_index import ensure_loaded
+
+    questions = []
+    for user_id, user in enumerate(dataset["users"], start=first_user_id):
+        for text in user["saves"]:
+            result = await insert_embedding(EmbeddingRequest(user_id=user_id, text=text))
+            if not isinstance(result, dict):
+                print(f"Save failed for user {user_id}: {text!r}")
+        await ensure_loaded(user_id)
+        questions.extend((user_id, question) for question in user["questions"])
+    return questions
+
+
+async def ask(user_id: int, question: dict) -> tuple[set, set]:
+    """Return the answers and suggestions for a labeled question."""
+    from app.schemas.embeddings import EmbeddingRequest
+    from app.services.retrieving_memory import process_item, process_location
+    from app.core.config import settings
+
+    text = (
+        f"Where is my {question['name']}?"
+        if question["kind"] == "item"
+        else f"What's in the {question['name']}?"
+    )
+    data = EmbeddingRequest(user_id=user_id, text=text)
+    if question["kind"] == "item":
+        result = await process_item(data, question["name"], settings.SIMILAR_ITEM_MIN_SCORE)
+        return set(result["exact_location"]), set(result["similar_items"])
+    result = await process_location(data, question["name"])
+    return set(result["exact_items"]), set(result["similar_locations"])
+
+
+def score(results: list[tuple[dict, set, set]]) -> dict:
+    answered = correct = answerable = 0
+    suggested = relevant = 0
+    surfaced = wanted = 0
+    for question, answers, suggestions in results:
+        expected = question["expected"]
+        expected_answers = (
+            {expected} if isinstance(expected, str) else set(expected or ())
+        )
+        if expected_answers:
+            answerable += 1
+        if answers:
+            answered += 1
+            correct += answers == expected_answers
+        suggested += len(suggestions)
+        if question.get("suggest"):
+            wanted += 1
+            hit = question["suggest"] in suggestions or (
+                expected_answers and answers == expected_answers
+            )
+            surfaced += bool(hit)
+            relevant += question["suggest"] in suggestions
+    return {
+        "answer_precision": correct / answered if answered else 0.0,
+        "answer_recall": correct / answerable if answerable else 0.0,
+        "suggestion_precision": relevant / suggested if suggested else 0.0,
+        "intent_recall": surfaced / wanted if wanted else 0.0,
+    }
+
+
+async def reset_state(questions: list[tuple[int, dict]]) -> None:
+    """
+    Drop what earlier grid points left in the app's caches and views, so each
+    one starts alike instead of answering from its predecessors' lookups. The
+    name indexes are loaded again before the measurement, as after the saves.
+    """
+    from app.services import location_view, name_index, negative_cache, write_overlay
+
+    negative_cache.clear()
+    write_overlay.clear()
+    name_index.clear()
+    await asyncio.to_thread(location_view._reset)
+    latency = dict(stubs.LATENCY)
+    stubs.LATENCY.update({name: 0.0 for name in stubs.LATENCY})
+    for user_id in sorted({user_id for user_id, _ in questions}):
+        await name_index.ensure_loaded(user_id)
+    stubs.LATENCY.update(latency)
+
+
+async def evaluate(questions: list[tuple[int, dict]]) -> dict:
+    await reset_state(questions)
+    stubs.calls.clear()
+    results, latencies = [], []
+    by_case = defaultdict(list)
+    for user_id, question in questions:
+        start = time.perf_counter()
+        answers, suggestions = await ask(user_id, question)
+        latencies.append(time.perf_counter() - start)
+        results.append((question, answers, suggestions))
+        by_case[question["case"]].append((question, answers, suggestions))
+    latencies.sort()
+    return {
+        **score(results),
+        "by_case": {case: score(case_results) for case, case_results in by_case.items()},
+        "embed_calls": stubs.calls["embed"] / len(questions),
+        "index_queries": stubs.calls["index_query"] / len(questions),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p95_ms": latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] * 1000,
+    }
+
+
+async def main(args) -> None:
+    overrides = dict(setting.split("=", 1) for setting in args.set)
+    if args.real_embeddings:
+        import google.generativeai as genai
+
+        real_embed_content = genai.embed_content
+        overrides.setdefault("GEMINI_API_KEY", os.environ["GEMINI_API_KEY"])
+        overrides.setdefault("INDEX_DIMENSION", "3072")
+    settings = stubs.install(**overrides)
+    if args.real_embeddings:
+        from app.core import config
+
+        config.genai.embed_content = real_embed_content
+
+    dataset = json.loads(Path(args.dataset).read_text())
+
+    # Saves are not part of the measurement
+    latency = dict(stubs.LATENCY)
+    stubs.LATENCY.update({name: 0.0 for name in stubs.LATENCY})
+    questions = await load_dataset(dataset, first_user_id=1)
+    stubs.LATENCY.update(
+        {name: value * args.latency_scale for name, value in latency.items()}
+    )
+
+    grid = parse_grid(args.grid or DEFAULT_GRID)
+    names = [name for name, _ in grid]
+    widths = [len(name) + 2 for name in names]
+    header = "".join(f"{name:>{width}}" for name, width in zip(names, widths))
+    print(
+        f"{header}{'ans P':>7}{'ans R':>7}{'sugg P':>8}{'intent R':>9}"
+        f"{'embeds':>8}{'queries':>9}{'mean ms':>9}{'p95 ms':>8}"
+    )
+    rows = []
+    for values in itertools.product(*(values for _, values in grid)):
+        for name, value in zip(names, values):
+            setattr(settings, name, coerce(getattr(settings, name), value))
+        result = await evaluate(questions)
+        rows.append((values, result))
+        print(
+            "".join(f"{value:>{width}}" for value, width in zip(values, widths))
+            + f"{result['answer_precision']:>7.2f}{result['answer_recall']:>7.2f}"
+            f"{result['suggestion_precision']:>8.2f}{result['intent_recall']:>9.2f}"
+            f"{result['embed_calls']:>8.2f}{result['index_queries']:>9.2f}"
+            f"{result['mean_ms']:>9.0f}{result['p95_ms']:>8.0f}"
+        )
+
+    if args.by_case:
+        cases = Counter(question["case"] for _, question in questions)
+        for values, result in rows:
+            print(f"\n{dict(zip(names, values))}")
+            for case in cases:
+                case_result = result["by_case"][case]
+                print(
+                    f"  {case:<10}({cases[case]:>2}) answer P {case_result['answer_precision']:.2f}"
+                    f" R {case_result['answer_recall']:.2f}, suggestions P"
+                    f" {case_result['suggestion_precision']:.2f}, intent R"
+                    f" {case_result['intent_recall']:.2f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dataset", default=str(DATASET))
+    parser.add_argument("--grid", action="append", metavar="SETTING=V1,V2", help="Setting values to sweep; repeat for a grid")
+    parser.add_argument("--set", action="append", default=[], metavar="SETTING=VALUE", help="Fixed setting override")
+    parser.add_argument("--by-case", action="store_true", help="Break results down by question case")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--real-embeddings", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,338 @@
+"""
+Offline stand-ins for Gemini and Pinecone used by the benchmarks.
+
+`install()` must be called before any `app.services` module is imported. It
+selects the local vector backend and replaces the Gemini embedding,
+function-calling and chat model calls with deterministic stand-ins, so the
+real service code runs unchanged with simulated latencies and every external
+call is counted. Adding "chain", "function_call" or "embed" to OUTAGES makes
+the corresponding stand-in fail, to exercise the circuit breakers. Gemini
+cached contents are simulated in CACHES, with their expiry and size.
+"""
+
+import os
+import re
+import math
+import time
+import types
+import zlib
+import atexit
+import tempfile
+from collections import Counter
+
+from app.prompts import info_extraction, item_matching, text_formatting
+
+calls = Counter()
+
+# Simulated per-call latencies in seconds
+LATENCY = {
+    "chain": 0.60,
+    "chain_per_1k_input_tokens": 0.0,
+    "function_call": 0.50,
+    "embed": 0.25,
+    "index_query": 0.05,
+    "index_write": 0.08,
+}
+
+EMBEDDING_DIMENSION = 256
+
+# Simulated Gemini outages: any of "chain", "function_call", "embed"
+OUTAGES: set[str] = set()
+
+
+def _call(kind: str) -> None:
+    calls[kind] += 1
+    time.sleep(LATENCY[kind])
+    if kind in OUTAGES:
+        raise ConnectionError(f"Simulated {kind} outage")
+
+_PROMPT_NAMES = {
+    id(value): name
+    for module in (info_extraction, item_matching, text_formatting)
+    for name, value in vars(module).items()
+    if name.isupper()
+}
+
+_PAIR_PATTERN = re.compile(
+    r"^(?:.*?\b(?:kept|keep|put|placed|left|stored|moved)\s+)?"
+    r"(?:(?:my|the|a|an|them|it)\s+)?(?P<item>.+?)\s+"
+    r"(?:in|on|at|inside|under|into|to)\s+(?:(?:the|my|a|an)\s+)?(?P<location>.+?)$",
+    re.IGNORECASE,
+)
+
+
+def parse_pairs(text: str) -> list[tuple[str, str]]:
+    """Split a note into (item, location) pairs, keeping the last location per item."""
+    pairs = {}
+    for clause in re.split(r"\s*(?:,|\.|;|\band\b|\bthen\b|\blater\b)\s*", text):
+        match = _PAIR_PATTERN.match(clause.strip())
+        if match:
+            item = match["item"].lower().strip()
+            pairs[item] = match["location"].lower().strip()
+    return list(pairs.items())
+
+
+# Words of the question and sentence templates, which would otherwise
+# dominate the similarity of short texts
+_TEMPLATE_WORDS = re.compile(
+    r"\b(?:i|have|kept|keep|put|placed|where|is|are|what|did|my|the|a|an|in|on|at)\b"
+)
+
+
+def fake_embedding(text: str) -> list[float]:
+    """Deterministic embedding from hashed character trigrams of the content words."""
+    values = [0.0] * EMBEDDING_DIMENSION
+    content = " ".join(_TEMPLATE_WORDS.sub(" ", text.lower()).split()) or text.lower()
+    padded = f"  {content}  "
+    for i in range(len(padded) - 2):
+        values[zlib.crc32(padded[i : i + 3].encode()) % EMBEDDING_DIMENSION] += 1.0
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def _chain_response(name: str, input_data: dict) -> dict:
+    if name == "ITEM_SEPARATION":
+        pairs = parse_pairs(input_data["text"])
+        return {"sentences": [f"I have kept {i} in the {l}." for i, l in pairs]}
+    if name == "EXTRACTION_PROMPT":
+        pairs = parse_pairs(input_data["input_text"])
+        if not pairs:
+            return {"error": "No item or location found."}
+        item, location = pairs[0]
+        return {location: item}
+    if name == "STRUCTURED_EXTRACTION":
+        pairs = parse_pairs(input_data["text"])
+        if not pairs:
+            return {"error": "No item or location found."}
+        return {
+            "entries": [
+                {"item": i, "location": l, "sentence": f"I have kept {i} in the {l}."}
+                for i, l in pairs
+            ],
+            "success_message": " and ".join(f"{i} kept in {l}" for i, l in pairs),
+        }
+    if name == "AI_OUTPUT_PROMPT":
+        return {"sentence": input_data["text"]}
+    if name == "RENAME_LOCATION":
+        return {
+            "answer": input_data["input_text"].replace(
+                input_data["original_location"], input_data["modified_location"]
+            )
+        }
+    return {"answer": str(input_data)}
+
+
+def count_tokens(text: str) -> int:
+    """Rough Gemini token count: about four characters per token."""
+    return max(1, len(text) // 4)
+
+
+# Simulated Gemini cached contents: name -> expiry time, and name -> tokens
+CACHES: dict[str, float] = {}
+CACHE_TOKENS: dict[str, int] = {}
+
+
+def create_cached_content(text: str, ttl_seconds: int) -> str:
+    calls["cache_create"] += 1
+    name = f"cachedContents/stub-{len(CACHES) + 1}"
+    CACHES[name] = time.time() + ttl_seconds
+    CACHE_TOKENS[name] = count_tokens(text)
+    return name
+
+
+def delete_cached_content(name: str) -> None:
+    CACHES.pop(name, None)
+
+
+def run_chain(prompt_template, input_data, cached_content=None):
+    """
+    Answer a prompt like the chat model would. Input tokens are counted and,
+    with LATENCY["chain_per_1k_input_tokens"], add to the call latency; tokens
+    served from cached content are counted separately and add nothing.
+    """
+    from google.api_core.exceptions import NotFound
+    from app.services import cost_accounting
+    from app.services.prompt_cache import cached_messages
+
+    name = _PROMPT_NAMES.get(id(prompt_template), "UNKNOWN")
+    calls[f"chain:{name}"] += 1
+    if cached_content:
+        if CACHES.get(cached_content, 0) < time.time():
+            raise NotFound(f"Cached content {cached_content} not found")
+        messages = cached_messages(prompt_template)
+        cached_tokens = CACHE_TOKENS[cached_content]
+    else:
+        messages, cached_tokens = prompt_template, 0
+    input_tokens = count_tokens(" ".join(text for _, text in messages) + str(input_data))
+    calls["tokens:chain_cached"] += cached_tokens
+    calls["tokens:chain_input"] += input_tokens
+    time.sleep(LATENCY["chain_per_1k_input_tokens"] * input_tokens / 1000)
+    _call("chain")
+    response = _chain_response(name, input_data)
+    # Like the real chain, report prompt tokens including the cached ones
+    cost_accounting.add("gemini_input_tokens", input_tokens + cached_tokens)
+    cost_accounting.add("gemini_cached_tokens", cached_tokens)
+    cost_accounting.add("gemini_output_tokens", count_tokens(str(response)))
+    return response
+
+
+def embed_content(model, content, **kwargs):
+    _call("embed")
+    if isinstance(content, list):
+        return {"embedding": [fake_embedding(text) for text in content]}
+    return {"embedding": fake_embedding(content)}
+
+
+def _function_call(text: str, names: list[str]) -> tuple[str, dict]:
+    """Route a text to one of the declared functions with simple keyword rules."""
+    lowered = text.lower()
+    if "insert_embedding" in names:
+        if lowered.startswith(("delete", "remove", "forget")):
+            targets = re.split(r"\s*(?:,|\band\b)\s*", re.sub(r"^\w+\s+", "", lowered))
+            if re.search(r"\b(?:from|in|at)\b", lowered):
+                location = re.split(r"\b(?:from|in|at)\s+(?:the\s+|my\s+)?", lowered)[-1]
+                return "delete_memory_location", {"locations": [location.strip(" .?")]}
+            return "delete_memory_item", {"items": [t.strip(" .?") for t in targets]}
+        return "insert_embedding", {}
+    match = re.match(r"what(?:'s| is| did i keep| have i kept)?\s+(?:in|on|at)\s+(?:the\s+|my\s+)?(.+)", lowered)
+    if match:
+        return "retrieving_memory_by_location", {"locations": [match[1].strip(" .?")]}
+    item = re.sub(r"^where(?:'s| is| are| did i (?:keep|put))?\s+(?:the\s+|my\s+)?", "", lowered)
+    targets = re.split(r"\s*(?:,|\band\b)\s*", item.strip(" .?"))
+    return "retrieving_memory_by_item", {"items": [t for t in targets if t]}
+
+
+FUNCTION_DECLARATION_TOKENS = 150
+
+
+class GenerativeModel:
+    """Function-calling model that routes texts with keyword rules."""
+
+    def __init__(self, model_name: str, tools=None, **kwargs):
+        self.names = [
+            declaration.name
+            for tool in tools or []
+            for declaration in tool.function_declarations
+        ]
+
+    def generate_content(self, text: str, **kwargs):
+        _call("function_call")
+        name, args = _function_call(text, self.names)
+        function_call = types.SimpleNamespace(name=name, args=args)
+        part = types.SimpleNamespace(function_call=function_call)
+        content = types.SimpleNamespace(parts=[part])
+        usage_metadata = types.SimpleNamespace(
+            # The function declarations are part of the prompt
+            prompt_token_count=count_tokens(text) + FUNCTION_DECLARATION_TOKENS * len(self.names),
+            candidates_token_count=count_tokens(f"{name}{args}"),
+            cached_content_token_count=0,
+        )
+        return types.SimpleNamespace(
+            candidates=[types.SimpleNamespace(content=content)],
+            usage_metadata=usage_metadata,
+        )
+
+
+# Pinecone serverless read units charged for a query
+QUERY_READ_UNITS = 5
+
+
+class CountingIndex:
+    """Wraps the local index to simulate network latency and count calls."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def query(self, *args, **kwargs):
+        calls["index_query"] += 1
+        time.sleep(LATENCY["index_query"])
+        response = self.index.query(*args, **kwargs)
+        response["usage"] = types.SimpleNamespace(read_units=QUERY_READ_UNITS)
+        return response
+
+    def fetch(self, *args, **kwargs):
+        calls["index_query"] += 1
+        time.sleep(LATENCY["index_query"])
+        response = self.index.fetch(*args, **kwargs)
+        response["usage"] = types.SimpleNamespace(
+            read_units=max(1, math.ceil(len(response.vectors) / 10))
+        )
+        return response
+
+    def list_paginated(self, *args, **kwargs):
+        calls["index_query"] += 1
+        time.sleep(LATENCY["index_query"])
+        return self.index.list_paginated(*args, **kwargs)
+
+    def describe_index_stats(self, *args, **kwargs):
+        calls["index_query"] += 1
+        time.sleep(LATENCY["index_query"])
+        return self.index.describe_index_stats(*args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        calls["index_write"] += 1
+        time.sleep(LATENCY["index_write"])
+        return self.index.upsert(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        calls["index_write"] += 1
+        time.sleep(LATENCY["index_write"])
+        return self.index.update(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        calls["index_write"] += 1
+        time.sleep(LATENCY["index_write"])
+        return self.index.delete(*args, **kwargs)
+
+
+def _temporary_state_database() -> str:
+    fd, path = tempfile.mkstemp(prefix="dear_memory_state-", suffix=".db")
+    os.close(fd)
+    atexit.register(os.remove, path)
+    return f"sqlite:///{path}"
+
+
+def offline_environment(**settings_overrides) -> None:
+    """
+    Point the app settings at the local vector backend with placeholder
+    credentials, and the state database at a temporary SQLite file so runs
+    never share jobs, views or versions with each other or with the app.
+    """
+    os.environ.update(
+        {
+            "DB_USER": "offline",
+            "DB_PASSWORD": "offline",
+            "DB_HOST": "localhost",
+            "DB_PORT": "3306",
+            "DB_NAME": "offline",
+            "PINECONE_API_KEY": "offline",
+            "GEMINI_API_KEY": "offline",
+            "VECTOR_BACKEND": "local",
+            "INDEX_DIMENSION": str(EMBEDDING_DIMENSION),
+            "STATE_DATABASE_URL": _temporary_state_database(),
+        }
+    )
+    os.environ.update({key: str(value) for key, value in settings_overrides.items()})
+
+
+def install(**settings_overrides):
+    """
+    Configure the app for the local vector backend, route Gemini calls to the
+    stand-ins above and return the app settings.
+    """
+    offline_environment(**settings_overrides)
+
+    from app.core import config
+
+    config.genai.embed_content = embed_content
+    config.genai.GenerativeModel = GenerativeModel
+    config.index = CountingIndex(config.index)
+
+    from app.services import chain_creation, prompt_cache
+
+    chain_creation.run_chain = run_chain
+    chain_creation.count_chat_tokens = count_tokens
+    prompt_cache.count_tokens = count_tokens
+    prompt_cache.create_cached_content = create_cached_content
+    prompt_cache.delete_cached_content = delete_cached_content
+    return config.settings
@@ -0,0 +1,96 @@
+"""
+Measure the memory a save holds for its embeddings, with embeddings kept as
+float32 arrays (the app's representation) and as the lists of Python floats
+returned by the SDK (the previous one).
+
+Each run saves a note of SENTENCES item/location pairs for a fresh user with
+embeddings of the real index dimension. It reports the memory traced when
+the new vectors are written to the index, i.e. what the request holds while
+its chat and index calls run, the peak while the save ran, and the size of
+one embedding. The local index keeps float32 values in both runs.
+
+Run from the `ai_dear_memory` directory:
+    python -m benchmarks.vector_memory
+"""
+
+import sys
+import asyncio
+import argparse
+import tracemalloc
+
+from benchmarks import stubs
+
+stubs.EMBEDDING_DIMENSION = 3072
+settings = stubs.install(INDEX_DIMENSION=stubs.EMBEDDING_DIMENSION)
+for kind in stubs.LATENCY:
+    stubs.LATENCY[kind] = 0
+
+from app.core import config  # noqa: E402
+from app.schemas.embeddings import EmbeddingRequest  # noqa: E402
+from app.services import vectors  # noqa: E402
+from app.services.generate_embeddings import insert_embedding  # noqa: E402
+
+SENTENCES = 20
+
+
+def note(sentences: int, user_id: int) -> str:
+    return ", ".join(
+        f"I kept the item{user_id}x{i} in the place{user_id}x{i}" for i in range(sentences)
+    )
+
+
+def embedding_bytes(embedding) -> int:
+    if isinstance(embedding, list):
+        return sys.getsizeof(embedding) + sum(sys.getsizeof(v) for v in embedding)
+    return sys.getsizeof(embedding)
+
+
+async def run(representation, sentences: int, user_id: int) -> dict:
+    vectors.float32 = representation
+    embedding = representation(stubs.fake_embedding("umbrella"))
+    data = EmbeddingRequest(user_id=user_id, text=note(sentences, user_id))
+    held = []
+    index_upsert = config.index.upsert
+
+    def upsert(*args, **kwargs):
+        held.append(tracemalloc.get_traced_memory()[0])
+        return index_upsert(*args, **kwargs)
+
+    config.index.upsert = upsert
+    tracemalloc.start()
+    try:
+        response = await insert_embedding(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        config.index.upsert = index_upsert
+    saved = len(response["items"]) if isinstance(response, dict) else 0
+    return {
+        "held": held[0] if held else 0,
+        "peak": peak,
+        "embedding": embedding_bytes(embedding),
+        "saved": saved,
+    }
+
+
+async def main(args) -> None:
+    float32 = vectors.float32
+    modes = (("list[float]", lambda values: values), ("float32 array", float32))
+    # Absorb one-time allocations (lazy imports, caches) before measuring
+    await run(float32, args.sentences, user_id=1)
+    print(
+        f"{'embeddings':<16}{'saved':>7}{'held KB':>10}{'peak KB':>10}{'KB/embedding':>14}"
+    )
+    for user_id, (label, representation) in enumerate(modes, start=2):
+        result = await run(representation, args.sentences, user_id)
+        print(
+            f"{label:<16}{result['saved']:>7}{result['held'] / 1024:>10.0f}"
+            f"{result['peak'] / 1024:>10.0f}{result['embedding'] / 1024:>14.1f}"
+        )
+    vectors.float32 = float32
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sentences", type=int, default=SENTENCES)
+    asyncio.run(main(parser.parse_args()))